@@ -0,0 +1,42 @@
+"""
+Measures time of importing `vk_app` packages in fresh interpreters
+and checks that heavy dependencies are not loaded at import
+
+run with `python -m benchmarks.import_time`
+"""
+import statistics
+import subprocess
+import sys
+
+MODULES = ['vk_app', 'vk_app.models', 'vk_app.services']
+HEAVY_MODULES = ['PIL', 'sqlalchemy', 'requests', 'vk']
+REPEATS = 20
+
+CODE_TEMPLATE = '''import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(",".join(module for module in {heavy_modules} if module in sys.modules))
+'''
+
+
+def measure(module: str, repeats: int = REPEATS):
+    code = CODE_TEMPLATE.format(module=module, heavy_modules=HEAVY_MODULES)
+    durations = list()
+    loaded_heavy_modules = ''
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', code]).decode()
+        duration, loaded_heavy_modules = output.splitlines()
+        durations.append(float(duration))
+    return statistics.median(durations), loaded_heavy_modules
+
+
+def run(repeats: int = REPEATS):
+    print('{:<20} {:>12} {}'.format('module', 'median, ms', 'heavy modules loaded'))
+    for module in MODULES:
+        duration, loaded_heavy_modules = measure(module, repeats)
+        print('{:<20} {:>12.2f} {}'.format(module, duration * 1000, loaded_heavy_modules or '-'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,52 @@
+"""
+Compares building of `execute` code and JSON handling of big pages
+with formatting from scratch and standard library `json` module
+against pre-compiled script and fast JSON backend (if installed)
+
+run with `python -m benchmarks.json_handling`
+"""
+import json
+import timeit
+
+from benchmarks.parsing import get_raw_post
+from vk_app.app import VK_SCRIPT_GET_ALL, GetAllScript
+from vk_app.utils import JSON_BACKEND, dump_json, load_json
+
+REPEATS = 1000
+PAGE_SIZE = 2500
+
+
+def format_script(params: dict, offset: int) -> str:
+    params = dict(params, offset=offset)
+    return VK_SCRIPT_GET_ALL.format(method='wall.get', key='items', params=json.dumps(params),
+                                    offset=offset)
+
+
+def report(title: str, baseline_sec: float, optimized_sec: float):
+    print('{:<32} {:>10.6f} {:>10.6f} {:>8.2f}x'.format(title, baseline_sec, optimized_sec,
+                                                       baseline_sec / optimized_sec))
+
+
+def run(repeats: int = REPEATS):
+    params = dict(owner_id=-129836227, filter='owner', extended=0)
+    script = GetAllScript('wall.get', **params)
+    page = dict(count=PAGE_SIZE, offset=PAGE_SIZE,
+                items=[get_raw_post(post_id) for post_id in range(PAGE_SIZE)])
+    page_json = json.dumps(page)
+    page_bytes = page_json.encode('utf-8')
+
+    print('JSON backend: {}'.format(JSON_BACKEND))
+    print('{:<32} {:>10} {:>10} {:>9}'.format('operation', 'baseline', 'optimized', 'gain'))
+    report('script building',
+           timeit.timeit(lambda: format_script(params, 100), number=repeats * 100) / (repeats * 100),
+           timeit.timeit(lambda: script.get_code(100), number=repeats * 100) / (repeats * 100))
+    report('page encoding',
+           timeit.timeit(lambda: json.dumps(page), number=repeats // 100) / (repeats // 100),
+           timeit.timeit(lambda: dump_json(page), number=repeats // 100) / (repeats // 100))
+    report('page decoding',
+           timeit.timeit(lambda: json.loads(page_json), number=repeats // 100) / (repeats // 100),
+           timeit.timeit(lambda: load_json(page_bytes), number=repeats // 100) / (repeats // 100))
+
+
+if __name__ == '__main__':
+    run()
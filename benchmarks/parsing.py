@@ -0,0 +1,52 @@
+"""
+Measures throughput of parsing newline-delimited raw wall posts
+depending on number of worker processes
+
+run with `python -m benchmarks.parsing`
+"""
+import json
+import os
+import tempfile
+import time
+
+from vk_app.models import VKPost
+from vk_app.services.parsing import parse_dump
+
+POSTS_COUNT = 100000
+
+
+def get_raw_post(post_id: int) -> dict:
+    raw_photo = dict(id=post_id, album_id=-7, owner_id=1, text='', date=1475513276,
+                     photo_75='https://pp.vk.me/c636223/v636223248/34934/R_hAK8m0JD0.jpg',
+                     photo_604='https://pp.vk.me/c636223/v636223248/34936/gTSsz726TIo.jpg',
+                     photo_1280='https://pp.vk.me/c636223/v636223248/34938/t1lKrWNWWro.jpg')
+    raw_audio = dict(id=post_id, owner_id=1, artist='Artist', title='Title', duration=189,
+                     date=1475376942, url='https://psv4.vk.me/c4405/u729766/audios/e827863eec4b.mp3',
+                     genre_id=1)
+    return dict(id=post_id, from_id=1, owner_id=1, date=1475513354, text='Lorem ipsum ' * 20,
+                attachments=[dict(type='photo', photo=raw_photo),
+                             dict(type='audio', audio=raw_audio)],
+                comments=dict(count=0), likes=dict(count=1), reposts=dict(count=0))
+
+
+def run(posts_count: int = POSTS_COUNT):
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as dump:
+        for post_id in range(posts_count):
+            dump.write(json.dumps(get_raw_post(post_id)) + '\n')
+    try:
+        print('{:>8} {:>12} {:>10}'.format('workers', 'posts/sec', 'speedup'))
+        base_throughput = None
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            parsed_count = sum(1 for _ in parse_dump(dump.name, VKPost, workers=workers))
+            throughput = parsed_count / (time.perf_counter() - start)
+            base_throughput = base_throughput or throughput
+            print('{:>8} {:>12.0f} {:>10.2f}'.format(workers, throughput, throughput / base_throughput))
+            workers *= 2
+    finally:
+        os.remove(dump.name)
+
+
+if __name__ == '__main__':
+    run()
@@ -4,6 +4,7 @@ import click
 
 from tests.test_app import TestApp
 from tests.test_models import TestModels
+from tests.test_services import TestServices
 from tests.test_utils import TestUtils
 
 
@@ -33,5 +34,12 @@ def test_app():
     unittest.TextTestRunner(verbosity=2).run(suite)
 
 
+@test.command(name='test_services')
+def test_services():
+    """Tests services"""
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestServices)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
 if __name__ == '__main__':
     test()
@@ -3,13 +3,16 @@ from setuptools import setup, find_packages
 setup(
     name='VKApp',
     version='0.0.1',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks', 'benchmarks.*']),
     install_requires=[
         'vk==2.0.2',
         'SQLAlchemy==1.1.0',
         'click==6.6',
         'Pillow==3.4.2'
     ],
+    extras_require={
+        'fast-json': ['orjson', 'ujson']
+    },
     url='https://github.com/lycantropos/VKApp',
     license='GNU GPL',
     author='lycantropos',
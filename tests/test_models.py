@@ -1,8 +1,13 @@
+import os
+import tempfile
 import unittest
 from datetime import datetime, time
 
 from vk_app.models import (VKSticker, VKPhoto, VKAudio, VKVideo,
-                           VKDoc, VKNote, VKPoll, VKPost)
+                           VKDoc, VKNote, VKPoll, VKPost, VKMessage,
+                           VKRawAttachable, register_attachable,
+                           HashPrefixSharding, OwnerSharding, DateSharding)
+from vk_app.models.objects import ATTACHABLES_CLASSES, CONTAINERS_CLASSES, VKAttachable
 
 
 class TestModels(unittest.TestCase):
@@ -388,3 +393,86 @@ class TestModels(unittest.TestCase):
     def test_vk_post_from_raw(self):
         post = VKPost.from_raw(self.raw_post)
         self.assertEqual(post, self.post)
+
+    def test_vk_post_unsupported_attachment(self):
+        raw_link = dict(url='https://vk.com/dev', title='VK API')
+        raw_post = dict(self.raw_post, attachments=[dict(type='link', link=raw_link)])
+        post = VKPost.from_raw(raw_post)
+        link = post.attachments[0]['link']
+        self.assertIsInstance(link, VKRawAttachable)
+        self.assertDictEqual(link.content, raw_link)
+
+        other_raw_link = dict(url='https://vk.com/dev/methods', title='VK API')
+        links = [VKRawAttachable.from_raw(raw_link, 'link') for raw_link in [raw_link, other_raw_link, raw_link]]
+        self.assertNotEqual(links[0].vk_id, links[1].vk_id)
+        self.assertEqual(links[0], links[2])
+        self.assertEqual(len(set(links)), 2)
+
+    def test_register_attachable(self):
+        class VKMarketItem(VKAttachable):
+            def __init__(self, owner_id: int, object_id: int, title: str):
+                super().__init__(owner_id, object_id)
+                self.title = title
+
+            @classmethod
+            def key(cls):
+                return 'market'
+
+            @classmethod
+            def from_raw(cls, raw_vk_object: dict) -> 'VKMarketItem':
+                return cls(owner_id=raw_vk_object['owner_id'], object_id=raw_vk_object['id'],
+                           title=raw_vk_object['title'])
+
+        def unregister_attachable():
+            ATTACHABLES_CLASSES.remove(VKMarketItem)
+            for container_cls in CONTAINERS_CLASSES:
+                if container_cls.VK_ATTACHABLE_BY_KEY.get('market') is VKMarketItem:
+                    del container_cls.VK_ATTACHABLE_BY_KEY['market']
+
+        self.assertIsNone(VKPost.get_attachable_cls('market'))
+        register_attachable(VKMarketItem)
+        self.addCleanup(unregister_attachable)
+        raw_market_item = dict(owner_id=-1, id=2, title='item')
+        raw_post = dict(self.raw_post, attachments=[dict(type='market', market=raw_market_item)])
+        self.assertEqual(VKPost.from_raw(raw_post).attachments,
+                         [dict(market=VKMarketItem(owner_id=-1, object_id=2, title='item'))])
+        self.assertIsNone(VKMessage.get_attachable_cls('market'))
+
+    def test_vk_message_deep_forwards(self):
+        depth = 5000
+        raw_message = dict(user_id=1, date=1475513354, body='forwarded')
+        for _ in range(depth):
+            raw_message = dict(user_id=1, date=1475513354, body='forwarding', fwd_messages=[raw_message])
+        message = VKMessage.from_raw(dict(raw_message, id=7))
+        self.assertEqual(message.vk_id, '1_7')
+        for _ in range(depth):
+            message, = message.forwarded_messages
+        self.assertEqual(message.body, 'forwarded')
+        self.assertListEqual(message.forwarded_messages, [])
+
+    def test_get_file_content_deprecation(self):
+        with tempfile.TemporaryDirectory() as photos_dir:
+            with open(self.photo.get_file_path(photos_dir), 'wb') as photo_file:
+                photo_file.write(b'photo')
+            with self.assertWarns(DeprecationWarning):
+                self.assertEqual(self.photo.get_file_content(photos_dir), b'photo')
+
+    def test_sharding(self):
+        self.assertListEqual(self.photo.get_file_subdirs(), [])
+        try:
+            VKPhoto.SHARDING = HashPrefixSharding(levels=2, width=2)
+            subdirs = self.photo.get_file_subdirs()
+            self.assertListEqual(list(map(len, subdirs)), [2, 2])
+            self.assertEqual(self.photo.get_file_path('photos'),
+                             os.path.join('photos', *subdirs + [self.photo.get_file_name()]))
+            self.assertListEqual(self.audio.get_file_subdirs(), [])
+
+            VKPhoto.SHARDING = OwnerSharding(bucket_size=1000)
+            self.assertListEqual(VKPhoto.from_raw(dict(self.raw_photo, owner_id=-123456)).get_file_subdirs(),
+                                 ['-123', '-123456'])
+
+            VKPhoto.SHARDING = DateSharding()
+            self.assertListEqual(self.photo.get_file_subdirs(), ['2012.02'])
+            self.assertListEqual(DateSharding().get_subdirs(self.sticker), [DateSharding.UNDATED_DIR])
+        finally:
+            del VKPhoto.SHARDING
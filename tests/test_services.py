@@ -0,0 +1,1052 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from queue import Queue
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from vk.exceptions import VkAPIError
+from vk_app.app import App, GetAllScript
+from vk_app.models import HashPrefixSharding, OwnerSharding, VKPhoto, VKPost, register_attachable
+from vk_app.models.objects import ATTACHABLES_CLASSES, CONTAINERS_CLASSES, VKAttachable
+from vk_app.services.archive import ArchiveReader, ArchiveWriter, rebuild_index
+from vk_app.services.captcha import CaptchaBroker, CaptchaTimeout, QueueCaptchaSolver
+from vk_app.services.changes import CHANGED, LOOKUP_CHUNK_SIZE, NEW, UNCHANGED, ChangeDetector
+from vk_app.services import dispatching
+from vk_app.services.crawling import Crawler, CrawlTarget, JSONLinesSink
+from vk_app.services.dispatching import (BULK, INTERACTIVE, DeadlineExceeded,
+                                         RequestDispatcher, prioritized)
+from vk_app.services.executing import MAX_EXECUTE_CALLS_COUNT, execute_calls, get_call_code, is_failed_call
+from vk_app.services.history import HistoryExporter
+from vk_app.services.imaging import ImageVariant, ResizingDownloader
+from vk_app.services.jobs import CollectionJob
+from vk_app.services.loading import DownloadsStore, VerifiedDownloader
+from vk_app.services.longpoll import LongPollClient, decode_user_event
+from vk_app.services.parsing import parse_lines, merge_columns
+from vk_app.services.pipeline import Pipeline, Stage, get_items
+from vk_app.services.planning import PathPlanner
+from vk_app.services.profiling import PROFILE_ENV_VAR, PROFILER, Profiler
+from vk_app.services.resharding import Resharder
+from vk_app.services.resolving import BulkResolver
+from vk_app.services.retrying import RetryPolicy
+from vk_app.services.scheduling import Scheduler, ScheduledJob, CATCH_UP, COALESCE, SKIP
+from vk_app.services.single_flight import SingleFlight
+from vk_app.services.uploading import MAX_STALLED_CHUNKS_COUNT, ChunkedUpload, MultipartBody, UploadStalled
+from vk_app.utils import DIRECTORIES_CACHE, DirectoriesCache, RateLimiter
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server answering with `respond(method, path, query, body) -> (status, body[, headers])` function,
+    which also receives request headers if `with_headers` flag is set
+    """
+    daemon_threads = True
+
+    def __init__(self, respond, with_headers: bool = False):
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(handler):
+                url = urlparse(handler.path)
+                content_length = int(handler.headers.get('Content-Length', 0))
+                body = handler.rfile.read(content_length)
+                args = [handler.command, url.path, parse_qs(url.query), body]
+                if with_headers:
+                    args.append(handler.headers)
+                status, response, *headers = respond(*args)
+                if not isinstance(response, bytes):
+                    response = json.dumps(response).encode('utf-8')
+                handler.send_response(status)
+                handler.send_header('Content-Length', str(len(response)))
+                for name, value in (headers[0] if headers else {}).items():
+                    handler.send_header(name, value)
+                handler.end_headers()
+                if handler.command != 'HEAD':
+                    handler.wfile.write(response)
+
+            do_GET = do_POST = do_HEAD = handle_request
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def __enter__(self) -> 'StubServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+
+
+class TestServices(unittest.TestCase):
+    def setUp(self):
+        self.captcha_img = 'https://api.vk.com/captcha.php?sid=1'
+        self.captcha_key = 'abcde'
+        self.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.01)
+
+    def test_captcha_broker(self):
+        captcha_imgs_paths = list()
+
+        def solver(captcha_img_path: str) -> str:
+            captcha_imgs_paths.append(captcha_img_path)
+            return self.captcha_key
+
+        broker = CaptchaBroker(solver, workers=2)
+        with mock.patch('vk_app.services.captcha.fetch', return_value=b'captcha'):
+            captcha_keys = [broker.solve(self.captcha_img) for _ in range(2)]
+        broker.shutdown()
+        self.assertListEqual(captcha_keys, [self.captcha_key] * 2)
+        self.assertEqual(len(set(captcha_imgs_paths)), 2)
+        self.assertFalse(any(map(os.path.exists, captcha_imgs_paths)))
+        self.assertEqual(broker.metrics.solved, 2)
+
+    def test_captcha_broker_queue_solver(self):
+        solver = QueueCaptchaSolver()
+        broker = CaptchaBroker(solver, timeout=5.)
+
+        def answer():
+            captcha_img_path, future = solver.get()
+            future.set_result(self.captcha_key)
+
+        answerer = threading.Thread(target=answer)
+        answerer.start()
+        with mock.patch('vk_app.services.captcha.fetch', return_value=b'captcha'):
+            self.assertEqual(broker.solve(self.captcha_img), self.captcha_key)
+        answerer.join()
+        broker.shutdown()
+
+    def test_captcha_broker_timeout(self):
+        broker = CaptchaBroker(QueueCaptchaSolver(), timeout=0.1)
+        with mock.patch('vk_app.services.captcha.fetch', return_value=b'captcha'):
+            self.assertRaises(CaptchaTimeout, broker.solve, self.captcha_img)
+        self.assertEqual(broker.metrics.timed_out, 1)
+        broker.shutdown(wait=False)
+
+    def test_captcha_broker_abandoned_solver(self):
+        unanswered = threading.Event()
+        captcha_imgs_paths = list()
+        abandoned_contents = list()
+
+        def solver(captcha_img_path: str) -> str:
+            captcha_imgs_paths.append(captcha_img_path)
+            if len(captcha_imgs_paths) == 1:
+                # blocking solver like one asking user with `input`
+                unanswered.wait(5.)
+                with open(captcha_img_path, 'rb') as captcha_img_file:
+                    abandoned_contents.append(captcha_img_file.read())
+            return self.captcha_key
+
+        broker = CaptchaBroker(solver, timeout=0.5)
+        with mock.patch('vk_app.services.captcha.fetch', return_value=b'captcha'):
+            self.assertRaises(CaptchaTimeout, broker.solve, self.captcha_img)
+            # abandoned solver is still running, but doesn't hold the only worker
+            self.assertEqual(broker.solve(self.captcha_img), self.captcha_key)
+        unanswered.set()
+        broker.shutdown()
+        self.assertEqual(broker.metrics.timed_out, 1)
+        self.assertEqual(broker.metrics.failed, 0)
+        # abandoned solver removes image by itself
+        deadline = time.monotonic() + 5.
+        while os.path.exists(captcha_imgs_paths[0]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertListEqual(abandoned_contents, [b'captcha'])
+        self.assertFalse(any(map(os.path.exists, captcha_imgs_paths)))
+
+    def test_captcha_broker_fetch_failure(self):
+        solver = mock.Mock(return_value=self.captcha_key)
+        broker = CaptchaBroker(solver)
+        with mock.patch('vk_app.services.captcha.fetch', side_effect=ConnectionResetError()):
+            self.assertRaises(ConnectionResetError, broker.solve, self.captcha_img)
+        broker.shutdown()
+        self.assertFalse(solver.called)
+        self.assertEqual(broker.metrics.failed, 1)
+
+    def test_retry_policy(self):
+        responses = [ConnectionResetError(), VkAPIError(dict(error_code=6)), 'response']
+
+        def flaky():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(self.retry_policy.call(flaky), 'response')
+
+    def test_retry_policy_budget(self):
+        attempts = list()
+
+        def failing():
+            attempts.append(None)
+            raise ConnectionResetError()
+
+        self.assertRaises(ConnectionResetError, self.retry_policy.call, failing)
+        self.assertEqual(len(attempts), self.retry_policy.max_attempts)
+        self.assertRaises(VkAPIError, self.retry_policy.call,
+                          mock.Mock(side_effect=VkAPIError(dict(error_code=5))))
+
+    def test_retry_policy_non_transient_errors(self):
+        for error in [requests.HTTPError(response=mock.Mock(status_code=404)),
+                      FileNotFoundError(), PermissionError()]:
+            failing = mock.Mock(side_effect=error)
+            self.assertRaises(type(error), self.retry_policy.call, failing)
+            self.assertEqual(failing.call_count, 1)
+        for error in [requests.HTTPError(response=mock.Mock(status_code=503)),
+                      requests.ConnectionError(), requests.Timeout()]:
+            flaky = mock.Mock(side_effect=[error, 'response'])
+            self.assertEqual(self.retry_policy.call(flaky), 'response')
+
+    def test_collection_job_resuming(self):
+        raw_objects = [dict(id=object_id) for object_id in range(250)]
+
+        def get_objects_batch(method: str, offset: int, **params):
+            return dict(count=len(raw_objects), items=raw_objects[offset:offset + 100], offset=offset + 100)
+
+        app = mock.Mock()
+        app.get_objects_batch.side_effect = [get_objects_batch('wall.get', offset=0),
+                                             ConnectionResetError()]
+        with tempfile.TemporaryDirectory() as checkpoints_dir:
+            checkpoint_path = os.path.join(checkpoints_dir, 'wall.jsonl')
+            job = CollectionJob(app, 'wall.get', checkpoint_path, owner_id=1)
+            self.assertRaises(ConnectionResetError, job.run)
+            with open(checkpoint_path, 'a') as checkpoint:
+                checkpoint.write('{"count": 250, "ite')
+
+            app.get_objects_batch.side_effect = get_objects_batch
+            job = CollectionJob(app, 'wall.get', checkpoint_path, owner_id=1)
+            self.assertEqual(job.offset, 100)
+            self.assertEqual(job.run(), len(raw_objects))
+            self.assertListEqual(list(job.items()), raw_objects)
+
+    def test_scheduler(self):
+        calls = list()
+        with Scheduler(workers=2) as scheduler:
+            fast_job = scheduler.schedule(calls.append, 0.05, 'fast')
+            slow_job = scheduler.schedule(time.sleep, 0.05, 0.12, missed_runs_policy=COALESCE)
+            cancelled_job = scheduler.schedule(calls.append, 0.05, 'cancelled', delay_in_sec=0.1)
+            cancelled_job.cancel()
+            time.sleep(0.5)
+        self.assertGreaterEqual(calls.count('fast'), 5)
+        self.assertNotIn('cancelled', calls)
+        self.assertGreater(slow_job.missed_runs, 0)
+        self.assertLess(slow_job.runs, fast_job.runs)
+        self.assertNotIn(cancelled_job, scheduler.jobs)
+
+    def test_scheduled_job_missed_runs_policies(self):
+        last_run_time = time.monotonic() - 0.35
+        next_runs_times = dict()
+        for policy in (SKIP, COALESCE, CATCH_UP):
+            job = ScheduledJob(print, 0.1, (), {}, missed_runs_policy=policy,
+                               jitter_in_sec=0., next_run_time=last_run_time)
+            job.reschedule()
+            next_runs_times[policy] = (round(job.next_run_time - last_run_time, 6), job.missed_runs)
+        self.assertDictEqual(next_runs_times, {SKIP: (0.4, 3),
+                                               # single run is launched right away
+                                               COALESCE: (0.3, 2),
+                                               CATCH_UP: (0.1, 0)})
+
+        jittered_job = ScheduledJob(print, 0.1, (), {}, missed_runs_policy=SKIP,
+                                    jitter_in_sec=1., next_run_time=time.monotonic() - 0.5)
+        jittered_job.jitter = 1.
+        self.assertFalse(jittered_job.is_expired())
+
+    def test_long_poll_client(self):
+        raw_message = dict(id=7, user_id=1, date=1475513354, body='bot message', out=0, read_state=0)
+        responses = [dict(failed=1, ts=2),
+                     dict(ts=3, updates=[dict(type='message_new', object=raw_message),
+                                         dict(type='group_join', object=dict(user_id=1))])]
+        requested_tss = list()
+
+        def respond(method, path, query, body):
+            requested_tss.append(int(query['ts'][0]))
+            return 200, responses.pop(0)
+
+        with StubServer(respond) as server:
+            app = mock.Mock(retry_policy=self.retry_policy)
+            app.call.return_value = dict(server=server.url, key='key', ts=1)
+            client = LongPollClient(app, group_id=1, wait=1)
+            message = next(iter(client))
+            client.close()
+        self.assertEqual(message.body, raw_message['body'])
+        self.assertListEqual(requested_tss, [1, 2])
+        self.assertEqual(client.ts, 3)
+
+    def test_long_poll_client_async(self):
+        event = [4, 10, 3, 1, 1475513354, 'user message', dict(title=' ... ')]
+
+        def respond(method, path, query, body):
+            return 200, dict(ts=2, updates=[[8, -1, 0], event])
+
+        with StubServer(respond) as server:
+            app = mock.Mock(retry_policy=self.retry_policy)
+            app.call.return_value = dict(server='imv4.vk.com/im0', key='key', ts=1)
+            client = LongPollClient(app, wait=1)
+            client.update_server()
+            self.assertEqual(client.server, 'https://imv4.vk.com/im0')
+            client.server = server.url
+            message = asyncio.get_event_loop().run_until_complete(client.__anext__())
+            client.close()
+        self.assertEqual(message.object_id, 10)
+        self.assertEqual(message.owner_id, 1)
+        self.assertTrue(message.sent)
+        chat_message = decode_user_event([4, 11, 1, 2000000001, 1475513354, 'chat message', {'from': '5'}])
+        self.assertEqual(chat_message.owner_id, 5)
+        self.assertEqual(chat_message.vk_id, '5_11')
+        self.assertFalse(message.read)
+
+    def test_parse_lines(self):
+        raw_posts = [dict(id=post_id, owner_id=1, date=1475513354, text='post',
+                          likes=dict(count=post_id), reposts=dict(count=0), comments=dict(count=0))
+                     for post_id in range(10)]
+        lines = [json.dumps(raw_post) + '\n' for raw_post in raw_posts]
+        posts = list(parse_lines(lines, VKPost, workers=2, chunk_size=3))
+        self.assertListEqual(posts, list(map(VKPost.from_raw, raw_posts)))
+        columns = merge_columns(parse_lines(lines, VKPost, workers=2, chunk_size=3,
+                                            columns=['object_id', 'likes_count']))
+        self.assertListEqual(columns['likes_count'], list(range(10)))
+
+    def test_archive(self):
+        raw_posts = [dict(id=post_id, owner_id=-1, date=1475513354 - post_id, text='post',
+                          likes=dict(count=0), reposts=dict(count=0), comments=dict(count=0))
+                     for post_id in range(10)]
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive_path = os.path.join(archive_dir, 'wall.bin')
+            with ArchiveWriter(archive_path) as writer:
+                for raw_post in raw_posts:
+                    writer.append(raw_post)
+            os.remove(archive_path + '.idx')
+            rebuild_index(archive_path)
+            with ArchiveReader(archive_path) as reader:
+                self.assertEqual(len(reader), len(raw_posts))
+                self.assertDictEqual(reader.get('-1_5'), raw_posts[5])
+                self.assertIsNone(reader.get('-1_10'))
+                self.assertListEqual(list(reader.between(1475513354 - 2, 1475513354)), raw_posts[2:0:-1])
+                self.assertListEqual(list(reader.iter_models(VKPost)), list(map(VKPost.from_raw, raw_posts)))
+
+    def test_archive_torn_record(self):
+        raw_posts = [dict(id=post_id, owner_id=-1, date=1475513354 + post_id, text='пост')
+                     for post_id in range(3)]
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive_path = os.path.join(archive_dir, 'wall.bin')
+            with ArchiveWriter(archive_path) as writer:
+                writer.append(raw_posts[0])
+            # writing of the next record was interrupted
+            with open(archive_path, 'ab') as archive:
+                archive.write(b'\x00\x00\x01\x00{"id"')
+            with ArchiveWriter(archive_path) as writer:
+                for raw_post in raw_posts[1:]:
+                    writer.append(raw_post)
+            with ArchiveReader(archive_path) as reader:
+                self.assertListEqual(list(reader), raw_posts)
+                self.assertDictEqual(reader.get('-1_2'), raw_posts[2])
+
+    def test_get_all_script(self):
+        params = dict(owner_id=1, filter='owner', offset=100)
+        script = GetAllScript('wall.get', **params)
+        code = script.get_code(300)
+        params_line, offset_line = code.splitlines()[:2]
+        self.assertDictEqual(json.loads(params_line[len('var params = '):-1]),
+                             dict(owner_id=1, filter='owner', count=100))
+        self.assertEqual(offset_line, 'params.offset = 300;')
+        self.assertIn('API.wall.get(params)', code)
+
+    def test_get_all_script_unsafe_params(self):
+        params = dict(owner_id=1, q='__offset__ {offset} \u2028пост')
+        code = GetAllScript('newsfeed.search', **params).get_code(300)
+        params_line, offset_line = code.splitlines()[:2]
+        # VKScript receives escaped non-ASCII characters only
+        self.assertEqual(params_line.encode('ascii', 'replace').decode('ascii'), params_line)
+        self.assertEqual(json.loads(params_line[len('var params = '):-1])['q'], params['q'])
+        self.assertEqual(offset_line, 'params.offset = 300;')
+
+    def test_app_concurrent_calls(self):
+        calls_count = 200
+        threads_count = 8
+        lock = threading.Lock()
+        requested_paths = list()
+
+        def respond(method, path, query, body):
+            with lock:
+                requested_paths.append(path)
+            return 200, dict(response=[dict(id=len(path))])
+
+        with StubServer(respond) as server:
+            app = App(access_token='token', api_url=server.url + '/method/')
+
+            def call(_):
+                # sessions themselves are kept, since ids of collected objects may be reused
+                return app.call('users.get'), threading.get_ident(), app.api_session, app.api_session
+
+            with ThreadPoolExecutor(threads_count) as executor:
+                responses, threads_ids, api_sessions, repeated_api_sessions = zip(
+                    *executor.map(call, range(calls_count)))
+        self.assertListEqual(list(responses), [[dict(id=len('/method/users.get'))]] * calls_count)
+        self.assertEqual(len(requested_paths), calls_count)
+        self.assertTrue(all(api_session is repeated_api_session
+                            for api_session, repeated_api_session in zip(api_sessions, repeated_api_sessions)))
+        api_sessions_by_threads_ids = dict()
+        for thread_id, api_session in zip(threads_ids, api_sessions):
+            self.assertIs(api_sessions_by_threads_ids.setdefault(thread_id, api_session), api_session)
+        threads_api_sessions = list(api_sessions_by_threads_ids.values())
+        self.assertLessEqual(len(threads_api_sessions), threads_count)
+        self.assertTrue(all(api_session is not other_api_session
+                            for index, api_session in enumerate(threads_api_sessions)
+                            for other_api_session in threads_api_sessions[index + 1:]))
+
+    def test_app_single_flight(self):
+        threads_count = 8
+        requested_paths = list()
+        barrier = threading.Barrier(threads_count)
+
+        def respond(method, path, query, body):
+            requested_paths.append(path)
+            time.sleep(0.2)
+            return 200, dict(response=dict(upload_url='https://upload.vk.com'))
+
+        with StubServer(respond) as server:
+            app = App(access_token='token', api_url=server.url + '/method/',
+                      single_flight=SingleFlight())
+
+            def get_upload_server_url(_):
+                barrier.wait()
+                return app.get_upload_server_url('photos.getWallUploadServer', group_id=1)
+
+            with ThreadPoolExecutor(threads_count) as executor:
+                upload_urls = list(executor.map(get_upload_server_url, range(threads_count)))
+
+            async def get_upload_servers_urls():
+                return await asyncio.gather(*[
+                    app.get_upload_server_url_async('photos.getWallUploadServer', group_id=group_id)
+                    for group_id in ['1', 1, 1]])
+
+            async_upload_urls = asyncio.get_event_loop().run_until_complete(get_upload_servers_urls())
+        self.assertListEqual(upload_urls + async_upload_urls,
+                             ['https://upload.vk.com'] * (threads_count + 3))
+        self.assertEqual(len(requested_paths), app.single_flight.executed)
+        self.assertEqual(app.single_flight.executed + app.single_flight.collapsed, threads_count + 3)
+        self.assertGreaterEqual(app.single_flight.collapsed, 2)
+
+    def test_app_single_flight_non_idempotent_calls(self):
+        threads_count = 4
+        requested_paths = list()
+        barrier = threading.Barrier(threads_count)
+
+        def respond(method, path, query, body):
+            requested_paths.append(path)
+            time.sleep(0.1)
+            return 200, dict(response=dict(post_id=len(requested_paths)))
+
+        with StubServer(respond) as server:
+            app = App(access_token='token', api_url=server.url + '/method/',
+                      single_flight=SingleFlight())
+
+            def post(_):
+                barrier.wait()
+                return app.call('wall.post', owner_id=1, message='post')
+
+            with ThreadPoolExecutor(threads_count) as executor:
+                list(executor.map(post, range(threads_count)))
+        self.assertEqual(len(requested_paths), threads_count)
+        self.assertEqual(app.single_flight.executed + app.single_flight.collapsed, 0)
+
+    def test_request_dispatcher(self):
+        dispatcher = RequestDispatcher(calls_per_second=20)
+        dispatched = list()
+
+        def acquire(priority: int, job: str):
+            with prioritized(priority, job=job):
+                dispatcher.acquire()
+            dispatched.append(job)
+
+        bulk_threads = [threading.Thread(target=acquire, args=(BULK, job))
+                        for job in ['first', 'second'] * 3]
+        for thread in bulk_threads:
+            thread.start()
+        time.sleep(0.02)
+        acquire(INTERACTIVE, 'upload')
+        self.assertRaises(DeadlineExceeded, dispatcher.acquire, BULK, deadline=time.monotonic() + 0.01)
+        for thread in bulk_threads:
+            thread.join()
+        self.assertLessEqual(dispatched.index('upload'), 2)
+        bulk_jobs = [job for job in dispatched if job != 'upload']
+        self.assertTrue(all(job != next_job for job, next_job in zip(bulk_jobs[1:], bulk_jobs[2:])))
+        metrics = dispatcher.get_metrics()
+        self.assertEqual(metrics['interactive'].dispatched, 1)
+        self.assertEqual(metrics['bulk'].dispatched, 6)
+        self.assertEqual(metrics['bulk'].expired, 1)
+        self.assertGreater(metrics['bulk'].max_queue_time, metrics['interactive'].max_queue_time)
+
+    def test_app_priorities(self):
+        app = App(access_token='token')
+
+        def call(method: str, **params):
+            priority, job, _ = dispatching.context.current
+            return dict(upload_url='{}_{}'.format(priority, job))
+
+        async def call_async():
+            with prioritized(BULK, job='crawl'):
+                return await app.call_async('users.get')
+
+        with mock.patch.object(app, 'call', side_effect=call):
+            self.assertEqual(app.get_upload_server_url('photos.getWallUploadServer'),
+                             '{}_None'.format(INTERACTIVE))
+            loop = asyncio.new_event_loop()
+            try:
+                self.assertEqual(loop.run_until_complete(call_async()), dict(upload_url='{}_crawl'.format(BULK)))
+                self.assertEqual(loop.run_until_complete(app.get_upload_server_url_async('photos.getWallUploadServer')),
+                                 '{}_None'.format(INTERACTIVE))
+            finally:
+                loop.close()
+        self.assertIsNone(getattr(dispatching.context, 'current', None))
+
+    def test_crawler(self):
+        counts_by_owners_ids = dict((owner_id, owner_id * 10) for owner_id in range(1, 31))
+        collected_owners_ids = list()
+
+        def iterate_batches(method: str, owner_id: int, **params):
+            if owner_id == 13:
+                raise ConnectionResetError()
+            collected_owners_ids.append(owner_id)
+            count = counts_by_owners_ids[owner_id]
+            yield dict(count=count, items=[dict(id=object_id) for object_id in range(count)], offset=count)
+
+        def call(method: str, code: str):
+            self.assertEqual(method, 'execute')
+            return [counts_by_owners_ids[owner_id] if owner_id != 30 else False
+                    for owner_id in map(int, re.findall(r'"owner_id": ?(-?\d+)', code))]
+
+        apps = [mock.Mock(call=mock.Mock(side_effect=call), iterate_batches=iterate_batches)
+                for _ in range(2)]
+        targets = [CrawlTarget('wall.get', owner_id) for owner_id in counts_by_owners_ids]
+        with tempfile.TemporaryDirectory() as crawl_dir:
+            crawler = Crawler(apps, targets, JSONLinesSink(crawl_dir))
+            failures = crawler.run()
+            with open(os.path.join(crawl_dir, 'wall.get_29.jsonl')) as target_file:
+                self.assertEqual(len(target_file.readlines()), 290)
+        self.assertListEqual(sorted(target.owner_id for target in failures), [13, 30])
+        self.assertEqual([app.call.call_count for app in apps], [1, 1])
+        self.assertSetEqual(set(collected_owners_ids[:2]), {28, 29})
+        self.assertEqual(crawler.items_count, sum(range(10, 300, 10)) - 130)
+        self.assertEqual(crawler.get_progress()['wall.get_1'], 1.)
+
+    def test_crawler_probe_escaping(self):
+        app = mock.Mock(call=mock.Mock(return_value=[1]))
+        target = CrawlTarget('newsfeed.search', 1, q='\u2028пост')
+        Crawler([app], [target], mock.Mock()).probe()
+        code = app.call.call_args[1]['code']
+        # VKScript receives escaped non-ASCII characters only
+        self.assertEqual(code.encode('ascii', 'replace').decode('ascii'), code)
+        self.assertEqual(target.count, 1)
+
+    def test_bulk_resolver(self):
+        photos_vk_ids = ['1_{}'.format(photo_id) for photo_id in range(3000)]
+        codes = list()
+
+        def call(method: str, code: str):
+            codes.append(code)
+            responses = list()
+            for photos_param in re.findall(r'"photos": ?"([\d_,]+)"', code):
+                chunk = photos_param.split(',')
+                if '1_2600' in chunk:
+                    responses.append(False)
+                    continue
+                responses.append([dict(owner_id=1, id=int(vk_id.split('_')[1]))
+                                  for vk_id in chunk
+                                  if vk_id != '1_13'])
+            return responses
+
+        resolver = BulkResolver(mock.Mock(call=mock.Mock(side_effect=call)), 'photos.getById')
+        raw_photos, errors = resolver.resolve(photos_vk_ids + photos_vk_ids[:10])
+        self.assertEqual(resolver.requests_count, 2)
+        self.assertEqual(codes[0].count('API.photos.getById'), 25)
+        self.assertEqual(raw_photos['1_7'], dict(owner_id=1, id=7))
+        self.assertSetEqual(set(errors), {'1_13'} | set(photos_vk_ids[2600:2700]))
+        self.assertEqual(len(raw_photos) + len(errors), len(photos_vk_ids))
+
+    def test_execute_calls(self):
+        app = mock.Mock(call=mock.Mock(return_value=[[dict(id=1)], False]))
+        calls_codes = [get_call_code('users.get', dict(user_ids=user_id, fields='\u2028имя'))
+                       for user_id in ('1', '2')]
+        results = execute_calls(app, calls_codes)
+        code = app.call.call_args[1]['code']
+        self.assertEqual(code, 'return [{}];'.format(', '.join(calls_codes)))
+        # VKScript receives escaped non-ASCII characters only
+        self.assertEqual(code.encode('ascii', 'replace').decode('ascii'), code)
+        self.assertListEqual(list(map(is_failed_call, results)), [False, True])
+        self.assertRaises(ValueError, execute_calls, app, calls_codes * MAX_EXECUTE_CALLS_COUNT)
+
+    def test_app_streaming_upload(self):
+        file_content = os.urandom(300 * 1024)
+        uploaded_bodies = list()
+
+        def respond(method, path, query, body):
+            if path == '/upload':
+                uploaded_bodies.append(body)
+                return 200, dict(server=1, photo='[]', hash='abc')
+            return 200, dict(response=[dict(id=2, owner_id=1)])
+
+        with StubServer(respond) as server, tempfile.TemporaryDirectory() as files_dir:
+            file_path = os.path.join(files_dir, 'photo.jpg')
+            with open(file_path, 'wb') as file:
+                file.write(file_content)
+            app = App(access_token='token', api_url=server.url + '/method/')
+            with open(file_path, 'rb') as file:
+                files = [('file1', file_path), ('file2', file), ('file3', ('photo.png', b'content'))]
+                raw_photos = app.upload_files_on_vk_server('photos.saveWallPhoto', server.url + '/upload', files)
+                with MultipartBody(files, chunk_size=1000) as body:
+                    chunks = list(body)
+                    body.reset()
+                    self.assertEqual(body.read(), b''.join(chunks))
+        self.assertListEqual(raw_photos, [dict(id=2, owner_id=1)])
+        uploaded_body, = uploaded_bodies
+        self.assertEqual(len(uploaded_body), len(body))
+        self.assertEqual(uploaded_body.count(file_content), 2)
+        self.assertIn(b'filename="photo.jpg"\r\nContent-Type: image/jpeg\r\n\r\n', uploaded_body)
+        self.assertIn(b'filename="photo.png"\r\nContent-Type: image/png\r\n\r\ncontent\r\n', uploaded_body)
+        self.assertLessEqual(max(map(len, chunks)), 1000)
+
+    def test_app_chunked_video_upload(self):
+        video_content = os.urandom(250 * 1024)
+        received_chunks = dict()
+        failed_offsets = set()
+        progress = list()
+
+        def respond(method, path, query, body, headers):
+            if path == '/method/video.save':
+                return 200, dict(response=dict(upload_url=server.url + '/upload', video_id=3, owner_id=1))
+            start, end, size = map(int, re.match(r'bytes (\d+)-(\d+)/(\d+)', headers['Content-Range']).groups())
+            if start == 100 * 1024 and start not in failed_offsets:
+                failed_offsets.add(start)
+                return 500, b''
+            self.assertEqual(headers['Session-ID'], session_ids.setdefault('session_id', headers['Session-ID']))
+            received_chunks[start] = body
+            if end + 1 < size:
+                return 201, '0-{}/{}'.format(end, size).encode('ascii')
+            content = b''.join(received_chunks[offset] for offset in sorted(received_chunks))
+            return 200, dict(video_hash='abc', size=len(content), md5=hashlib.md5(content).hexdigest())
+
+        session_ids = dict()
+        with StubServer(respond, with_headers=True) as server, \
+                tempfile.TemporaryDirectory() as videos_dir:
+            video_path = os.path.join(videos_dir, 'video.mp4')
+            with open(video_path, 'wb') as video_file:
+                video_file.write(video_content)
+            app = App(access_token='token', api_url=server.url + '/method/', retry_policy=self.retry_policy)
+            video = app.upload_video(video_path, chunk_size=100 * 1024,
+                                     progress=lambda uploaded, total: progress.append((uploaded, total)),
+                                     name='video')
+        self.assertEqual(video['video_id'], 3)
+        self.assertEqual(video['video_hash'], 'abc')
+        self.assertEqual(b''.join(received_chunks[offset] for offset in sorted(received_chunks)), video_content)
+        self.assertSetEqual(failed_offsets, {100 * 1024})
+        self.assertListEqual(progress, [(100 * 1024, len(video_content)), (200 * 1024, len(video_content)),
+                                        (len(video_content), len(video_content))])
+
+    def test_chunked_upload_stalled(self):
+        chunks_count = [0]
+
+        def respond(method, path, query, body):
+            chunks_count[0] += 1
+            # server never receives the first byte
+            return 201, b'1-10/1000'
+
+        with StubServer(respond) as server, tempfile.TemporaryDirectory() as videos_dir:
+            video_path = os.path.join(videos_dir, 'video.mp4')
+            with open(video_path, 'wb') as video_file:
+                video_file.write(os.urandom(1000))
+            upload = ChunkedUpload(server.url + '/upload', video_path, chunk_size=100)
+            self.assertRaises(UploadStalled, upload.run, self.retry_policy)
+
+            empty_video_path = os.path.join(videos_dir, 'empty.mp4')
+            open(empty_video_path, 'wb').close()
+            self.assertRaises(ValueError, ChunkedUpload, server.url + '/upload', empty_video_path)
+        self.assertEqual(chunks_count[0], MAX_STALLED_CHUNKS_COUNT)
+
+    def test_path_planner(self):
+        photos = [VKPhoto(owner_id=1, object_id=photo_id, album_id=-7, album='wall', date_time=None,
+                          link='https://vk.com/photo.jpg')
+                  for photo_id in range(100)]
+        with tempfile.TemporaryDirectory() as photos_dir, \
+                mock.patch('os.makedirs', wraps=os.makedirs) as makedirs, \
+                mock.patch('vk_app.models.objects.download') as download:
+            planner = PathPlanner(photos_dir, DirectoriesCache())
+            files_paths = planner.download_all(photos)
+            self.assertListEqual(planner.download_all(photos), files_paths)
+        self.assertEqual(files_paths[2], os.path.join(photos_dir, '1_2.jpg'))
+        self.assertEqual(makedirs.call_count, 1)
+        self.assertEqual(download.call_count, 2 * len(photos))
+        self.assertEqual(len(planner.files_paths), len(photos))
+
+    def test_path_planner_existing_file(self):
+        photo = VKPhoto(owner_id=1, object_id=2, album_id=-7, album='wall', date_time=None,
+                        link='https://vk.com/photo.jpg')
+        with tempfile.TemporaryDirectory() as photos_dir, \
+                mock.patch('vk_app.models.objects.download') as download:
+            planner = PathPlanner(photos_dir, DirectoriesCache())
+            file_path = planner.get_file_path(photo)
+            open(file_path, 'wb').close()
+            planner.plan([photo])
+            with mock.patch('os.stat', wraps=os.stat) as stat:
+                self.assertEqual(planner.download(photo), file_path)
+                photo.synchronize(photos_dir)
+        self.assertEqual(stat.call_count, 2)
+        self.assertFalse(download.called)
+
+    def test_path_planner_removed_directory(self):
+        def download(url: str, save_path: str):
+            # errors are logged and skipped like by `loading.download`
+            if os.path.isdir(os.path.dirname(save_path)):
+                open(save_path, 'wb').close()
+
+        photo = VKPhoto(owner_id=1, object_id=2, album_id=-7, album='wall', date_time=None,
+                        link='https://vk.com/photo.jpg')
+        with tempfile.TemporaryDirectory() as photos_dir, \
+                mock.patch('vk_app.models.objects.download', side_effect=download):
+            directories_cache = DirectoriesCache()
+            planner = PathPlanner(os.path.join(photos_dir, 'photos'), directories_cache)
+            file_path = planner.download(photo)
+            shutil.rmtree(planner.path)
+            self.assertEqual(planner.download(photo), file_path)
+            self.assertTrue(os.path.exists(file_path))
+
+            # attachables use shared cache
+            photos = [VKPhoto(owner_id=1, object_id=photo_id, album_id=-7, album='wall', date_time=None)
+                      for photo_id in range(3, 5)]
+            old_files_paths = [os.path.join(photos_dir, photo.get_file_name()) for photo in photos]
+            for old_file_path in old_files_paths:
+                open(old_file_path, 'w').close()
+            try:
+                for photo in photos:
+                    shutil.rmtree(planner.path, ignore_errors=True)
+                    photo.synchronize(planner.path, files_paths=old_files_paths)
+                    self.assertTrue(os.path.exists(photo.get_file_path(planner.path)))
+            finally:
+                DIRECTORIES_CACHE.forget(photos_dir)
+
+    def test_resharder(self):
+        photos = [VKPhoto(owner_id=owner_id, object_id=photo_id, album_id=-7, album='wall', date_time=None)
+                  for owner_id in (1, -1)
+                  for photo_id in range(50)]
+        with tempfile.TemporaryDirectory() as photos_dir:
+            for photo in photos[:-1]:
+                open(photo.get_file_path(photos_dir), 'w').close()
+            VKPhoto.SHARDING = OwnerSharding(bucket_size=10)
+            try:
+                resharder = Resharder(photos_dir, workers=4, directories_cache=DirectoriesCache())
+                self.assertEqual(resharder.run(photos), len(photos) - 1)
+                self.assertEqual(resharder.missing, 1)
+                self.assertTrue(all(os.path.exists(photo.get_file_path(photos_dir)) for photo in photos[:-1]))
+
+                VKPhoto.SHARDING = HashPrefixSharding(levels=1)
+                self.assertEqual(resharder.run(photos), len(photos) - 1)
+                self.assertTrue(all(os.path.exists(photo.get_file_path(photos_dir)) for photo in photos[:-1]))
+                # emptied owners' directories are removed
+                self.assertFalse(os.path.exists(os.path.join(photos_dir, '0')))
+                self.assertEqual(Resharder(photos_dir).run(photos), 0)
+            finally:
+                del VKPhoto.SHARDING
+
+    def test_verified_downloader(self):
+        content = os.urandom(1000)
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        requests_methods = list()
+
+        def respond(method, path, query, body, headers):
+            requests_methods.append(method)
+            if path != '/photo.jpg':
+                return 404, b''
+            if headers.get('If-None-Match') == etag:
+                return 304, b''
+            return 200, content, {'ETag': etag}
+
+        with StubServer(respond, with_headers=True) as server, \
+                tempfile.TemporaryDirectory() as photos_dir, \
+                DownloadsStore(os.path.join(photos_dir, 'downloads.db')) as store:
+            url = server.url + '/photo.jpg'
+            file_path = os.path.join(photos_dir, 'photo.jpg')
+            downloader = VerifiedDownloader(store, self.retry_policy)
+            self.assertTrue(downloader.download(url, file_path))
+            self.assertFalse(downloader.download(url, file_path))
+            self.assertEqual(store.get(file_path).etag, etag)
+
+            # truncated file from failed run
+            with open(file_path, 'r+b') as file:
+                file.truncate(500)
+            self.assertTrue(downloader.download(url, file_path))
+            self.assertEqual(downloader.corrupted, 1)
+
+            # corrupted file of the same size is found only by checksum
+            with open(file_path, 'r+b') as file:
+                file.write(b'corrupted')
+            self.assertFalse(downloader.download(url, file_path))
+            checking_downloader = VerifiedDownloader(store, self.retry_policy, verify_checksums=True)
+            self.assertTrue(checking_downloader.download(url, file_path))
+            with open(file_path, 'rb') as file:
+                self.assertEqual(file.read(), content)
+
+            # file downloaded without store is adopted
+            store.remove(file_path)
+            requests_methods.clear()
+            self.assertFalse(downloader.download(url, file_path))
+            self.assertFalse(downloader.download(url, file_path))
+            self.assertListEqual(requests_methods, ['HEAD', 'GET'])
+            self.assertEqual(store.get(file_path).checksum, hashlib.md5(content).hexdigest())
+            self.assertListEqual(sorted(os.listdir(photos_dir)), ['downloads.db', 'photo.jpg'])
+
+            missing_downloader = VerifiedDownloader(store, RetryPolicy(max_attempts=1))
+            self.assertFalse(missing_downloader.download(server.url + '/missing.jpg',
+                                                         os.path.join(photos_dir, 'missing.jpg')))
+        self.assertEqual(downloader.fetched, 2)
+        self.assertEqual(downloader.unchanged, 4)
+
+    def test_profiler(self):
+        raw_posts = [dict(id=post_id, owner_id=1, date=1475513354, text='post',
+                          likes=dict(count=0), reposts=dict(count=0), comments=dict(count=0))
+                     for post_id in range(100)]
+
+        def respond(method, path, query, body):
+            return 200, dict(response=dict(count=len(raw_posts), items=raw_posts, offset=len(raw_posts)))
+
+        original_repr = VKPost.__repr__
+        with StubServer(respond) as server, Profiler() as profiler:
+            app = App(access_token='token', api_url=server.url + '/method/', rate_limiter=RateLimiter(1000.))
+            posts = list(map(VKPost.from_raw, app.get_all_objects('wall.get', owner_id=1)))
+            posts_reprs = list(map(repr, posts))
+        self.assertFalse(profiler.enabled)
+        # hot paths are restored
+        self.assertIs(VKPost.__repr__, original_repr)
+        repr(posts[0])
+
+        timers = dict((timer.name, timer) for timer in profiler.get_timers())
+        self.assertEqual(timers['App.call_api[execute]'].calls, 1)
+        self.assertEqual(timers['RateLimiter.acquire'].calls, 1)
+        self.assertEqual(timers['VKPost.from_raw'].calls, len(raw_posts))
+        self.assertEqual(timers['get_repr'].calls, len(posts_reprs))
+        report = profiler.get_report()
+        self.assertIn('App.call_api[execute]', report)
+
+        class VKMarketItem(VKAttachable):
+            @classmethod
+            def key(cls):
+                return 'market'
+
+            @classmethod
+            def from_raw(cls, raw_vk_object: dict) -> 'VKMarketItem':
+                return cls(owner_id=raw_vk_object['owner_id'], object_id=raw_vk_object['id'])
+
+        def unregister_attachable():
+            ATTACHABLES_CLASSES.remove(VKMarketItem)
+            for container_cls in CONTAINERS_CLASSES:
+                container_cls.VK_ATTACHABLE_BY_KEY.pop('market', None)
+
+        self.addCleanup(PROFILER.reset)
+        with PROFILER:
+            # classes registered while profiling are timed too
+            register_attachable(VKMarketItem)
+            self.addCleanup(unregister_attachable)
+            VKMarketItem.from_raw(dict(owner_id=1, id=2))
+        # hot paths are restored
+        self.assertNotIn('__wrapped__', VKMarketItem.__dict__['from_raw'].__func__.__dict__)
+        timers = dict((timer.name, timer) for timer in PROFILER.get_timers())
+        self.assertEqual(timers['VKMarketItem.from_raw'].calls, 1)
+
+        with mock.patch.dict(os.environ, {PROFILE_ENV_VAR: 'timers,tracemalloc'}), \
+                mock.patch('vk_app.app.start_profiling') as start_profiling:
+            App(access_token='token')
+            App(access_token='token', profile='')
+        start_profiling.assert_called_once_with('timers,tracemalloc')
+
+    def test_change_detector(self):
+        raw_photo = dict(id=2, album_id=-7, owner_id=1, date=1328126422, text='',
+                         photo_604='https://pp.vk.me/c10408/u4172580/-6/x_ee97448e.jpg')
+        raw_posts = [dict(id=post_id, owner_id=1, date=1475513354, text='post',
+                          attachments=[dict(type='photo', photo=raw_photo)],
+                          likes=dict(count=0), reposts=dict(count=0), comments=dict(count=0))
+                     for post_id in range(1000)]
+        recrawled_raw_posts = [dict(raw_post, likes=dict(count=10)) for raw_post in raw_posts]
+        recrawled_raw_posts[3]['text'] = 'edited post'
+        recrawled_raw_posts[4]['attachments'] = [dict(type='photo', photo=dict(raw_photo, text='photo'))]
+        recrawled_raw_posts.append(dict(raw_posts[0], id=1000))
+
+        with tempfile.TemporaryDirectory() as fingerprints_dir:
+            fingerprints_path = os.path.join(fingerprints_dir, 'fingerprints.db')
+            with ChangeDetector(fingerprints_path) as detector:
+                self.assertEqual(len(list(detector.deltas(map(VKPost.from_raw, raw_posts)))), len(raw_posts))
+            with ChangeDetector(fingerprints_path) as detector:
+                changes = list(detector.classify(map(VKPost.from_raw, recrawled_raw_posts)))
+        self.assertListEqual([(change, post.object_id) for change, post in changes if change != UNCHANGED],
+                             [(CHANGED, 3), (CHANGED, 4), (NEW, 1000)])
+        self.assertDictEqual(detector.counts, {NEW: 1, CHANGED: 2, UNCHANGED: len(raw_posts) - 2})
+
+    def test_change_detector_interrupted_consumer(self):
+        raw_posts = [dict(id=post_id, owner_id=1, date=1475513354, text='post',
+                          likes=dict(count=0), reposts=dict(count=0), comments=dict(count=0))
+                     for post_id in range(1000)]
+        stored_posts_ids = list()
+
+        def store(post: VKPost):
+            if len(stored_posts_ids) == 600:
+                raise OSError('Storage is full.')
+            stored_posts_ids.append(post.object_id)
+
+        with ChangeDetector() as detector:
+            with self.assertRaises(OSError):
+                for post in detector.deltas(map(VKPost.from_raw, raw_posts)):
+                    store(post)
+            for post in detector.deltas(map(VKPost.from_raw, raw_posts)):
+                self.assertNotIn(post.object_id, stored_posts_ids[:LOOKUP_CHUNK_SIZE])
+                break
+            # only the first chunk was fully consumed, the rest is reported again
+            new_posts_ids = [post.object_id for post in detector.deltas(map(VKPost.from_raw, raw_posts))]
+        self.assertListEqual(new_posts_ids, list(range(LOOKUP_CHUNK_SIZE, len(raw_posts))))
+
+    def test_pipeline(self):
+        batches_count = 20
+        batch_size = 50
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def iterate_batches():
+            for offset in range(0, batches_count * batch_size, batch_size):
+                with lock:
+                    in_flight[0] += batch_size
+                    in_flight[1] = max(in_flight)
+                yield dict(count=batches_count * batch_size, offset=offset + batch_size,
+                           items=[dict(id=post_id, owner_id=1, date=1475513354, text=str(post_id % 2 or ''),
+                                       likes=dict(count=0), reposts=dict(count=0), comments=dict(count=0))
+                                  for post_id in range(offset, offset + batch_size)])
+
+        def persist(post: VKPost) -> VKPost:
+            time.sleep(0.0005)
+            with lock:
+                in_flight[0] -= 1
+            return post
+
+        def drop_empty(post: VKPost):
+            if post.text:
+                return post
+            with lock:
+                in_flight[0] -= 1
+
+        stages = [Stage(get_items, expand=True),
+                  Stage(VKPost.from_raw, workers=2),
+                  Stage(drop_empty),
+                  Stage(persist)]
+        pipeline = Pipeline(iterate_batches(), stages, queue_size=2)
+        self.assertEqual(pipeline.run(), batches_count * batch_size // 2)
+        self.assertEqual(stages[1].metrics.received, batches_count * batch_size)
+        self.assertGreater(pipeline.get_metrics()['persist'].throughput, 0)
+        # only few batches are in memory at once
+        self.assertLessEqual(in_flight[1], 5 * batch_size)
+
+        failing_pipeline = Pipeline(iterate_batches(), [Stage(get_items, expand=True),
+                                                        Stage(lambda raw_post: 1 / (raw_post['id'] - 10))])
+        self.assertRaises(ZeroDivisionError, failing_pipeline.run)
+        self.assertEqual(next(iter(Pipeline(iterate_batches(), [Stage(get_items, expand=True)]))),
+                         next(iterate_batches())['items'][0])
+
+        async def enrich(post: VKPost) -> VKPost:
+            await asyncio.sleep(0)
+            return post
+
+        posts = list()
+        async_pipeline = Pipeline(iterate_batches(), [Stage(get_items, expand=True),
+                                                      Stage(VKPost.from_raw),
+                                                      Stage(enrich, workers=4)], queue_size=10)
+        count = asyncio.get_event_loop().run_until_complete(async_pipeline.run_async(posts.append))
+        self.assertEqual(count, batches_count * batch_size)
+        self.assertEqual(len(set(post.object_id for post in posts)), batches_count * batch_size)
+
+    def test_history_exporter(self):
+        raw_photo = dict(id=2, album_id=-7, owner_id=1, date=1328126422, text='',
+                         photo_604='https://pp.vk.me/c10408/u4172580/-6/x_ee97448e.jpg')
+        raw_forwarded_message = dict(user_id=2, date=1475513354, body='forwarded',
+                                     attachments=[dict(type='photo', photo=raw_photo)],
+                                     fwd_messages=[dict(user_id=3, date=1475513354, body='deep')])
+        raw_messages = [dict(id=7, user_id=1, date=1475513354, body='first',
+                             fwd_messages=[raw_forwarded_message, dict(user_id=4, date=1475513354, body='last')]),
+                        dict(id=8, user_id=1, date=1475513354, body='second')]
+        app = mock.Mock()
+        app.iterate_batches.return_value = iter([dict(count=2, items=raw_messages, offset=2)])
+        attachments_queue = Queue()
+        exporter = HistoryExporter(app, peer_id=1, attachments_queue=attachments_queue)
+        with tempfile.TemporaryDirectory() as history_dir:
+            history_path = os.path.join(history_dir, 'history.jsonl')
+            self.assertEqual(exporter.export(history_path), 5)
+            with open(history_path) as history_file:
+                rows = list(map(json.loads, history_file))
+        self.assertListEqual([(row['row_id'], row['parent_id'], row['depth'], row['body']) for row in rows],
+                             [('1_7', None, 0, 'first'),
+                              ('1_7.1', '1_7', 1, 'forwarded'),
+                              ('1_7.2', '1_7.1', 2, 'deep'),
+                              ('1_7.3', '1_7', 1, 'last'),
+                              ('1_8', None, 0, 'second')])
+        self.assertListEqual(rows[1]['attachments'], [dict(photo='1_2')])
+        self.assertEqual(attachments_queue.get_nowait().vk_id, '1_2')
+        self.assertTrue(attachments_queue.empty())
+        self.assertEqual(exporter.messages_count, 2)
+
+    def test_resizing_downloader(self):
+        from PIL import Image
+
+        image_content = BytesIO()
+        Image.new('RGB', (640, 480)).save(image_content, 'JPEG')
+
+        def respond(method, path, query, body):
+            return 200, image_content.getvalue()
+
+        variants = [ImageVariant('thumbnails', 64, 64), ImageVariant('previews', 320, 320, 'PNG')]
+        with StubServer(respond) as server, tempfile.TemporaryDirectory() as photos_dir, \
+                ResizingDownloader(variants, workers=1) as downloader:
+            photo = VKPhoto(owner_id=1, object_id=2, album_id=-7, album='wall', date_time=None,
+                            link=server.url + '/photo.jpg')
+            thumbnail_path, preview_path = downloader.submit(photo, photos_dir).result()
+            self.assertEqual(thumbnail_path, os.path.join(photos_dir, 'thumbnails', '1_2.jpg'))
+            with Image.open(thumbnail_path) as thumbnail:
+                self.assertTupleEqual(thumbnail.size, (64, 48))
+            with Image.open(preview_path) as preview:
+                self.assertTupleEqual(preview.size, (320, 240))
+            self.assertFalse(os.path.exists(photo.get_file_path(photos_dir)))
+
+    def test_resizing_downloader_broken_images(self):
+        def respond(method, path, query, body):
+            if path == '/missing.jpg':
+                return 404, b''
+            return 200, b'not an image'
+
+        variants = [ImageVariant('thumbnails', 64, 64)]
+        with StubServer(respond) as server, tempfile.TemporaryDirectory() as photos_dir, \
+                ResizingDownloader(variants, workers=1, retry_policy=self.retry_policy) as downloader:
+            photos = [VKPhoto(owner_id=1, object_id=object_id, album_id=-7, album='wall', date_time=None,
+                              link=server.url + path)
+                      for object_id, path in enumerate(['/broken.jpg', '/missing.jpg'])]
+            self.assertListEqual(downloader.download_all(photos, photos_dir), [[None], [None]])
+            self.assertListEqual([files_names for _, _, files_names in os.walk(photos_dir) if files_names], [])
+
+    def test_resizing_downloader_removed_directory(self):
+        def respond(method, path, query, body):
+            return 200, b'photo'
+
+        with StubServer(respond) as server, tempfile.TemporaryDirectory() as photos_dir, \
+                ResizingDownloader([], workers=1, keep_original=True) as downloader:
+            self.addCleanup(DIRECTORIES_CACHE.forget, photos_dir)
+            photos_dir = os.path.join(photos_dir, 'photos')
+            for object_id in range(2):
+                shutil.rmtree(photos_dir, ignore_errors=True)
+                photo = VKPhoto(owner_id=1, object_id=object_id, album_id=-7, album='wall', date_time=None,
+                                link=server.url + '/photo.jpg')
+                downloader.download(photo, photos_dir)
+                with open(photo.get_file_path(photos_dir), 'rb') as photo_file:
+                    self.assertEqual(photo_file.read(), b'photo')
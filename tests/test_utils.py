@@ -1,8 +1,15 @@
 import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from unittest import mock
 
-from vk_app.utils import get_year_month_date, find_file, check_dir, get_valid_dirs
+from vk_app.utils import (get_year_month_date, find_file, check_dir, get_valid_dirs, make_delayed,
+                          DirectoriesCache)
 
 
 class TestUtils(unittest.TestCase):
@@ -33,6 +40,47 @@ class TestUtils(unittest.TestCase):
             test_dir = os.path.join(self.file_dir, *self.valid_dirs[:len(self.valid_dirs) - ind])
             os.rmdir(test_dir)
 
+    def test_directories_cache(self):
+        directories_cache = DirectoriesCache()
+        with tempfile.TemporaryDirectory() as root, \
+                mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+            test_dir = os.path.join(root, *self.valid_dirs)
+            directories_cache.ensure(test_dir)
+            self.assertTrue(os.path.isdir(test_dir))
+            makedirs.reset_mock()
+            directories_cache.ensure(test_dir)
+            directories_cache.ensure(os.path.join(root, self.valid_dirs[0]))
+            self.assertFalse(makedirs.called)
+            self.assertIn(root, directories_cache)
+
+            directories_cache.forget(os.path.join(root, self.valid_dirs[0]))
+            self.assertNotIn(test_dir, directories_cache)
+            self.assertIn(root, directories_cache)
+
+    def test_make_delayed_concurrently(self):
+        delay_in_seconds = 0.01
+        calls_count = 20
+        calls_times = list()
+
+        @make_delayed(delay_in_seconds)
+        def delayed_call(_):
+            calls_times.append(time.monotonic())
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(delayed_call, range(calls_count)))
+        self.assertEqual(len(calls_times), calls_count)
+        # single call may be woken up late by scheduler, so only overall rate is checked
+        self.assertGreaterEqual(max(calls_times) - min(calls_times),
+                                (calls_count - 1) * delay_in_seconds * 0.9)
+
+    def test_lazy_imports(self):
+        heavy_modules = ['PIL', 'sqlalchemy', 'requests', 'vk']
+        code = ('import sys, vk_app, vk_app.models, vk_app.services\n'
+                'print(",".join(module for module in {} if module in sys.modules))'.format(heavy_modules))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(self.file_dir))
+        self.assertEqual(output.decode().strip(), '')
+
 
 if __name__ == '__main__':
     test = TestUtils()
@@ -1,27 +1,35 @@
 import json
 import os
-from functools import wraps
-from typing import List, Tuple, Callable, Any
+import threading
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
-import requests
-from vk_app.services import download
-from vk_app.utils import solve_captcha
-from vk import API, Session, AuthSession
-from vk.exceptions import VkAPIError
+from vk_app.services import CaptchaBroker, RetryPolicy, SingleFlight
+from vk_app.services.dispatching import BULK, INTERACTIVE, bind_priority, prioritized
+from vk_app.services.profiling import PROFILE_ENV_VAR, start_profiling
+from vk_app.services.retrying import DEFAULT_RETRY_POLICY
+from vk_app.services.single_flight import make_call_key
+from vk_app.utils import RateLimiter, solve_captcha, load_json
 
 
-def captchured(captcha_img_path: str = os.path.join(os.path.expanduser('~'), 'captcha.png'),
-               captcha_solver: Callable[[str], str] = solve_captcha):
+def captchured(captcha_solver: Callable[[str], Any] = solve_captcha, max_attempts: int = 5,
+               timeout: float = None, workers: int = 1, broker: CaptchaBroker = None):
     """
     Decorator with parameters for taking care of
     sending too frequent requests to VK API
     with possibility of entering CAPTCHA text
 
-    :param captcha_img_path: file path for CAPTCHA image to be stored at,
-    user's home directory by default
-    :param captcha_solver: function which receives path to CAPTCHA image and returns CAPTCHA text
+    :param captcha_solver: function which receives path to CAPTCHA image
+    and returns CAPTCHA text or `Future` object which will be resolved with it
+    :param max_attempts: maximum number of CAPTCHAs to be solved for single call
+    :param timeout: seconds to wait for CAPTCHA text, infinite by default
+    :param workers: number of CAPTCHAs of decorated function being solved simultaneously
+    :param broker: `CaptchaBroker` instance to share between decorated functions,
+    new one with given `captcha_solver`, `timeout` and `workers` is created by default
     :return: decorator
     """
+    if broker is None:
+        broker = CaptchaBroker(captcha_solver, workers=workers, timeout=timeout)
 
     def resolve_captcha(function: Callable[[Any], Any]):
         """
@@ -33,25 +41,25 @@ def captchured(captcha_img_path: str = os.path.join(os.path.expanduser('~'), 'ca
         @wraps(function)
         def resolved_captcha(*args, **kwargs):
             """
-            Runs function in infinite loop
-            until correct text CAPTCHA entered
+            Runs function until correct CAPTCHA text entered
+            or attempts are exhausted
 
             :param args: positional function arguments
             :param kwargs: keyword function arguments
-            :return: result of wrapped function or runs forever
+            :return: result of wrapped function
             """
-            while True:
+            from vk.exceptions import VkAPIError
+
+            kwargs = dict(kwargs)
+            for attempt in range(max_attempts):
                 try:
                     return function(*args, **kwargs)
                 except VkAPIError as error:
-                    if error.code == error.CAPTCHA_NEEDED:
-                        download(error.captcha_img, captcha_img_path)
-                        captcha_key = captcha_solver(captcha_img_path)
-                        os.remove(captcha_img_path)
-                        kwargs['captcha_sid'] = error.captcha_sid
-                        kwargs['captcha_key'] = captcha_key
-                    else:
+                    if error.code != error.CAPTCHA_NEEDED:
                         raise error
+                    kwargs['captcha_sid'] = error.captcha_sid
+                    kwargs['captcha_key'] = broker.solve(error.captcha_img)
+            return function(*args, **kwargs)
 
         return resolved_captcha
 
@@ -60,7 +68,9 @@ def captchured(captcha_img_path: str = os.path.join(os.path.expanduser('~'), 'ca
 
 class App:
     def __init__(self, app_id: int = 0, user_login: str = '', user_password: str = '', scope: str = '',
-                 access_token: str = '', api_version: str = '5.57'):
+                 access_token: str = '', api_version: str = '5.57',
+                 retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY, rate_limiter: RateLimiter = None,
+                 api_url: str = None, single_flight: SingleFlight = None, profile: str = None):
         """Initializes instance of our application for working with VK API.
         You have to specify authentication data for app (`app_id`) and user (`user_login`, `user_password`, `scope`)
          or `access_token` parameter.
@@ -81,7 +91,32 @@ class App:
         :param api_version: version of using VK API
 
         more info at https://vk.com/dev/versions
+        :param retry_policy: policy of retrying requests failed with transient errors
+        :param rate_limiter: limiter of API calls rate shared between threads
+        (and other `App` instances if needed)
+
+        VK API allows up to 3 requests per second for user access token,
+        `RequestDispatcher` can be passed to serve uploads before `get_all_objects` collecting
+        :param api_url: URL of VK API server to send requests to, useful for testing
+        :param single_flight: `SingleFlight` instance for collapsing concurrent identical read-only calls
+        (`get_all_objects`, `get_upload_server_url` and their asynchronous versions),
+        its `collapsed` attribute counts calls which received result of another one,
+        every call is sent separately by default
+        :param profile: comma-separated profiling modes ('timers', 'cprofile', 'tracemalloc'),
+        `VK_APP_PROFILE` environment variable value by default.
+        If set, time spent in API calls, rate limiting, parsing and file system work is measured
+        and report is written to standard error at exit (see `vk_app.services.profiling`)
+
+        `App` instance can be used from multiple threads concurrently:
+        every thread sends requests with its own HTTP session
         """
+        from vk import API, Session, AuthSession
+
+        if profile is None:
+            profile = os.environ.get(PROFILE_ENV_VAR)
+        if profile:
+            start_profiling(profile)
+
         if access_token:
             self.session = Session(access_token)
             self.access_token = access_token
@@ -93,13 +128,76 @@ class App:
             self.session = AuthSession(**self.__dict__)
             self.access_token = self.session.access_token
         self.api_version = api_version
-        self.api_session = API(self.session, v=self.api_version)
+        self.api_url = api_url
+        if api_url is not None:
+            self.session.API_URL = api_url
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.single_flight = single_flight
+        # HTTP sessions are not guaranteed to be thread-safe
+        self.local = threading.local()
+        self.local.api_session = API(self.session, v=self.api_version)
 
     def __repr__(self):
         return 'App:<app_id={self.app_id}, ' \
                'user_login={self.user_login}, ' \
                'api_version={self.api_version}>'.format(self=self)
 
+    @property
+    def api_session(self) -> 'API':
+        """Returns VK API session of the current thread"""
+        api_session = getattr(self.local, 'api_session', None)
+        if api_session is None:
+            from vk import API, Session
+
+            session = Session(self.access_token)
+            if self.api_url is not None:
+                session.API_URL = self.api_url
+            api_session = self.local.api_session = API(session, v=self.api_version)
+        return api_session
+
+    def call(self, method: str, **params):
+        """Calls VK API method retrying on transient errors
+
+        :param method: name of API method. Ex.: 'wall.get'
+
+        for the full list check https://new.vk.com/dev/methods
+        :param params: method's parameters
+        :return: response of API method
+        """
+        return self.retry_policy.call(self.call_api, method, **params)
+
+    async def call_async(self, method: str, **params):
+        """
+        Same as `call`, but runs in default executor of the current event loop
+        keeping `prioritized` context of the calling thread
+        """
+        import asyncio
+
+        return await asyncio.get_event_loop().run_in_executor(None, bind_priority(partial(self.call, method, **params)))
+
+    def collapse(self, key: Tuple[Any, ...], function: Callable[[], Any]) -> Any:
+        # only read-only calls are collapsed: arbitrary methods (like `wall.post` or `video.save`)
+        # are not idempotent, so every such call is sent separately
+        if self.single_flight is None:
+            return function()
+        return self.single_flight.call(key, function)
+
+    async def collapse_async(self, key: Tuple[Any, ...], function: Callable[[], Any]) -> Any:
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        # executor's threads don't share `prioritized` context of the calling thread
+        function = bind_priority(function)
+        if self.single_flight is None:
+            return await loop.run_in_executor(None, function)
+        return await self.single_flight.call_async(key, loop.run_in_executor, None, function)
+
+    def call_api(self, method: str, **params):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.api_session(method, **params)
+
     def get_all_objects(self, method: str, **params):
         """Returns all VK countable objects (wall posts, audios, photo albums, photos, videos, etc.)
 
@@ -113,19 +211,52 @@ class App:
         more info about `method_name` parameters at https://vk.com/dev/`method_name`
         :return:
         """
-        params['count'] = 100
-        params.setdefault('offset', 0)
+        return self.collapse(('get_all_objects',) + make_call_key(method, params),
+                             partial(self.collect_all_objects, method, **params))
 
-        key = 'items'
+    async def get_all_objects_async(self, method: str, **params):
+        """Same as `get_all_objects`, but runs in default executor of the current event loop"""
+        return await self.collapse_async(('get_all_objects',) + make_call_key(method, params),
+                                         partial(self.collect_all_objects, method, **params))
+
+    def collect_all_objects(self, method: str, **params):
         items = list()
+        with prioritized(BULK, job=make_call_key(method, params)):
+            for batch in self.iterate_batches(method, **params):
+                items += batch['items']
+        return items
+
+    def iterate_batches(self, method: str, **params) -> Iterator[Dict[str, Any]]:
+        """Yields batches of VK countable objects fetched by single `execute` call each
+
+        :param method: name of API method. Ex.: 'photos.get'
+        :param params: method's parameters (see `get_all_objects`)
+        :return: iterator over dictionaries with total `count` of objects, fetched `items`
+        and `offset` to continue collecting from
+        """
+        offset = params.pop('offset', 0)
+        script = GetAllScript(method, **params)
         while True:
-            params_json = json.dumps(params)
-            code = VK_SCRIPT_GET_ALL.format(method=method, key=key, params=params_json)
-            code_res = self.api_session.execute(code=code, **params)
-            items += code_res[key]
-            params['offset'] = code_res['offset']
-            if len(items) >= code_res['count']:
-                return items
+            batch = self.execute_batch(script, offset)
+            yield batch
+            offset = batch['offset']
+            if not batch['items'] or offset >= batch['count']:
+                return
+
+    def get_objects_batch(self, method: str, **params) -> Dict[str, Any]:
+        """Returns up to 25 pages of VK countable objects fetched by single `execute` call
+
+        :param method: name of API method. Ex.: 'photos.get'
+        :param params: method's parameters (see `get_all_objects`)
+        :return: dictionary with total `count` of objects, fetched `items`
+        and `offset` to continue collecting from
+        """
+        offset = params.pop('offset', 0)
+        return self.execute_batch(GetAllScript(method, **params), offset)
+
+    def execute_batch(self, script: 'GetAllScript', offset: int) -> Dict[str, Any]:
+        code_res = self.call('execute', code=script.get_code(offset))
+        return dict(count=code_res['count'], items=code_res[script.key], offset=code_res['offset'])
 
     def get_upload_server_url(self, method: str, **params) -> str:
         """Returns VK server URL for uploading files on it
@@ -138,12 +269,23 @@ class App:
         to get upload server URL for images to be posted on current user's wall
         :return:
         """
-        response = self.api_session.__call__(method, **params)
+        # server URL is requested as part of upload triggered by user
+        with prioritized(INTERACTIVE):
+            response = self.collapse(('get_upload_server_url',) + make_call_key(method, params),
+                                     partial(self.call, method, **params))
         upload_url = response['upload_url']
         return upload_url
 
+    async def get_upload_server_url_async(self, method: str, **params) -> str:
+        """Same as `get_upload_server_url`, but runs in default executor of the current event loop"""
+        # context can't be entered around `await`, since it is shared by all coroutines of the thread
+        with prioritized(INTERACTIVE):
+            call = bind_priority(partial(self.call, method, **params))
+        response = await self.collapse_async(('get_upload_server_url',) + make_call_key(method, params), call)
+        return response['upload_url']
+
     def upload_files_on_vk_server(self, method: str, upload_url: str,
-                                  files: List[Tuple[str, Tuple[str, bytearray]]], **params) -> List[dict]:
+                                  files: List[Tuple[str, Any]], **params) -> List[dict]:
         """Uploads files on VK servers and returns the list of raw VK objects
 
         :param method: name of API method used to save given by VK IDs objects on user/community page.
@@ -151,28 +293,84 @@ class App:
 
         for the full list check https://new.vk.com/dev/methods
         :param upload_url: upload server URL which was gotten by `get_upload_server_url` method
-        :param files: tuples of 'file' strings with index number postfix and tuples of files' names with its content
+        :param files: tuples of 'file' strings with index number postfix and files given as
+        paths, binary file objects or tuples of files' names with its content or file objects,
+        files are streamed from disk without loading them into memory
         :param params: method's parameters. Ex. for method 'audio.save':
         {}
         to get raw VK audio object with `artist` and `title` fields obtained from ID3 tags
         """
-        with requests.Session() as session:
-            response = session.post(upload_url, files=files)
-            params.update(response.json())
+        import requests
+        from vk_app.services.uploading import MultipartBody
+
+        with requests.Session() as session, MultipartBody(files) as body:
+            def post_files() -> dict:
+                body.reset()
+                response = session.post(upload_url, data=body, headers=body.headers)
+                response.raise_for_status()
+                return load_json(response.content)
+
+            params.update(self.retry_policy.call(post_files))
+
+        with prioritized(INTERACTIVE):
+            return self.call(method, **params)
+
+    def upload_video(self, file_path: str, chunk_size: int = None,
+                     progress: Callable[[int, int], Any] = None, **params) -> Dict[str, Any]:
+        """Uploads video file by chunks retrying failed ones and returns saved video info
+
+        :param file_path: path of video file
+        :param chunk_size: number of bytes sent by single request, 8 MiB by default
+        :param progress: function which receives numbers of uploaded and total bytes after every chunk
+        :param params: `video.save` parameters. Ex.:
+        {name: 'Holidays', group_id: 1}
+        to upload video into community with id 1
+
+        more info about `video.save` parameters at https://vk.com/dev/video.save
+        :return: `video.save` response updated with upload server response
+        """
+        from vk_app.services.uploading import ChunkedUpload, DEFAULT_UPLOAD_CHUNK_SIZE
 
-        return self.api_session.__call__(method, **params)
+        with prioritized(INTERACTIVE):
+            video = self.call('video.save', **params)
+        upload = ChunkedUpload(video['upload_url'], file_path, chunk_size or DEFAULT_UPLOAD_CHUNK_SIZE)
+        video.update(upload.run(self.retry_policy, progress))
+        return video
 
 
 VK_SCRIPT_GET_ALL = """var params = {params};
-var count = params.count, offset = params.offset, key = "{key}";
+params.offset = {offset};
+var count = params.count, key = "{key}";
 var res = API.{method}(params);
 var total_count = res.count, items = res[key], api_calls = 1;
 
-while (api_calls < 25 && params.offset + count <= total_count) {{
+while (api_calls < 25 && params.offset + count < total_count) {{
     params.offset = params.offset + count;
     items = items + API.{method}(params)[key];
     api_calls = api_calls + 1;
 }}
 
-return {{"count": total_count, "items": items, "offset": params.offset}};
+return {{"count": total_count, "items": items, "offset": params.offset + count}};
 """
+
+# script is split by offset beforehand, so there is no placeholder params' values could collide with
+VK_SCRIPT_GET_ALL_PREFIX, VK_SCRIPT_GET_ALL_SUFFIX = VK_SCRIPT_GET_ALL.split('{offset}')
+
+
+class GetAllScript:
+    """
+    VKScript code for collecting VK countable objects
+    formatted once for everything except offset
+    """
+
+    def __init__(self, method: str, key: str = 'items', **params):
+        params['count'] = 100
+        params.pop('offset', None)
+        self.method = method
+        self.key = key
+        # non-ASCII characters are escaped, since some of them (like U+2028) break VKScript strings
+        self.prefix = VK_SCRIPT_GET_ALL_PREFIX.format(params=json.dumps(params))
+        self.suffix = VK_SCRIPT_GET_ALL_SUFFIX.format(method=method, key=key)
+
+    def get_code(self, offset: int) -> str:
+        return self.prefix + str(offset) + self.suffix
@@ -1,2 +1,4 @@
 from .attachables import *
 from .containers import *
+from .sharding import *
+from .objects import VKRawAttachable, register_attachable, register_container
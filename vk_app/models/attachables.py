@@ -2,13 +2,14 @@ import re
 from datetime import datetime, time, timedelta
 from typing import List, Dict, Any
 
-from vk_app.models.objects import VKAttachable, VKFileAttachable
+from vk_app.models.objects import VKAttachable, VKFileAttachable, register_attachable
 from vk_app.utils import get_normalized_file_name
 
 __all__ = ['VKPage', 'VKDoc', 'VKNote', 'VKPoll', 'VKPhotoAlbum',
            'VKSticker', 'VKPhoto', 'VKAudio', 'VKVideo']
 
 
+@register_attachable
 class VKPage(VKAttachable):
     """
     Implements working with VK wiki-pages
@@ -57,6 +58,7 @@ class VKPage(VKAttachable):
         )
 
 
+@register_attachable
 class VKNote(VKAttachable):
     """
     Implements working with VK notes
@@ -92,6 +94,7 @@ class VKNote(VKAttachable):
         )
 
 
+@register_attachable
 class VKPoll(VKAttachable):
     """
     Implements working with VK polls
@@ -129,6 +132,7 @@ class VKPoll(VKAttachable):
         )
 
 
+@register_attachable
 class VKPhotoAlbum(VKAttachable):
     """
     Implements working with VK photo albums
@@ -185,6 +189,7 @@ def link_key_sort_key(link_key: str):
     return int(re.sub(r'\D', '0', link_key.split('_')[-1]))
 
 
+@register_attachable
 class VKSticker(VKFileAttachable):
     """
     Implements working with VK stickers
@@ -220,6 +225,7 @@ class VKSticker(VKFileAttachable):
         )
 
 
+@register_attachable
 class VKPhoto(VKFileAttachable):
     """
     Implements working with VK photos
@@ -315,6 +321,7 @@ SPECIAL_ALBUMS_IDS_TITLES = {
 }
 
 
+@register_attachable
 class VKAudio(VKFileAttachable):
     """
     Implements working with VK audios
@@ -398,6 +405,7 @@ AUDIO_GENRES_IDS_GENRES = {
 }
 
 
+@register_attachable
 class VKVideo(VKFileAttachable):
     """
     Implements working with VK videos
@@ -472,6 +480,7 @@ class VKVideo(VKFileAttachable):
         return 'video.save'
 
 
+@register_attachable
 class VKDoc(VKFileAttachable):
     """
     Implements working with VK documents
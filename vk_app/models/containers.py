@@ -1,23 +1,19 @@
 import datetime
 from typing import Dict, List
 
-from vk_app.models.objects import VKAttachable, VKContainer, VKFileAttachable
-from vk_app.utils import get_all_subclasses
+from vk_app.models.objects import VKAttachable, VKContainer, VKFileAttachable, register_container
 
 __all__ = ['VKPost', 'VKMessage']
 
 
+@register_container
 class VKPost(VKContainer):
     """
     Implements working with VK wall posts
 
     more info about `Post` objects at https://vk.com/dev/post
     """
-    VK_ATTACHABLE_BY_KEY = dict(
-        (inheritor.key(), inheritor)
-        for inheritor in get_all_subclasses(VKAttachable)
-        if inheritor.key() is not None
-    )
+    ATTACHABLE_BASE = VKAttachable
 
     def __init__(self, owner_id: int, object_id: int, from_id: int, created_by: int,
                  text: str, attachments: List[Dict[str, VKAttachable]],
@@ -53,22 +49,15 @@ class VKPost(VKContainer):
             comments_count=int(raw_post['comments']['count'])
         )
 
-    @classmethod
-    def get_attachable_cls(cls, type_name: str) -> VKAttachable:
-        return cls.VK_ATTACHABLE_BY_KEY[type_name]
-
 
+@register_container
 class VKMessage(VKContainer):
     """
     Implements working with VK private messages
 
     more info about `Message` objects at https://vk.com/dev/message
     """
-    VK_ATTACHABLE_BY_KEY = dict(
-        (inheritor.key(), inheritor)
-        for inheritor in get_all_subclasses(VKFileAttachable)
-        if inheritor.key() is not None
-    )
+    ATTACHABLE_BASE = VKFileAttachable
 
     def __init__(self, owner_id: int, object_id: int,
                  title: str, body: str,
@@ -92,6 +81,19 @@ class VKMessage(VKContainer):
 
     @classmethod
     def from_raw(cls, raw_message: dict) -> 'VKMessage':
+        message = cls.from_raw_without_forwarded(raw_message)
+        # forwarded messages chains may be deeper than recursion limit
+        raw_messages_stack = [(message, raw_message)]
+        while raw_messages_stack:
+            parent_message, raw_parent_message = raw_messages_stack.pop()
+            for raw_forwarded_message in raw_parent_message.get('fwd_messages', []):
+                forwarded_message = cls.from_raw_without_forwarded(raw_forwarded_message)
+                parent_message.forwarded_messages.append(forwarded_message)
+                raw_messages_stack.append((forwarded_message, raw_forwarded_message))
+        return message
+
+    @classmethod
+    def from_raw_without_forwarded(cls, raw_message: dict) -> 'VKMessage':
         # forwarded message only has `user_id`, `date`, `body` and/or `attachments`
         return cls(
             # for an incoming message, the user ID of the author
@@ -106,9 +108,5 @@ class VKMessage(VKContainer):
             read=raw_message.get('read_state', 0) == 1,
             deleted=raw_message.get('deleted', 0) == 1,
             emojied=raw_message.get('emoji', 0) == 1,
-            forwarded_messages=list(map(cls.from_raw, raw_message.get('fwd_messages', [])))
+            forwarded_messages=[]
         )
-
-    @classmethod
-    def get_attachable_cls(cls, type_name: str) -> VKAttachable:
-        return cls.VK_ATTACHABLE_BY_KEY[type_name]
@@ -1,14 +1,35 @@
+import hashlib
+import json
 import logging
 import os
 import shutil
-from typing import List, Dict, Any
+import warnings
+from functools import partial
+from typing import Any, Dict, List, Optional
 
+from vk_app.models.sharding import Sharding, NO_SHARDING
 from vk_app.services import download
-from vk_app.utils import get_repr, obj_to_dict, find_file, check_dir
+from vk_app.services.loading import VerifiedDownloader
+from vk_app.services.profiling import PROFILER
+from vk_app.utils import get_repr, obj_to_dict, find_file, DIRECTORIES_CACHE
 
 VK_ID_FORMAT = '{owner_id}_{object_id}'
 
 
+def load_link(link: str, file_path: str, downloader: VerifiedDownloader = None) -> bool:
+    """
+    Downloads file with given downloader, otherwise only missing file is downloaded,
+    returns whether file was found in place without downloading
+    """
+    if downloader is not None:
+        downloader.download(link, file_path)
+        return False
+    if os.path.exists(file_path):
+        return True
+    download(link, file_path)
+    return False
+
+
 class VKObject:
     """
     Abstract class for working with VK data types
@@ -70,6 +91,8 @@ class VKFileAttachable(VKAttachable):
 
     more info about `Media Attachments` at https://vk.com/dev/attachments_w
     """
+    # scheme of spreading files across subdirectories, all files are in the same directory by default
+    SHARDING = NO_SHARDING  # type: Sharding
 
     def __init__(self, owner_id: int, object_id: int, link: str = None):
         super().__init__(owner_id, object_id)
@@ -80,40 +103,51 @@ class VKFileAttachable(VKAttachable):
     def __ne__(self, other):
         return not self == other
 
-    def synchronize(self, path: str, files_paths=None):
-        file_name = self.get_file_name()
-        if files_paths is not None:
-            old_file_path = next((file_path
-                                  for file_path in files_paths
-                                  if file_name in file_path),
-                                 None)
-        else:
-            old_file_path = find_file(file_name, path)
-        if old_file_path is not None:
-            file_subdirs = self.get_file_subdirs()
-            check_dir(path, *file_subdirs, create=True)
-
-            file_dir = os.path.join(path, *file_subdirs)
-            file_path = os.path.join(file_dir, file_name)
-
-            shutil.move(old_file_path, file_path)
-        else:
-            self.download(path)
-
-    def download(self, path: str, **kwargs) -> str:
-        """Downloads `VKFileAttachable` object into file system"""
-        file_subdirs = self.get_file_subdirs()
-        check_dir(path, *file_subdirs, create=True)
-
-        file_dir = os.path.join(path, *file_subdirs)
+    def synchronize(self, path: str, files_paths=None, downloader: VerifiedDownloader = None):
         file_name = self.get_file_name()
+        file_dir = self.get_file_dir(path)
         file_path = os.path.join(file_dir, file_name)
+        # file which is already in place doesn't need to be searched for
+        file_exists = os.path.exists(file_path)
+        if not file_exists:
+            if files_paths is not None:
+                old_file_path = next((file_path
+                                      for file_path in files_paths
+                                      if file_name in file_path),
+                                     None)
+            else:
+                old_file_path = find_file(file_name, path)
+            if old_file_path is not None:
+                # `shutil.move` returns destination path, so moved file is not checked again
+                DIRECTORIES_CACHE.write(file_path, partial(shutil.move, old_file_path))
+                file_exists = True
+        if downloader is not None or not file_exists:
+            self.download(path, downloader=downloader)
+
+    def download(self, path: str, downloader: VerifiedDownloader = None, **kwargs) -> str:
+        """
+        Downloads `VKFileAttachable` object into file system
 
-        if self.link and not os.path.exists(file_path):
-            download(self.link, file_path)
+        :param path: directory of files
+        :param downloader: downloader verifying existing file, otherwise existing file is trusted
+        """
+        file_path = os.path.join(self.get_file_dir(path), self.get_file_name())
+        if self.link:
+            DIRECTORIES_CACHE.write(file_path, partial(load_link, self.link, downloader=downloader))
+        else:
+            DIRECTORIES_CACHE.ensure(os.path.dirname(file_path))
         return file_path
 
-    def get_file_content(self, path: str, **kwargs) -> bytearray:
+    def get_file_content(self, path: str, **kwargs) -> bytes:
+        """
+        Reads the whole file into memory
+
+        deprecated: for uploading pass `get_file_path` result
+        to `App.upload_files_on_vk_server` instead, so file is streamed from disk
+        """
+        warnings.warn('`get_file_content` loads the whole file into memory and is deprecated, '
+                      'pass `get_file_path` result to `App.upload_files_on_vk_server` instead.',
+                      DeprecationWarning, stacklevel=2)
         file_path = self.get_file_path(path, **kwargs)
         with open(file_path, 'rb') as file:
             file_content = file.read()
@@ -121,16 +155,17 @@ class VKFileAttachable(VKAttachable):
         return file_content
 
     def get_file_path(self, path: str, **kwargs) -> str:
-        file_name = self.get_file_name(**kwargs)
-        file_subdirs = self.get_file_subdirs()
-        file_path = os.path.join(path, *file_subdirs, file_name)
-        return file_path
+        return os.path.join(self.get_file_dir(path), self.get_file_name(**kwargs))
+
+    def get_file_dir(self, path: str) -> str:
+        return os.path.join(path, *self.get_file_subdirs())
 
     def get_file_subdirs(self) -> List[str]:
         """
         Returns list of subdirectories names for file to be located at
+        according to `SHARDING` scheme
         """
-        return []
+        return self.SHARDING.get_subdirs(self)
 
     def get_file_name(self, **kwargs) -> str:
         """Must be overridden by inheritors"""
@@ -174,6 +209,9 @@ class VKContainer(VKObject):
     https://vk.com/dev/post
     https://vk.com/dev/message
     """
+    # base class of attachables which can be found in container
+    ATTACHABLE_BASE = VKAttachable
+    VK_ATTACHABLE_BY_KEY = dict()
 
     def __init__(self, owner_id: int, object_id: int,
                  attachments: List[Dict[str, VKAttachable]]):
@@ -200,14 +238,93 @@ class VKContainer(VKObject):
             content = raw_attachment[type_name]
             if (not required_keys or type_name in required_keys) and \
                     (not forbidden_keys or type_name not in forbidden_keys):
+                attachable_cls = cls.get_attachable_cls(type_name)
+                if attachable_cls is None:
+                    if type_name not in UNSUPPORTED_TYPES_NAMES:
+                        UNSUPPORTED_TYPES_NAMES.add(type_name)
+                        logging.info('No support found for attachment type: "{}", '
+                                     'keeping raw content'.format(type_name))
+                    attachments.append({type_name: VKRawAttachable.from_raw(content, type_name)})
+                    continue
                 try:
-                    attachments.append(
-                        {type_name: cls.get_attachable_cls(type_name).from_raw(content)}
-                    )
+                    attachments.append({type_name: attachable_cls.from_raw(content)})
                 except KeyError:
-                    logging.warning('No support found for attachment type: "{}"'.format(type_name))
+                    logging.warning('Invalid "{}" attachment: {}'.format(type_name, content))
         return attachments
 
     @classmethod
-    def get_attachable_cls(cls, type_name: str) -> VKAttachable:
-        """Returns VKAttachable class by VK attachment type key"""
+    def get_attachable_cls(cls, type_name: str) -> Optional[type]:
+        """Returns VKAttachable class by VK attachment type key or `None` if it's not supported"""
+        return cls.VK_ATTACHABLE_BY_KEY.get(type_name)
+
+    @classmethod
+    def add_attachable_cls(cls, attachable_cls: type):
+        if issubclass(attachable_cls, cls.ATTACHABLE_BASE):
+            cls.VK_ATTACHABLE_BY_KEY[attachable_cls.key()] = attachable_cls
+
+
+def get_content_vk_id(type_name: str, content: Dict[str, Any]) -> str:
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return '{}_{}'.format(type_name, hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:16])
+
+
+class VKRawAttachable(VKAttachable):
+    """
+    Keeps raw content of attachments which types are not supported
+    """
+
+    def __init__(self, owner_id: int, object_id: int, type_name: str, content: Dict[str, Any]):
+        super().__init__(owner_id, object_id)
+        if owner_id is None or object_id is None:
+            # attachments like links have no identifiers, so they are told apart by content
+            self.vk_id = get_content_vk_id(type_name, content)
+
+        # info fields
+        self.type_name = type_name
+        self.content = content
+
+    @classmethod
+    def from_raw(cls, raw_vk_object: Dict[str, Any], type_name: str = None) -> 'VKRawAttachable':
+        return cls(
+            owner_id=raw_vk_object.get('owner_id'),
+            object_id=raw_vk_object.get('id'),
+            type_name=type_name,
+            content=raw_vk_object
+        )
+
+
+UNSUPPORTED_TYPES_NAMES = set()
+
+ATTACHABLES_CLASSES = list()
+CONTAINERS_CLASSES = list()
+
+
+def register_attachable(cls: type) -> type:
+    """
+    Class decorator for making `VKAttachable` inheritor
+    available for parsing in containers which support it (including third-party ones)
+
+    class is registered by its `key`, later registered class overrides former one
+    """
+    if not issubclass(cls, VKAttachable) or cls.key() is None:
+        raise ValueError('Expected `VKAttachable` inheritor with key, but found: {}'.format(cls))
+    ATTACHABLES_CLASSES.append(cls)
+    for container_cls in CONTAINERS_CLASSES:
+        container_cls.add_attachable_cls(cls)
+    PROFILER.add_model(cls)
+    return cls
+
+
+def register_container(cls: type) -> type:
+    """
+    Class decorator for making `VKContainer` inheritor
+    parse every registered attachable which is a subclass of its `ATTACHABLE_BASE`
+    """
+    if not issubclass(cls, VKContainer):
+        raise ValueError('Expected `VKContainer` inheritor, but found: {}'.format(cls))
+    cls.VK_ATTACHABLE_BY_KEY = dict()
+    CONTAINERS_CLASSES.append(cls)
+    for attachable_cls in ATTACHABLES_CLASSES:
+        cls.add_attachable_cls(attachable_cls)
+    PROFILER.add_model(cls)
+    return cls
@@ -0,0 +1,104 @@
+import hashlib
+from typing import List
+
+from vk_app.utils import get_year_month_date
+
+__all__ = ['Sharding', 'NoSharding', 'HashPrefixSharding', 'OwnerSharding', 'DateSharding',
+           'NO_SHARDING']
+
+
+class Sharding:
+    """
+    Abstract class of scheme spreading files of `VKFileAttachable` objects across subdirectories,
+    so no directory gets too many entries to be listed and searched fast
+
+    scheme is set by `SHARDING` class attribute of attachable class. Ex.:
+     VKPhoto.SHARDING = HashPrefixSharding()
+    """
+
+    def get_subdirs(self, attachable) -> List[str]:
+        """Must be overridden by inheritors"""
+
+    def __repr__(self):
+        return '{}()'.format(type(self).__name__)
+
+
+class NoSharding(Sharding):
+    """Keeps all files in the same directory"""
+
+    def get_subdirs(self, attachable) -> List[str]:
+        return []
+
+
+class HashPrefixSharding(Sharding):
+    """
+    Spreads files evenly by prefixes of their VK IDs' hashes.
+    Ex.: with 2 levels of width 2 photo '1_456239017' is located at 'a4/7c'
+    """
+
+    def __init__(self, levels: int = 2, width: int = 2):
+        """
+        :param levels: number of nested subdirectories
+        :param width: number of hexadecimal digits in subdirectory name, so there are up to 16 ** width of them
+        """
+        self.levels = levels
+        self.width = width
+
+    def __repr__(self):
+        return 'HashPrefixSharding(levels={self.levels}, ' \
+               'width={self.width})'.format(self=self)
+
+    def get_subdirs(self, attachable) -> List[str]:
+        # hash should be stable between runs, so built-in `hash` can't be used
+        digest = hashlib.md5(attachable.vk_id.encode('utf-8')).hexdigest()
+        return [digest[level * self.width:(level + 1) * self.width]
+                for level in range(self.levels)]
+
+
+class OwnerSharding(Sharding):
+    """
+    Groups files by owners, owners' directories are spread across buckets of identifiers.
+    Ex.: with bucket size 1000 photo of community -123456 is located at '-123/-123456'
+    """
+
+    def __init__(self, bucket_size: int = 1000):
+        """
+        :param bucket_size: number of consecutive owners' identifiers in single bucket
+        """
+        self.bucket_size = bucket_size
+
+    def __repr__(self):
+        return 'OwnerSharding(bucket_size={self.bucket_size})'.format(self=self)
+
+    def get_subdirs(self, attachable) -> List[str]:
+        owner_id = attachable.owner_id
+        bucket = abs(owner_id) // self.bucket_size
+        return ['-{}'.format(bucket) if owner_id < 0 else str(bucket), str(owner_id)]
+
+
+class DateSharding(Sharding):
+    """
+    Groups files by year and month of attachables' `date_time`
+    (see `get_year_month_date`). Ex.: '2016.10'
+    """
+
+    # directory of attachables without date like stickers
+    UNDATED_DIR = 'undated'
+
+    def __init__(self, sep: str = '.'):
+        """
+        :param sep: separator of year and month
+        """
+        self.sep = sep
+
+    def __repr__(self):
+        return 'DateSharding(sep={self.sep!r})'.format(self=self)
+
+    def get_subdirs(self, attachable) -> List[str]:
+        date_time = getattr(attachable, 'date_time', None)
+        if date_time is None:
+            return [self.UNDATED_DIR]
+        return [get_year_month_date(date_time, sep=self.sep)]
+
+
+NO_SHARDING = NoSharding()
@@ -1 +1,7 @@
+from .captcha import CaptchaBroker
+from .dispatching import RequestDispatcher
+from .jobs import CollectionJob, run_jobs
 from .loading import download
+from .retrying import RetryPolicy
+from .scheduling import Scheduler
+from .single_flight import SingleFlight
@@ -0,0 +1,200 @@
+import bisect
+import mmap
+import os
+import struct
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from vk_app.models.objects import VK_ID_FORMAT
+from vk_app.utils import dump_json, load_json
+
+__all__ = ['ArchiveWriter', 'ArchiveReader', 'rebuild_index']
+
+# every record is a JSON-encoded raw VK object prefixed with its length
+RECORD_HEADER = struct.Struct('>I')
+
+INDEX_EXTENSION = '.idx'
+
+
+def get_raw_vk_id(raw_vk_object: Dict[str, Any]) -> str:
+    # messages are identified by user instead of owner
+    owner_id = raw_vk_object.get('owner_id', raw_vk_object.get('user_id'))
+    return VK_ID_FORMAT.format(owner_id=owner_id, object_id=raw_vk_object.get('id'))
+
+
+def get_index_path(path: str) -> str:
+    return path + INDEX_EXTENSION
+
+
+def get_complete_records_size(path: str) -> int:
+    """Returns size of archive's complete records, the trailing one may be torn by interrupted writing"""
+    if not os.path.exists(path):
+        return 0
+    size = 0
+    with open(path, 'rb') as archive:
+        archive_size = os.fstat(archive.fileno()).st_size
+        while True:
+            header = archive.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return size
+            length, = RECORD_HEADER.unpack(header)
+            end = size + RECORD_HEADER.size + length
+            if end > archive_size:
+                return size
+            size = end
+            archive.seek(size)
+
+
+def dump_index_entry(index_entry: Dict[str, Any]) -> str:
+    return dump_json(index_entry) + '\n'
+
+
+class ArchiveWriter:
+    """
+    Appends raw VK objects to archive file with sidecar index by `vk_id` and date
+
+    index is a JSON Lines file with `vk_id`, `date`, `offset` and `length` of every record,
+    its entries are written on `flush` after records reach the disk,
+    so index never points to unwritten data
+    """
+
+    def __init__(self, path: str, vk_id_getter: Callable[[Dict[str, Any]], str] = get_raw_vk_id):
+        self.path = path
+        self.vk_id_getter = vk_id_getter
+        complete_records_size = get_complete_records_size(path)
+        self.archive = open(path, 'ab')
+        if self.archive.tell() > complete_records_size:
+            # records appended after torn one would be unreachable by scanning
+            self.archive.truncate(complete_records_size)
+            self.archive.seek(complete_records_size)
+        self.index = open(get_index_path(path), 'a', encoding='utf-8')
+        self.index_entries = list()
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, raw_vk_object: Dict[str, Any]) -> int:
+        """Writes raw VK object and returns its record offset"""
+        record = dump_json(raw_vk_object).encode('utf-8')
+        offset = self.archive.tell()
+        self.archive.write(RECORD_HEADER.pack(len(record)))
+        self.archive.write(record)
+        self.index_entries.append(dict(vk_id=self.vk_id_getter(raw_vk_object), date=raw_vk_object.get('date'),
+                                       offset=offset, length=len(record)))
+        return offset
+
+    def flush(self):
+        # index should never point to unwritten data
+        self.archive.flush()
+        os.fsync(self.archive.fileno())
+        self.index.writelines(map(dump_index_entry, self.index_entries))
+        self.index_entries = list()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.archive.close()
+        self.index.close()
+
+
+class ArchiveReader:
+    """
+    Reads raw VK objects from memory-mapped archive file on demand
+
+    lookups by `vk_id` take constant time,
+    scans decode records one by one without loading the whole archive
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.records_by_vk_id = dict()
+        dates_records_pairs = list()
+        with open(get_index_path(path), encoding='utf-8') as index:
+            for line in index:
+                index_entry = load_json(line)
+                record = index_entry['offset'], index_entry['length']
+                self.records_by_vk_id[index_entry['vk_id']] = record
+                if index_entry['date'] is not None:
+                    dates_records_pairs.append((index_entry['date'], record))
+        dates_records_pairs.sort()
+        self.dates = [date for date, _ in dates_records_pairs]
+        self.dates_records = [record for _, record in dates_records_pairs]
+
+    def __enter__(self) -> 'ArchiveReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.records_by_vk_id)
+
+    def __contains__(self, vk_id: str) -> bool:
+        return vk_id in self.records_by_vk_id
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for record in self.scan():
+            yield self.read(record)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def read(self, record: Tuple[int, int]) -> Dict[str, Any]:
+        offset, length = record
+        start = offset + RECORD_HEADER.size
+        return load_json(self.buffer[start:start + length])
+
+    def get(self, vk_id: str) -> Optional[Dict[str, Any]]:
+        record = self.records_by_vk_id.get(vk_id)
+        if record is None:
+            return None
+        return self.read(record)
+
+    def get_model(self, vk_id: str, model_cls: type):
+        raw_vk_object = self.get(vk_id)
+        if raw_vk_object is None:
+            return None
+        return model_cls.from_raw(raw_vk_object)
+
+    def between(self, start_date: int, end_date: int) -> Iterator[Dict[str, Any]]:
+        """Yields raw VK objects with `date` timestamp in [start_date, end_date) range"""
+        start = bisect.bisect_left(self.dates, start_date)
+        stop = bisect.bisect_left(self.dates, end_date)
+        for record in self.dates_records[start:stop]:
+            yield self.read(record)
+
+    def scan(self) -> Iterator[Tuple[int, int]]:
+        """Yields pairs of offset and length of records in order of writing"""
+        offset = 0
+        size = len(self.buffer)
+        while offset + RECORD_HEADER.size <= size:
+            length, = RECORD_HEADER.unpack_from(self.buffer, offset)
+            if offset + RECORD_HEADER.size + length > size:
+                # incomplete trailing record
+                return
+            yield offset, length
+            offset += RECORD_HEADER.size + length
+
+    def iter_models(self, model_cls: type) -> Iterator[Any]:
+        """Yields models (like `VKPost`, `VKMessage`) built from raw VK objects"""
+        for raw_vk_object in self:
+            yield model_cls.from_raw(raw_vk_object)
+
+
+def rebuild_index(path: str, vk_id_getter: Callable[[Dict[str, Any]], str] = get_raw_vk_id):
+    """Restores sidecar index from archive file (e.g. after interrupted writing)"""
+    index_path = get_index_path(path)
+    open(index_path, 'w').close()
+    with ArchiveReader(path) as reader, \
+            open(index_path, 'w', encoding='utf-8') as index:
+        for offset, length in reader.scan():
+            raw_vk_object = reader.read((offset, length))
+            index.write(dump_index_entry(dict(vk_id=vk_id_getter(raw_vk_object), date=raw_vk_object.get('date'),
+                                              offset=offset, length=length)))
@@ -0,0 +1,218 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from queue import Queue
+from typing import Any, Callable, Optional, Tuple
+
+from vk_app.services.loading import fetch
+from vk_app.utils import solve_captcha
+
+__all__ = ['CaptchaBroker', 'CaptchaMetrics', 'CaptchaTimeout',
+           'QueueCaptchaSolver', 'ServiceCaptchaSolver']
+
+# solver receives path to CAPTCHA image
+# and returns CAPTCHA text or `Future` object which will be resolved with it
+CaptchaSolver = Callable[[str], Any]
+
+
+class CaptchaTimeout(Exception):
+    """Raised when CAPTCHA was not solved in time"""
+
+
+def call_in_thread(function: Callable[..., Any], *args) -> Future:
+    """
+    Calls function in separate daemon thread,
+    so waiting for its result can be given up without keeping any worker busy
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = function(*args)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def get_remaining_time(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.)
+
+
+class CaptchaMetrics:
+    """
+    Thread-safe counters of CAPTCHA solving,
+    CAPTCHAs which were not solved in time are counted as timed out only
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requested = 0
+        self.solved = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.solving_time = 0.
+
+    def __repr__(self):
+        return 'CaptchaMetrics(requested={self.requested}, ' \
+               'solved={self.solved}, ' \
+               'failed={self.failed}, ' \
+               'timed_out={self.timed_out}, ' \
+               'solving_time={self.solving_time})'.format(self=self)
+
+    def increment(self, counter: str, value=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+
+class CaptchaBroker:
+    """
+    Solves CAPTCHAs in background threads,
+    so only the request which received CAPTCHA waits for its text
+    while other requests keep on going
+    """
+
+    def __init__(self, solver: CaptchaSolver = solve_captcha, workers: int = 1,
+                 timeout: float = None, captcha_dir: str = None):
+        """
+        :param solver: function which receives path to CAPTCHA image
+        and returns CAPTCHA text or `Future` object which will be resolved with it
+        :param workers: number of CAPTCHAs being solved simultaneously
+        :param timeout: seconds to wait for CAPTCHA text, infinite by default
+        :param captcha_dir: directory for CAPTCHA images to be stored at,
+        system temporary directory by default
+        """
+        self.solver = solver
+        self.timeout = timeout
+        self.captcha_dir = captcha_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.metrics = CaptchaMetrics()
+
+    def submit(self, captcha_img: str) -> Future:
+        """
+        Schedules solving of CAPTCHA located at `captcha_img` URL,
+        returned `Future` object fails with `CaptchaTimeout`
+        if CAPTCHA is not solved in `timeout` seconds since submission
+        """
+        self.metrics.increment('requested')
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        return self.executor.submit(self.solve_captcha, captcha_img, deadline)
+
+    def solve(self, captcha_img: str) -> str:
+        """Waits for the text of CAPTCHA located at `captcha_img` URL"""
+        future = self.submit(captcha_img)
+        try:
+            return future.result(self.timeout)
+        except (TimeoutError, CaptchaTimeout):
+            future.cancel()
+            self.metrics.increment('timed_out')
+            raise CaptchaTimeout('CAPTCHA {} was not solved in {} seconds.'
+                                 .format(captcha_img, self.timeout))
+
+    def solve_captcha(self, captcha_img: str, deadline: float = None) -> str:
+        if get_remaining_time(deadline) == 0.:
+            raise CaptchaTimeout('CAPTCHA {} was not solved in time.'.format(captcha_img))
+        start = time.monotonic()
+        try:
+            captcha_img_path = self.write_captcha_img(fetch(captcha_img))
+            if deadline is None:
+                captcha_key = self.run_solver(captcha_img_path)
+            else:
+                # blocking solver (like one asking user with `input`) can't be interrupted,
+                # so it is left in its own thread after deadline instead of holding worker
+                captcha_key = call_in_thread(self.run_solver, captcha_img_path).result(
+                    get_remaining_time(deadline))
+            if isinstance(captcha_key, Future):
+                captcha_key = captcha_key.result(get_remaining_time(deadline))
+        except TimeoutError:
+            raise CaptchaTimeout('CAPTCHA {} was not solved in time.'.format(captcha_img))
+        except Exception:
+            self.metrics.increment('failed')
+            logging.exception('Can\'t solve CAPTCHA {}.'.format(captcha_img))
+            raise
+        self.metrics.increment('solved')
+        self.metrics.increment('solving_time', time.monotonic() - start)
+        return captcha_key
+
+    def write_captcha_img(self, content: bytes) -> str:
+        # each CAPTCHA gets its own file, so concurrent requests don't collide
+        fd, captcha_img_path = tempfile.mkstemp(suffix='.png', prefix='captcha_',
+                                                dir=self.captcha_dir)
+        with open(fd, 'wb') as captcha_img_file:
+            captcha_img_file.write(content)
+        return captcha_img_path
+
+    def run_solver(self, captcha_img_path: str) -> Any:
+        """
+        Runs solver removing CAPTCHA image once it is not needed anymore,
+        so solver abandoned after deadline can still read it
+        """
+        try:
+            captcha_key = self.solver(captcha_img_path)
+        except BaseException:
+            os.remove(captcha_img_path)
+            raise
+        if isinstance(captcha_key, Future):
+            # image is used by consumer of `Future` object until it is resolved
+            captcha_key.add_done_callback(lambda _: os.remove(captcha_img_path))
+        else:
+            os.remove(captcha_img_path)
+        return captcha_key
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+class QueueCaptchaSolver:
+    """
+    Puts CAPTCHAs into queue for being solved elsewhere (e.g. by UI thread)
+
+    consumer gets pairs of CAPTCHA image path and `Future` object
+    which should be resolved with CAPTCHA text
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self.queue = Queue(maxsize)
+
+    def __call__(self, captcha_img_path: str) -> Future:
+        future = Future()
+        self.queue.put((captcha_img_path, future))
+        return future
+
+    def get(self, block: bool = True, timeout: float = None) -> Tuple[str, Future]:
+        return self.queue.get(block, timeout)
+
+
+class ServiceCaptchaSolver:
+    """
+    Abstract class for solving CAPTCHAs with external recognition services
+    """
+
+    def __init__(self, poll_interval: float = 5.):
+        self.poll_interval = poll_interval
+
+    def __call__(self, captcha_img_path: str) -> str:
+        task_id = self.send_captcha(captcha_img_path)
+        while True:
+            captcha_key = self.get_captcha_key(task_id)
+            if captcha_key is not None:
+                return captcha_key
+            time.sleep(self.poll_interval)
+
+    def send_captcha(self, captcha_img_path: str) -> str:
+        """Must be overridden by inheritors"""
+        raise NotImplementedError
+
+    def get_captcha_key(self, task_id: str) -> Optional[str]:
+        """Must be overridden by inheritors"""
+        raise NotImplementedError
@@ -0,0 +1,161 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Any, Iterable, Iterator, List, Tuple
+
+from vk_app.models.objects import VKObject
+
+__all__ = ['ChangeDetector', 'NEW', 'CHANGED', 'UNCHANGED', 'VOLATILE_FIELDS']
+
+# kinds of changes
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+# fields which change without object being changed:
+# counters and links to CDN servers
+VOLATILE_FIELDS = frozenset(['likes_count', 'reposts_count', 'comments_count', 'views_count',
+                             'link', 'player_link'])
+
+# 64 bits are enough to tell versions of the same object apart
+FINGERPRINT_SIZE = 8
+
+# SQLite limits number of query parameters by 999
+LOOKUP_CHUNK_SIZE = 500
+
+CREATE_TABLE_QUERY = 'CREATE TABLE IF NOT EXISTS fingerprints (' \
+                     'kind TEXT NOT NULL, ' \
+                     'vk_id TEXT NOT NULL, ' \
+                     'fingerprint BLOB NOT NULL, ' \
+                     'PRIMARY KEY (kind, vk_id))'
+LOOKUP_QUERY_FORMAT = 'SELECT vk_id, fingerprint FROM fingerprints WHERE kind = ? AND vk_id IN ({})'
+UPSERT_QUERY = 'INSERT OR REPLACE INTO fingerprints (kind, vk_id, fingerprint) VALUES (?, ?, ?)'
+
+
+def get_meaningful_value(value: Any, excluded_fields: frozenset) -> Any:
+    if isinstance(value, VKObject):
+        return dict((field, get_meaningful_value(field_value, excluded_fields))
+                    for field, field_value in value.to_dict().items()
+                    if field not in excluded_fields)
+    if isinstance(value, dict):
+        return dict((key, get_meaningful_value(item, excluded_fields))
+                    for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [get_meaningful_value(item, excluded_fields) for item in value]
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+class ChangeDetector:
+    """
+    Tells new and changed VK objects from unchanged ones seen by previous crawls
+    by compact fingerprints of their meaningful fields stored in SQLite database,
+    so only deltas can be passed to storage and download queues:
+    >>> detector = ChangeDetector('fingerprints.db')
+    >>> for post in detector.deltas(map(VKPost.from_raw, raw_posts)): ...
+    """
+
+    def __init__(self, path: str = ':memory:', excluded_fields: Iterable[str] = VOLATILE_FIELDS):
+        """
+        :param path: path of SQLite database with fingerprints, in-memory one by default
+        :param excluded_fields: names of `to_dict` fields ignored by fingerprints
+        (of nested objects like attachments too)
+        """
+        self.path = path
+        self.excluded_fields = frozenset(excluded_fields)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(CREATE_TABLE_QUERY)
+
+        # metrics
+        self.counts = dict.fromkeys([NEW, CHANGED, UNCHANGED], 0)
+
+    def __repr__(self):
+        return 'ChangeDetector(path={self.path!r}, ' \
+               'counts={self.counts})'.format(self=self)
+
+    def __enter__(self) -> 'ChangeDetector':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_fingerprint(self, vk_object: VKObject) -> bytes:
+        meaningful_value = get_meaningful_value(vk_object, self.excluded_fields)
+        serialized = json.dumps(meaningful_value, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).digest()[:FINGERPRINT_SIZE]
+
+    def classify(self, vk_objects: Iterable[VKObject]) -> Iterator[Tuple[str, VKObject]]:
+        """
+        Yields kinds of changes with objects remembering their new fingerprints,
+        objects are looked up and stored by chunks
+
+        fingerprints of chunk are stored only after consumer requested the object
+        following the chunk's last one (or the end of objects), so objects
+        should be persisted before requesting the next one:
+        if consumer fails or stops iteration, objects of unfinished chunk
+        are reported again by the next crawl
+        """
+        chunk = list()
+        for vk_object in vk_objects:
+            chunk.append(vk_object)
+            if len(chunk) == LOOKUP_CHUNK_SIZE:
+                yield from self.deliver_chunk(chunk)
+                chunk = list()
+        if chunk:
+            yield from self.deliver_chunk(chunk)
+
+    def deltas(self, vk_objects: Iterable[VKObject]) -> Iterator[VKObject]:
+        """Yields only new and changed objects"""
+        for change, vk_object in self.classify(vk_objects):
+            if change != UNCHANGED:
+                yield vk_object
+
+    def deliver_chunk(self, vk_objects: List[VKObject]) -> Iterator[Tuple[str, VKObject]]:
+        changes, updates = self.classify_chunk(vk_objects)
+        yield from changes
+        # consumer has taken all objects of chunk
+        self.store(updates)
+
+    def store(self, updates: List[Tuple[str, str, bytes]]):
+        with self.lock, self.connection:
+            self.connection.executemany(UPSERT_QUERY, updates)
+
+    def classify_chunk(self, vk_objects: List[VKObject]) -> Tuple[List[Tuple[str, VKObject]],
+                                                                  List[Tuple[str, str, bytes]]]:
+        """Returns kinds of changes with objects and new fingerprints to be stored"""
+        fingerprints = [self.get_fingerprint(vk_object) for vk_object in vk_objects]
+        with self.lock:
+            stored_fingerprints = dict()
+            for kind in set(type(vk_object).__name__ for vk_object in vk_objects):
+                vk_ids = [vk_object.vk_id for vk_object in vk_objects if type(vk_object).__name__ == kind]
+                query = LOOKUP_QUERY_FORMAT.format(', '.join('?' * len(vk_ids)))
+                stored_fingerprints.update(((kind, vk_id), bytes(fingerprint))
+                                           for vk_id, fingerprint in self.connection.execute(query,
+                                                                                            [kind] + vk_ids))
+
+            changes = list()
+            updates = list()
+            for vk_object, fingerprint in zip(vk_objects, fingerprints):
+                key = (type(vk_object).__name__, vk_object.vk_id)
+                stored_fingerprint = stored_fingerprints.get(key)
+                if stored_fingerprint is None:
+                    change = NEW
+                elif stored_fingerprint != fingerprint:
+                    change = CHANGED
+                else:
+                    change = UNCHANGED
+                if change != UNCHANGED:
+                    # the same object may occur twice in chunk
+                    stored_fingerprints[key] = fingerprint
+                    updates.append(key + (fingerprint,))
+                self.counts[change] += 1
+                changes.append((change, vk_object))
+        return changes, updates
@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, Iterable, List
+
+from vk_app.services.dispatching import BULK, prioritized
+from vk_app.services.executing import MAX_EXECUTE_CALLS_COUNT, execute_calls, get_call_code, is_failed_call
+from vk_app.utils import check_dir, dump_json
+
+__all__ = ['Crawler', 'CrawlTarget', 'JSONLinesSink']
+
+# sink receives target and batch of its raw VK objects
+Sink = Callable[['CrawlTarget', List[Dict[str, Any]]], Any]
+
+
+class CrawlTarget:
+    """VK countable objects of single owner to be collected with `App.iterate_batches`"""
+
+    def __init__(self, method: str, owner_id: int, **params):
+        """
+        :param method: name of API method. Ex.: 'wall.get'
+        :param owner_id: identifier of user or community (with minus sign)
+        :param params: other method's parameters
+        """
+        self.method = method
+        self.owner_id = owner_id
+        self.params = params
+
+        # progress fields
+        self.count = None
+        self.collected = 0
+        self.error = None
+        self.done = False
+
+    def __repr__(self):
+        return 'CrawlTarget(method={self.method!r}, ' \
+               'owner_id={self.owner_id}, ' \
+               'collected={self.collected}, ' \
+               'count={self.count})'.format(self=self)
+
+    @property
+    def name(self) -> str:
+        return '{self.method}_{self.owner_id}'.format(self=self)
+
+    def get_params(self) -> Dict[str, Any]:
+        return dict(self.params, owner_id=self.owner_id)
+
+
+class JSONLinesSink:
+    """Sink appending raw VK objects of every target to its own JSON Lines file"""
+
+    def __init__(self, path: str):
+        """
+        :param path: directory for files named after targets
+        """
+        check_dir(path)
+        self.path = path
+
+    def __call__(self, target: CrawlTarget, items: List[Dict[str, Any]]):
+        # single target is collected by single worker, so no locking is needed
+        with open(os.path.join(self.path, target.name + '.jsonl'), 'a') as target_file:
+            for item in items:
+                target_file.write(dump_json(item) + '\n')
+
+
+class Crawler:
+    """
+    Collects VK countable objects of many owners:
+    sizes targets with `count=0` probes batched via `execute`,
+    then collects them with workers spread across `App` instances (tokens)
+    starting from the largest targets and passes fetched batches to sink
+    """
+
+    def __init__(self, apps: List[Any], targets: Iterable[CrawlTarget], sink: Sink,
+                 workers_per_app: int = 1):
+        """
+        :param apps: `App` instances to send requests with, every one is expected to have its own token
+        :param targets: targets to be collected
+        :param sink: function which receives target and batch of its raw VK objects,
+        called from workers' threads
+        :param workers_per_app: number of targets collected simultaneously with single `App` instance
+        """
+        if not apps:
+            raise ValueError('No apps to crawl with.')
+
+        self.apps = apps
+        self.targets = list(targets)
+        self.sink = sink
+        self.workers_per_app = workers_per_app
+        self.queue = Queue()
+        self.lock = threading.Lock()
+
+        # metrics
+        self.items_count = 0
+        self.start_time = None
+        self.elapsed_time = 0.
+
+    def __repr__(self):
+        return 'Crawler(targets_count={targets_count}, ' \
+               'items_count={self.items_count}, ' \
+               'throughput={self.throughput:.2f}, ' \
+               'failures_count={failures_count})'.format(self=self,
+                                                         targets_count=len(self.targets),
+                                                         failures_count=len(self.get_failures()))
+
+    @property
+    def throughput(self) -> float:
+        """Returns number of collected objects per second"""
+        elapsed_time = self.elapsed_time
+        if self.start_time is not None:
+            elapsed_time = time.monotonic() - self.start_time
+        return self.items_count / elapsed_time if elapsed_time else 0.
+
+    def get_progress(self) -> Dict[str, float]:
+        """Returns fractions of collected objects by targets' names"""
+        return dict((target.name, target.collected / target.count if target.count else float(target.done))
+                    for target in self.targets)
+
+    def get_failures(self) -> List[CrawlTarget]:
+        return [target for target in self.targets if target.error is not None]
+
+    def run(self) -> List[CrawlTarget]:
+        """Collects all targets and returns failed ones"""
+        self.start_time = time.monotonic()
+        self.probe()
+        for target in sorted(self.targets, key=lambda target: target.count or 0, reverse=True):
+            if target.error is None:
+                self.queue.put(target)
+
+        workers = [threading.Thread(target=self.work, args=(app,), daemon=True)
+                   for app in self.apps
+                   for _ in range(self.workers_per_app)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.elapsed_time = time.monotonic() - self.start_time
+        self.start_time = None
+        failures = self.get_failures()
+        logging.info('Crawled {} objects of {} targets with {:.2f} objects per second, {} targets failed.'
+                     .format(self.items_count, len(self.targets), self.throughput, len(failures)))
+        return failures
+
+    def probe(self):
+        """Sets number of objects for every target spreading `execute` calls across apps"""
+        for index, start in enumerate(range(0, len(self.targets), MAX_EXECUTE_CALLS_COUNT)):
+            chunk = self.targets[start:start + MAX_EXECUTE_CALLS_COUNT]
+            app = self.apps[index % len(self.apps)]
+            calls_codes = [get_call_code(target.method, dict(target.get_params(), count=0)) + '.count'
+                           for target in chunk]
+            try:
+                with prioritized(BULK):
+                    counts = execute_calls(app, calls_codes)
+            except Exception as error:
+                logging.exception('Probing of {} targets failed.'.format(len(chunk)))
+                for target in chunk:
+                    target.error = error
+                continue
+            for target, count in zip(chunk, counts):
+                if is_failed_call(count):
+                    target.error = ValueError('Probing of {} failed.'.format(target.name))
+                else:
+                    target.count = count
+
+    def work(self, app):
+        while True:
+            try:
+                target = self.queue.get_nowait()
+            except Empty:
+                return
+            try:
+                self.collect(app, target)
+            except Exception as error:
+                target.error = error
+                logging.exception('Collecting of {} failed after {} of {} objects.'
+                                  .format(target.name, target.collected, target.count))
+
+    def collect(self, app, target: CrawlTarget):
+        with prioritized(BULK, job=target.name):
+            for batch in app.iterate_batches(target.method, **target.get_params()):
+                self.sink(target, batch['items'])
+                target.collected += len(batch['items'])
+                target.count = batch['count']
+                with self.lock:
+                    self.items_count += len(batch['items'])
+        target.done = True
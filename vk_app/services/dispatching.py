@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+__all__ = ['RequestDispatcher', 'DeadlineExceeded', 'QueueTimeMetrics', 'prioritized', 'bind_priority',
+           'INTERACTIVE', 'DEFAULT', 'BULK']
+
+# priority classes, smaller ones are served first
+INTERACTIVE = 0
+DEFAULT = 1
+BULK = 2
+
+PRIORITIES_NAMES = {INTERACTIVE: 'interactive',
+                    DEFAULT: 'default',
+                    BULK: 'bulk'}
+
+context = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Raised when request was not dispatched before its deadline"""
+
+
+@contextmanager
+def prioritized(priority: int, job: Hashable = None, deadline_in_sec: float = None) -> Iterator[None]:
+    """
+    Context manager setting priority class, job and deadline
+    of requests dispatched by the current thread within it:
+    >>> with prioritized(INTERACTIVE, deadline_in_sec=10.):
+    ...     app.upload_files_on_vk_server(...)
+
+    :param priority: priority class of requests
+    :param job: identifier of job for requests of the same class to be fairly alternated by,
+    requests of the same job are dispatched in order
+    :param deadline_in_sec: seconds from entering context for requests to be dispatched in,
+    infinite by default
+    """
+    deadline = None if deadline_in_sec is None else time.monotonic() + deadline_in_sec
+    previous = getattr(context, 'current', None)
+    context.current = (priority, job, deadline)
+    try:
+        yield
+    finally:
+        context.current = previous
+
+
+def bind_priority(function: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Returns function running within `prioritized` context of the current thread,
+    since context is thread-local it is lost by functions submitted to executors otherwise
+    """
+    current = getattr(context, 'current', None)
+
+    def bound(*args, **kwargs):
+        previous = getattr(context, 'current', None)
+        context.current = current
+        try:
+            return function(*args, **kwargs)
+        finally:
+            context.current = previous
+
+    return bound
+
+
+class Ticket:
+    def __init__(self, priority: int, job: Hashable, deadline: Optional[float]):
+        self.priority = priority
+        self.job = job
+        self.deadline = deadline
+        self.enqueue_time = time.monotonic()
+
+
+class QueueTimeMetrics:
+    """Queue time statistics of single priority class"""
+
+    def __init__(self):
+        self.dispatched = 0
+        self.expired = 0
+        self.total_queue_time = 0.
+        self.max_queue_time = 0.
+
+    def __repr__(self):
+        return 'QueueTimeMetrics(dispatched={self.dispatched}, ' \
+               'expired={self.expired}, ' \
+               'mean_queue_time={self.mean_queue_time}, ' \
+               'max_queue_time={self.max_queue_time})'.format(self=self)
+
+    @property
+    def mean_queue_time(self) -> float:
+        if not self.dispatched:
+            return 0.
+        return self.total_queue_time / self.dispatched
+
+    def update(self, queue_time: float):
+        self.dispatched += 1
+        self.total_queue_time += queue_time
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+
+
+class RequestDispatcher:
+    """
+    Thread-safe limiter of requests rate (see `RateLimiter`)
+    which dispatches waiting requests by priority classes:
+    requests of higher class are always dispatched first,
+    requests of the same class are alternated between jobs (round-robin)
+    and requests which missed their deadlines fail with `DeadlineExceeded`
+
+    priority class, job and deadline are taken from `prioritized` context of calling thread,
+    so dispatcher can be passed to `App` as `rate_limiter`
+    """
+
+    def __init__(self, calls_per_second: float):
+        if calls_per_second <= 0.:
+            raise ValueError('Non-positive calls rate: {}'.format(calls_per_second))
+
+        self.delay_in_seconds = 1. / calls_per_second
+        self.condition = threading.Condition()
+        self.next_call_time = time.monotonic()
+        # jobs' queues of tickets by priority classes in order of their turns
+        self.queues = dict((priority, OrderedDict()) for priority in PRIORITIES_NAMES)
+        self.metrics = dict((priority, QueueTimeMetrics()) for priority in PRIORITIES_NAMES)
+
+    def __repr__(self):
+        return 'RequestDispatcher(delay_in_seconds={self.delay_in_seconds}, ' \
+               'metrics={metrics})'.format(self=self, metrics=self.get_metrics())
+
+    def get_metrics(self) -> Dict[str, QueueTimeMetrics]:
+        return dict((PRIORITIES_NAMES[priority], metrics)
+                    for priority, metrics in self.metrics.items())
+
+    def acquire(self, priority: int = None, job: Hashable = None, deadline: float = None):
+        """
+        Blocks until request is dispatched
+
+        :param priority: priority class, taken from `prioritized` context by default
+        :param job: identifier of job, taken from `prioritized` context by default
+        :param deadline: `time.monotonic` value for request to be dispatched before,
+        taken from `prioritized` context by default
+        """
+        current = getattr(context, 'current', None) or (DEFAULT, None, None)
+        context_priority, context_job, context_deadline = current
+        if priority is None:
+            priority = context_priority
+        if job is None:
+            job = context_job
+        if deadline is None:
+            deadline = context_deadline
+        if priority not in self.queues:
+            raise ValueError('Unknown priority class: {}'.format(priority))
+
+        ticket = Ticket(priority, job, deadline)
+        with self.condition:
+            self.queues[priority].setdefault(job, deque()).append(ticket)
+            while True:
+                now = time.monotonic()
+                is_next = self.get_next_ticket() is ticket
+                if is_next and now >= self.next_call_time:
+                    self.dispatch(ticket, now)
+                    return
+                if deadline is not None and now >= deadline:
+                    self.remove(ticket)
+                    self.metrics[priority].expired += 1
+                    self.condition.notify_all()
+                    raise DeadlineExceeded('Request of {} job {!r} was not dispatched in time.'
+                                           .format(PRIORITIES_NAMES[priority], job))
+                timeout = self.next_call_time - now if is_next else None
+                if deadline is not None:
+                    timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                self.condition.wait(timeout)
+
+    def get_next_ticket(self) -> Optional[Ticket]:
+        for priority in sorted(self.queues):
+            jobs_queues = self.queues[priority]
+            if jobs_queues:
+                return next(iter(jobs_queues.values()))[0]
+        return None
+
+    def dispatch(self, ticket: Ticket, now: float):
+        self.remove(ticket)
+        jobs_queues = self.queues[ticket.priority]
+        if ticket.job in jobs_queues:
+            # job's turn is over until other jobs of the same class get theirs
+            jobs_queues.move_to_end(ticket.job)
+        self.next_call_time = max(self.next_call_time, now) + self.delay_in_seconds
+        self.metrics[ticket.priority].update(now - ticket.enqueue_time)
+        self.condition.notify_all()
+
+    def remove(self, ticket: Ticket):
+        jobs_queues = self.queues[ticket.priority]
+        job_queue = jobs_queues[ticket.job]
+        job_queue.remove(ticket)
+        if not job_queue:
+            del jobs_queues[ticket.job]
@@ -0,0 +1,34 @@
+import json
+from typing import Any, Dict, List
+
+__all__ = ['MAX_EXECUTE_CALLS_COUNT', 'get_call_code', 'execute_calls', 'is_failed_call']
+
+# VK API allows up to 25 API calls in single `execute` call
+MAX_EXECUTE_CALLS_COUNT = 25
+
+VK_SCRIPT_EXECUTE = 'return [{calls}];'
+VK_SCRIPT_CALL = 'API.{method}({params})'
+
+
+def get_call_code(method: str, params: Dict[str, Any]) -> str:
+    """Returns VKScript expression calling API method. Ex.: 'API.users.get({"user_ids": "1"})'"""
+    # non-ASCII characters are escaped, since some of them (like U+2028) break VKScript strings
+    return VK_SCRIPT_CALL.format(method=method, params=json.dumps(params))
+
+
+def execute_calls(app, calls_codes: List[str]) -> List[Any]:
+    """
+    Packs up to `MAX_EXECUTE_CALLS_COUNT` calls into single `execute` call
+    and returns their results in the same order
+
+    :param app: `App` instance to send request with
+    :param calls_codes: VKScript expressions. Ex.: `get_call_code` results
+    """
+    if len(calls_codes) > MAX_EXECUTE_CALLS_COUNT:
+        raise ValueError('Too many calls for single `execute` call: {}'.format(len(calls_codes)))
+    return app.call('execute', code=VK_SCRIPT_EXECUTE.format(calls=', '.join(calls_codes)))
+
+
+def is_failed_call(result: Any) -> bool:
+    # failed calls inside `execute` return `false`
+    return result is False or result is None
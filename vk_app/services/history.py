@@ -0,0 +1,140 @@
+import calendar
+import logging
+from queue import Queue
+from typing import Any, Dict, Iterator, Optional
+
+from vk_app.models import VKMessage
+from vk_app.models.objects import VKFileAttachable
+from vk_app.utils import dump_json
+
+__all__ = ['HistoryRow', 'HistoryExporter']
+
+# forwarded messages have no identifiers of their own,
+# so they are numbered in order of appearance within their top-level message
+FORWARDED_ROW_ID_FORMAT = '{message_id}.{index}'
+
+
+class HistoryRow:
+    """
+    Flat record of private message history:
+    top-level message or message forwarded by another one (its parent)
+    """
+
+    def __init__(self, row_id: str, parent_id: Optional[str], depth: int, message: VKMessage):
+        """
+        :param row_id: VK ID of top-level message or it with ordinal number of forwarded one
+        :param parent_id: identifier of row with forwarding message, `None` for top-level messages
+        :param depth: number of forwards between row and its top-level message
+        :param message: message without forwarded messages
+        """
+        self.row_id = row_id
+        self.parent_id = parent_id
+        self.depth = depth
+        self.message = message
+
+    def __repr__(self):
+        return 'HistoryRow(row_id={self.row_id!r}, ' \
+               'parent_id={self.parent_id!r}, ' \
+               'depth={self.depth})'.format(self=self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        message = self.message
+        return dict(
+            row_id=self.row_id,
+            parent_id=self.parent_id,
+            depth=self.depth,
+            owner_id=message.owner_id,
+            object_id=message.object_id,
+            title=message.title,
+            body=message.body,
+            attachments=[dict((type_name, attachable.vk_id)
+                              for type_name, attachable in attachment.items())
+                         for attachment in message.attachments],
+            date=calendar.timegm(message.date_time.utctimetuple()),
+            sent=message.sent,
+            read=message.read,
+            deleted=message.deleted,
+            emojied=message.emojied
+        )
+
+
+class HistoryExporter:
+    """
+    Streams private messages history of conversation (`messages.getHistory`)
+    as flat rows with forwarded messages following their parents,
+    so only single batch of raw messages is kept in memory
+
+    downloadable attachments are put into queue as soon as they are found:
+    >>> attachments_queue = Queue(maxsize=100)
+    >>> exporter = HistoryExporter(app, peer_id=1, attachments_queue=attachments_queue)
+    >>> threading.Thread(target=exporter.export, args=('history.jsonl',)).start()
+    >>> attachable = attachments_queue.get()
+    """
+
+    def __init__(self, app, peer_id: int, attachments_queue: Queue = None, **params):
+        """
+        :param app: `App` instance to send requests with
+        :param peer_id: identifier of conversation
+        :param attachments_queue: queue for downloadable attachables,
+        bounded one will suspend export until attachables are consumed
+        :param params: other `messages.getHistory` parameters
+        """
+        self.app = app
+        self.peer_id = peer_id
+        self.attachments_queue = attachments_queue
+        self.params = params
+        self.messages_count = 0
+        self.rows_count = 0
+
+    def __repr__(self):
+        return 'HistoryExporter(peer_id={self.peer_id}, ' \
+               'messages_count={self.messages_count}, ' \
+               'rows_count={self.rows_count})'.format(self=self)
+
+    def __iter__(self) -> Iterator[HistoryRow]:
+        for batch in self.app.iterate_batches('messages.getHistory', peer_id=self.peer_id, **self.params):
+            for raw_message in batch['items']:
+                self.messages_count += 1
+                yield from self.flatten(raw_message)
+
+    def flatten(self, raw_message: Dict[str, Any]) -> Iterator[HistoryRow]:
+        """Yields rows of message and all its forwarded messages in depth-first order without recursion"""
+        message = VKMessage.from_raw_without_forwarded(raw_message)
+        message_id = message.vk_id
+        raw_rows_stack = [(None, 0, raw_message)]
+        forwarded_messages_count = 0
+        while raw_rows_stack:
+            parent_id, depth, raw_row_message = raw_rows_stack.pop()
+            if parent_id is None:
+                row_id = message_id
+            else:
+                forwarded_messages_count += 1
+                row_id = FORWARDED_ROW_ID_FORMAT.format(message_id=message_id,
+                                                        index=forwarded_messages_count)
+                message = VKMessage.from_raw_without_forwarded(raw_row_message)
+            self.put_attachments(message)
+            self.rows_count += 1
+            yield HistoryRow(row_id, parent_id, depth, message)
+
+            # reversed to pop forwarded messages in original order
+            for raw_forwarded_message in reversed(raw_row_message.get('fwd_messages', [])):
+                raw_rows_stack.append((row_id, depth + 1, raw_forwarded_message))
+
+    def put_attachments(self, message: VKMessage):
+        if self.attachments_queue is None:
+            return
+        for attachment in message.attachments:
+            for attachable in attachment.values():
+                if isinstance(attachable, VKFileAttachable):
+                    self.attachments_queue.put(attachable)
+
+    def export(self, path: str) -> int:
+        """Writes rows into JSON Lines file and returns their number"""
+        rows_count = 0
+        with open(path, 'w') as history_file:
+            for row in self:
+                history_file.write(dump_json(row.to_dict()) + '\n')
+                rows_count += 1
+        logging.info('Exported {} rows of {} messages from conversation {} to {}.'
+                     .format(rows_count, self.messages_count, self.peer_id, path))
+        return rows_count
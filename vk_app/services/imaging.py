@@ -0,0 +1,195 @@
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from vk_app.models.objects import VKFileAttachable
+from vk_app.services.loading import PART_SUFFIX, fetch
+from vk_app.services.retrying import RetryPolicy, DEFAULT_RETRY_POLICY
+from vk_app.utils import DIRECTORIES_CACHE
+
+__all__ = ['ImageVariant', 'ResizingDownloader', 'resize_image']
+
+EXTENSIONS_BY_FORMAT = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+}
+
+
+class ImageVariant:
+    """Downscaled copy of image fitting into given size"""
+
+    def __init__(self, name: str, width: int, height: int, image_format: str = 'JPEG', quality: int = 85):
+        """
+        :param name: name of subdirectory for variant files to be stored at. Ex.: 'thumbnails'
+        :param width: maximum width of image
+        :param height: maximum height of image
+        :param image_format: Pillow format name of variant files
+        :param quality: quality of lossy formats
+        """
+        if image_format not in EXTENSIONS_BY_FORMAT:
+            raise ValueError('Unsupported image format: {}'.format(image_format))
+
+        self.name = name
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        self.quality = quality
+
+    def __repr__(self):
+        return 'ImageVariant(name={self.name!r}, ' \
+               'width={self.width}, ' \
+               'height={self.height}, ' \
+               'image_format={self.image_format!r}, ' \
+               'quality={self.quality})'.format(self=self)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def get_file_path(self, attachable: VKFileAttachable, path: str) -> str:
+        file_name = os.path.splitext(attachable.get_file_name())[0]
+        file_name += EXTENSIONS_BY_FORMAT[self.image_format]
+        return os.path.join(path, self.name, *attachable.get_file_subdirs(), file_name)
+
+
+def write_atomically(file_path: str, write: Callable[[str], None]):
+    """
+    Writes file with given function under temporary name and renames it,
+    so interrupted writing never leaves truncated file which looks complete
+    """
+    part_path = file_path + PART_SUFFIX
+    try:
+        write(part_path)
+        os.replace(part_path, file_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def write_content(content: bytes, file_path: str):
+    with open(file_path, 'wb') as file:
+        file.write(content)
+
+
+def write_file(file_path: str, content: bytes):
+    """Writes file atomically into cached directory, which is created again if it was removed by others"""
+    DIRECTORIES_CACHE.write(file_path, partial(write_atomically, write=partial(write_content, content)))
+
+
+def get_existing_files_paths(files_paths: List[str]) -> List[Optional[str]]:
+    return [file_path if os.path.exists(file_path) else None
+            for file_path in files_paths]
+
+
+def resize_image(content: bytes, variants: List[ImageVariant]) -> List[bytes]:
+    """
+    Decodes image and returns encoded contents of its downscaled variants,
+    runs in worker processes, so files are written by caller
+    """
+    from PIL import Image
+
+    variants_contents = list()
+    for variant in variants:
+        with Image.open(BytesIO(content)) as image:
+            # JPEG images can be decoded right at reduced scale which is much faster
+            image.draft('RGB', variant.size)
+            image.thumbnail(variant.size)
+            if variant.image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            variant_content = BytesIO()
+            image.save(variant_content, variant.image_format, quality=variant.quality)
+        variants_contents.append(variant_content.getvalue())
+    return variants_contents
+
+
+class ResizingDownloader:
+    """
+    Downloads photo-like attachables (`VKPhoto`, `VKSticker`)
+    writing only requested downscaled variants of them
+
+    content is fetched in threads and kept in memory,
+    decoding and resizing is done in pool of processes,
+    original files are stored only if asked to
+
+    images which can't be fetched or decoded are logged and skipped,
+    so single broken image doesn't fail the whole batch
+    """
+
+    def __init__(self, variants: Iterable[ImageVariant], workers: int = None, fetchers: int = 8,
+                 keep_original: bool = False, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY):
+        """
+        :param variants: variants of images to be written
+        :param workers: number of resizing processes, number of processors by default
+        :param fetchers: number of simultaneously fetched images
+        :param keep_original: if set then original files are stored as with `VKFileAttachable.download`
+        :param retry_policy: policy of retrying failed fetches
+        """
+        self.variants = list(variants)
+        self.keep_original = keep_original
+        self.retry_policy = retry_policy
+        self.fetcher = ThreadPoolExecutor(max_workers=fetchers)
+        self.resizer = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self) -> 'ResizingDownloader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        self.fetcher.shutdown(wait=wait)
+        self.resizer.shutdown(wait=wait)
+
+    def submit(self, attachable: VKFileAttachable, path: str) -> Future:
+        """Schedules downloading and returns `Future` object resolving with `download` result"""
+        return self.fetcher.submit(self.download, attachable, path)
+
+    def download_all(self, attachables: Iterable[VKFileAttachable], path: str) -> List[List[Optional[str]]]:
+        futures = [self.submit(attachable, path) for attachable in attachables]
+        return [future.result() for future in futures]
+
+    def download(self, attachable: VKFileAttachable, path: str) -> List[Optional[str]]:
+        """
+        Returns paths of variants' files in order of variants
+        with `None` for ones which are neither written nor existed before
+        """
+        files_paths = [variant.get_file_path(attachable, path) for variant in self.variants]
+        original_file_path = attachable.get_file_path(path)
+        missing_variants = [(variant, file_path)
+                            for variant, file_path in zip(self.variants, files_paths)
+                            if not os.path.exists(file_path)]
+        keep_original = self.keep_original and not os.path.exists(original_file_path)
+        if not missing_variants and not keep_original:
+            return files_paths
+        if not attachable.link:
+            return get_existing_files_paths(files_paths)
+
+        try:
+            content = fetch(attachable.link, self.retry_policy)
+        except OSError:
+            logging.exception('Can\'t fetch {}. Skipping.'.format(attachable.link))
+            return get_existing_files_paths(files_paths)
+        if keep_original:
+            try:
+                write_file(original_file_path, content)
+            except OSError:
+                logging.exception('Can\'t write {}. Skipping.'.format(original_file_path))
+        if missing_variants:
+            variants, variants_files_paths = zip(*missing_variants)
+            try:
+                variants_contents = self.resizer.submit(resize_image, content, list(variants)).result()
+            except Exception:
+                # Pillow raises various errors for broken or unsupported images
+                logging.exception('Can\'t resize image from {}. Skipping.'.format(attachable.link))
+                variants_contents = []
+            for file_path, variant_content in zip(variants_files_paths, variants_contents):
+                try:
+                    write_file(file_path, variant_content)
+                except OSError:
+                    logging.exception('Can\'t write {}. Skipping.'.format(file_path))
+        return get_existing_files_paths(files_paths)
@@ -0,0 +1,116 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+from vk_app.services.dispatching import BULK, prioritized
+from vk_app.utils import RateLimiter, dump_json, load_json
+
+__all__ = ['CollectionJob', 'run_jobs']
+
+
+class CollectionJob:
+    """
+    Collects all VK countable objects (like `App.get_all_objects`)
+    committing every fetched batch into append-only JSON Lines checkpoint file,
+    so restarted job continues from the last committed offset
+
+    each line of checkpoint file is a JSON object with total `count` of objects,
+    fetched `items` and `offset` to continue collecting from
+    """
+
+    def __init__(self, app, method: str, checkpoint_path: str,
+                 rate_limiter: RateLimiter = None, **params):
+        """
+        :param app: `App` instance to send requests with
+        :param method: name of API method. Ex.: 'wall.get'
+        :param checkpoint_path: path of JSON Lines file for fetched batches to be stored at
+        :param rate_limiter: limiter of `execute` calls shared with other jobs
+        :param params: method's parameters
+        """
+        self.app = app
+        self.method = method
+        self.checkpoint_path = checkpoint_path
+        self.rate_limiter = rate_limiter
+        self.params = params
+        self.offset = params.get('offset', 0)
+        self.count = None
+        self.items_count = 0
+        self.restore()
+
+    def __repr__(self):
+        return 'CollectionJob(method={self.method!r}, ' \
+               'checkpoint_path={self.checkpoint_path!r}, ' \
+               'offset={self.offset}, ' \
+               'count={self.count})'.format(self=self)
+
+    @property
+    def done(self) -> bool:
+        return self.count is not None and self.offset >= self.count
+
+    def restore(self):
+        """Reads committed batches from checkpoint file dropping incomplete trailing record"""
+        if not os.path.exists(self.checkpoint_path):
+            return
+        committed_size = 0
+        with open(self.checkpoint_path, 'rb') as checkpoint:
+            for line in checkpoint:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    batch = load_json(line)
+                except ValueError:
+                    break
+                committed_size += len(line)
+                self.update(batch)
+        if committed_size < os.path.getsize(self.checkpoint_path):
+            logging.warning('Dropping incomplete record of checkpoint file {}.'
+                            .format(self.checkpoint_path))
+            with open(self.checkpoint_path, 'r+b') as checkpoint:
+                checkpoint.truncate(committed_size)
+
+    def update(self, batch: Dict[str, Any]):
+        self.offset = batch['offset']
+        self.count = batch['count']
+        self.items_count += len(batch['items'])
+        # total count may shrink when objects are deleted during collecting
+        if not batch['items']:
+            self.count = self.offset
+
+    def run(self) -> int:
+        """Fetches remaining batches and returns total number of collected items"""
+        with open(self.checkpoint_path, 'ab') as checkpoint, \
+                prioritized(BULK, job=self.checkpoint_path):
+            while not self.done:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                params = dict(self.params, offset=self.offset)
+                batch = self.app.get_objects_batch(self.method, **params)
+                self.commit(checkpoint, batch)
+                self.update(batch)
+                logging.debug('Job {} collected {} of {} objects.'
+                              .format(self, self.items_count, self.count))
+        return self.items_count
+
+    @staticmethod
+    def commit(checkpoint, batch: Dict[str, Any]):
+        line = dump_json(batch) + '\n'
+        checkpoint.write(line.encode('utf-8'))
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+    def items(self) -> Iterator[Dict[str, Any]]:
+        """Yields committed raw VK objects"""
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, 'rb') as checkpoint:
+            for line in checkpoint:
+                if not line.endswith(b'\n'):
+                    return
+                yield from load_json(line)['items']
+
+
+def run_jobs(jobs: List[CollectionJob], workers: int = None) -> List[int]:
+    """Runs jobs side by side and returns numbers of collected items"""
+    with ThreadPoolExecutor(max_workers=workers or len(jobs) or 1) as executor:
+        return list(executor.map(CollectionJob.run, jobs))
@@ -1,15 +1,272 @@
+import hashlib
 import logging
-from urllib.request import urlopen
+import os
+import threading
+from typing import Dict
 
+from vk_app.services.retrying import RetryPolicy, DEFAULT_RETRY_POLICY
+from vk_app.services.uploading import get_file_md5
 
-def download(url: str, save_path: str):
+__all__ = ['download', 'load', 'fetch', 'read', 'DownloadsStore', 'FileRecord', 'VerifiedDownloader',
+           'IncompleteDownload']
+
+CHUNK_SIZE = 64 * 1024
+
+# content is written to file with this suffix and renamed after it is fully received,
+# so interrupted download never looks like complete file
+PART_SUFFIX = '.part'
+
+NOT_MODIFIED_STATUS = 304
+
+CREATE_TABLE_QUERY = 'CREATE TABLE IF NOT EXISTS downloads (' \
+                     'path TEXT PRIMARY KEY, ' \
+                     'url TEXT NOT NULL, ' \
+                     'size INTEGER NOT NULL, ' \
+                     'etag TEXT, ' \
+                     'last_modified TEXT, ' \
+                     'checksum TEXT NOT NULL)'
+SELECT_QUERY = 'SELECT url, size, etag, last_modified, checksum FROM downloads WHERE path = ?'
+UPSERT_QUERY = 'INSERT OR REPLACE INTO downloads (path, url, size, etag, last_modified, checksum) ' \
+               'VALUES (?, ?, ?, ?, ?, ?)'
+DELETE_QUERY = 'DELETE FROM downloads WHERE path = ?'
+
+
+class IncompleteDownload(ConnectionError):
+    """Raised when connection is closed before whole content is received"""
+
+
+def download(url: str, save_path: str, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY):
     logging.debug("Loading from {} to {}".format(url, save_path))
     try:
-        response = urlopen(url)
-        if response.status == 200:
-            with open(save_path, 'wb') as out:
-                file_content = response.read()
-                out.write(file_content)
-        return
+        retry_policy.call(load, url, save_path)
     except OSError:
         logging.exception('Can\'t download from {} to {}. Skipping.'.format(url, save_path))
+
+
+def load(url: str, save_path: str) -> 'FileRecord':
+    response = open_url(url)
+    with response:
+        if response.getcode() == 200:
+            return write_response(response, url, save_path)
+
+
+def fetch(url: str, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY) -> bytes:
+    """Returns content located at given URL without storing it"""
+    logging.debug("Fetching from {}".format(url))
+    return retry_policy.call(read, url)
+
+
+def read(url: str) -> bytes:
+    from urllib.request import urlopen
+
+    with urlopen(url) as response:
+        return response.read()
+
+
+def open_url(url: str, method: str = 'GET', headers: Dict[str, str] = None):
+    """Returns response to request, "Not Modified" response is returned instead of being raised"""
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    try:
+        return urlopen(Request(url, headers=headers or {}, method=method))
+    except HTTPError as error:
+        if error.code == NOT_MODIFIED_STATUS:
+            return error
+        raise
+
+
+def write_response(response, url: str, save_path: str) -> 'FileRecord':
+    """Writes response content to file chunk by chunk and returns its record"""
+    from http.client import IncompleteRead
+
+    part_path = save_path + PART_SUFFIX
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with open(part_path, 'wb') as part:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                part.write(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None and int(content_length) != size:
+            raise IncompleteDownload('Received {} bytes of {} from {}.'.format(size, content_length, url))
+        os.replace(part_path, save_path)
+    except IncompleteRead:
+        os.remove(part_path)
+        raise IncompleteDownload('Connection to {} was closed after {} bytes.'.format(url, size))
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return FileRecord(url, size, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                      md5.hexdigest())
+
+
+class FileRecord:
+    """Metadata of downloaded file"""
+
+    def __init__(self, url: str, size: int, etag: str = None, last_modified: str = None, checksum: str = None):
+        """
+        :param url: URL file was downloaded from
+        :param size: number of bytes in file
+        :param etag: `ETag` header of response
+        :param last_modified: `Last-Modified` header of response
+        :param checksum: MD5 checksum of file's content
+        """
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checksum = checksum
+
+    def __repr__(self):
+        return 'FileRecord(url={self.url!r}, ' \
+               'size={self.size}, ' \
+               'etag={self.etag!r}, ' \
+               'last_modified={self.last_modified!r}, ' \
+               'checksum={self.checksum!r})'.format(self=self)
+
+    def get_conditional_headers(self) -> Dict[str, str]:
+        headers = dict()
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class DownloadsStore:
+    """SQLite database of downloaded files' records by their paths"""
+
+    def __init__(self, path: str = ':memory:'):
+        """
+        :param path: path of SQLite database, in-memory one by default
+        """
+        import sqlite3
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(CREATE_TABLE_QUERY)
+
+    def __repr__(self):
+        return 'DownloadsStore(path={self.path!r})'.format(self=self)
+
+    def __enter__(self) -> 'DownloadsStore':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, file_path: str) -> FileRecord:
+        with self.lock:
+            row = self.connection.execute(SELECT_QUERY, (os.path.normpath(file_path),)).fetchone()
+        if row is None:
+            return None
+        return FileRecord(*row)
+
+    def put(self, file_path: str, record: FileRecord):
+        with self.lock, self.connection:
+            self.connection.execute(UPSERT_QUERY, (os.path.normpath(file_path), record.url, record.size,
+                                                   record.etag, record.last_modified, record.checksum))
+
+    def remove(self, file_path: str):
+        with self.lock, self.connection:
+            self.connection.execute(DELETE_QUERY, (os.path.normpath(file_path),))
+
+
+class VerifiedDownloader:
+    """
+    Downloads files keeping their records in store, so existing files are checked instead of being trusted:
+    files with size (and checksum if required) differing from the record are re-fetched,
+    intact ones are re-fetched only if conditional request shows they are changed,
+    files without records (ex. downloaded by `download`) are adopted if their size matches `HEAD` response
+    """
+
+    def __init__(self, store: DownloadsStore, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 verify_checksums: bool = False):
+        """
+        :param store: store of downloaded files' records
+        :param retry_policy: policy of retrying requests failed with transient errors
+        :param verify_checksums: if set existing files are read to compare their checksums with records,
+        otherwise only sizes are compared
+        """
+        self.store = store
+        self.retry_policy = retry_policy
+        self.verify_checksums = verify_checksums
+        self.lock = threading.Lock()
+
+        # metrics
+        self.fetched = 0
+        self.unchanged = 0
+        self.corrupted = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return 'VerifiedDownloader(store={self.store!r}, ' \
+               'fetched={self.fetched}, ' \
+               'unchanged={self.unchanged}, ' \
+               'corrupted={self.corrupted}, ' \
+               'failed={self.failed})'.format(self=self)
+
+    def download(self, url: str, save_path: str) -> bool:
+        """Makes file at given path match content at given URL, returns whether content was fetched"""
+        logging.debug("Verifying {} from {}".format(save_path, url))
+        try:
+            fetched = self.retry_policy.call(self.synchronize, url, save_path)
+        except OSError:
+            logging.exception('Can\'t download from {} to {}. Skipping.'.format(url, save_path))
+            self.count('failed')
+            return False
+        self.count('fetched' if fetched else 'unchanged')
+        return fetched
+
+    def synchronize(self, url: str, save_path: str) -> bool:
+        headers = dict()
+        if os.path.exists(save_path):
+            record = self.store.get(save_path)
+            if record is None:
+                record = self.adopt(url, save_path)
+                if record is not None:
+                    return False
+            elif self.is_intact(save_path, record):
+                headers = record.get_conditional_headers()
+                if not headers:
+                    # there is nothing to compare with, so size match is trusted
+                    return False
+            else:
+                logging.warning('File {} is corrupted, re-fetching it.'.format(save_path))
+                self.count('corrupted')
+
+        with open_url(url, headers=headers) as response:
+            if response.getcode() == NOT_MODIFIED_STATUS:
+                return False
+            record = write_response(response, url, save_path)
+        self.store.put(save_path, record)
+        return True
+
+    def adopt(self, url: str, save_path: str) -> FileRecord:
+        """Records existing file if its size matches content at given URL"""
+        with open_url(url, method='HEAD') as response:
+            content_length = response.headers.get('Content-Length')
+            if content_length is None or int(content_length) != os.path.getsize(save_path):
+                return None
+            record = FileRecord(url, int(content_length), response.headers.get('ETag'),
+                                response.headers.get('Last-Modified'), get_file_md5(save_path))
+        self.store.put(save_path, record)
+        return record
+
+    def is_intact(self, file_path: str, record: FileRecord) -> bool:
+        if os.path.getsize(file_path) != record.size:
+            return False
+        return not self.verify_checksums or get_file_md5(file_path) == record.checksum
+
+    def count(self, metric: str):
+        with self.lock:
+            setattr(self, metric, getattr(self, metric) + 1)
@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import logging
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from vk_app.models import VKMessage
+from vk_app.utils import load_json
+
+__all__ = ['LongPollClient']
+
+# more info about user Long Poll events at https://vk.com/dev/using_longpoll
+NEW_MESSAGE_EVENT = 4
+
+UNREAD_FLAG = 1
+OUTBOX_FLAG = 2
+DELETED_FLAG = 128
+
+# more info about Bots Long Poll events at https://vk.com/dev/bots_longpoll
+NEW_MESSAGE_TYPE = 'message_new'
+
+# history is outdated, new `ts` is given
+OUTDATED_HISTORY_FAILURE = 1
+# key is expired, `ts` can be kept
+EXPIRED_KEY_FAILURE = 2
+# user information is lost, new key and `ts` are required
+LOST_INFORMATION_FAILURE = 3
+
+
+class LongPollClient:
+    """
+    Implements receiving of new private messages through VK Long Poll server
+    for users (`messages.getLongPollServer`) or communities (`groups.getLongPollServer`)
+
+    can be iterated over synchronously or asynchronously:
+    >>> for message in LongPollClient(app): ...
+    >>> async for message in LongPollClient(app): ...
+    """
+
+    def __init__(self, app, group_id: int = None, wait: int = 25, mode: int = 2, version: int = 2):
+        """
+        :param app: `App` instance to get Long Poll server with
+        :param group_id: community identifier for Bots Long Poll, user Long Poll is used by default
+        :param wait: seconds for server to hold connection waiting for events
+        :param mode: additional answer options for user Long Poll
+        :param version: version of user Long Poll
+        """
+        self.app = app
+        self.group_id = group_id
+        self.wait = wait
+        self.mode = mode
+        self.version = version
+        self.session = requests.Session()
+        self.server = None
+        self.key = None
+        self.ts = None
+        self.messages = deque()
+
+    def __repr__(self):
+        return 'LongPollClient(group_id={self.group_id}, ' \
+               'server={self.server!r}, ' \
+               'ts={self.ts})'.format(self=self)
+
+    def __iter__(self) -> Iterator[VKMessage]:
+        while True:
+            while self.messages:
+                yield self.messages.popleft()
+            self.messages.extend(self.get_messages())
+
+    def __aiter__(self) -> 'LongPollClient':
+        return self
+
+    async def __anext__(self) -> VKMessage:
+        loop = asyncio.get_event_loop()
+        while not self.messages:
+            messages = await loop.run_in_executor(None, self.get_messages)
+            self.messages.extend(messages)
+        return self.messages.popleft()
+
+    def close(self):
+        self.session.close()
+
+    def update_server(self, keep_ts: bool = False):
+        if self.group_id is not None:
+            response = self.app.call('groups.getLongPollServer', group_id=self.group_id)
+            server = response['server']
+        else:
+            response = self.app.call('messages.getLongPollServer', lp_version=self.version)
+            server = 'https://' + response['server']
+        self.server = server
+        self.key = response['key']
+        if not keep_ts or self.ts is None:
+            self.ts = response['ts']
+
+    def get_messages(self) -> List[VKMessage]:
+        messages = list()
+        for update in self.get_updates():
+            message = self.decode(update)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def get_updates(self) -> List[Any]:
+        """Waits for events and returns them, handles Long Poll failures"""
+        if self.server is None:
+            self.update_server()
+        params = dict(act='a_check', key=self.key, ts=self.ts, wait=self.wait,
+                      mode=self.mode, version=self.version)
+        response = self.app.retry_policy.call(self.check, params)
+        failure = response.get('failed')
+        if failure is None:
+            self.ts = response['ts']
+            return response['updates']
+
+        logging.debug('Long Poll server {} failed with code {}.'.format(self.server, failure))
+        if failure == OUTDATED_HISTORY_FAILURE:
+            self.ts = response['ts']
+        elif failure == EXPIRED_KEY_FAILURE:
+            self.update_server(keep_ts=True)
+        else:
+            self.update_server()
+        return []
+
+    def check(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.session.get(self.server, params=params, timeout=self.wait + 10)
+        response.raise_for_status()
+        return load_json(response.content)
+
+    def decode(self, update: Any) -> Optional[VKMessage]:
+        if self.group_id is not None:
+            if update['type'] == NEW_MESSAGE_TYPE:
+                return VKMessage.from_raw(update['object'])
+            return None
+        return decode_user_event(update)
+
+
+def decode_user_event(event: List[Any]) -> Optional[VKMessage]:
+    if event[0] != NEW_MESSAGE_EVENT:
+        return None
+    message_id, flags, peer_id, timestamp, text = event[1:6]
+    extra_fields = event[6] if len(event) > 6 else dict()
+    # owner is the same as `user_id` used by `VKMessage.from_raw`:
+    # peer of dialog is the author (or the receiver of outgoing message),
+    # but peer of chat is the chat itself, so its author is given in `from` field
+    user_id = int(extra_fields.get('from', peer_id))
+    # user Long Poll gives only identifiers of attachments,
+    # full objects can be requested with `messages.getById`
+    return VKMessage(
+        owner_id=user_id,
+        object_id=message_id,
+        title=extra_fields.get('title'),
+        body=text,
+        attachments=[],
+        date_time=datetime.datetime.utcfromtimestamp(timestamp),
+        sent=bool(flags & OUTBOX_FLAG),
+        read=not flags & UNREAD_FLAG,
+        deleted=bool(flags & DELETED_FLAG),
+        emojied=extra_fields.get('emoji') == '1',
+        forwarded_messages=[]
+    )
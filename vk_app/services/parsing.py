@@ -0,0 +1,85 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List
+
+from vk_app.models.objects import VKObject
+from vk_app.utils import load_json
+
+__all__ = ['parse_dump', 'parse_lines', 'parse_chunk', 'merge_columns']
+
+
+def parse_chunk(lines: List[str], model_cls: type, columns: List[str] = None) -> Any:
+    """
+    Parses newline-delimited raw VK objects into models
+
+    :param lines: JSON-encoded raw VK objects
+    :param model_cls: `VKObject` inheritor with `from_raw` method. Ex.: `VKPost`
+    :param columns: names of models' attributes,
+    if specified then dictionary of columns with their values is returned instead of models
+    """
+    models = [model_cls.from_raw(load_json(line))
+              for line in lines
+              if line.strip()]
+    if columns is None:
+        return models
+    return dict((column, [getattr(model, column) for model in models])
+                for column in columns)
+
+
+def parse_lines(lines: Iterable[str], model_cls: type, workers: int = None,
+                chunk_size: int = 1000, columns: List[str] = None) -> Iterator[Any]:
+    """
+    Parses newline-delimited raw VK objects in pool of processes
+
+    chunks of lines are shipped to workers as is and parsed there,
+    so JSON decoding and `from_raw` calls are not serialized by GIL,
+    number of chunks being parsed simultaneously is bounded,
+    so lines are consumed lazily
+
+    :param lines: JSON-encoded raw VK objects
+    :param model_cls: `VKObject` inheritor with `from_raw` method. Ex.: `VKPost`
+    :param workers: number of processes, number of processors by default
+    :param chunk_size: number of lines sent to worker at once
+    :param columns: names of models' attributes,
+    if specified then chunks of columns are yielded instead of models (see `parse_chunk`),
+    picking primitive attributes reduces cost of shipping results back
+    :return: iterator over models or columns chunks in order of lines
+    """
+    if not issubclass(model_cls, VKObject):
+        raise ValueError('Expected `VKObject` inheritor, but found: {}'.format(model_cls))
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = 2 * workers
+    lines = iter(lines)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if chunk:
+                pending.append(executor.submit(parse_chunk, chunk, model_cls, columns))
+            if pending and (len(pending) >= max_pending or not chunk):
+                result = pending.popleft().result()
+                if columns is None:
+                    yield from result
+                else:
+                    yield result
+            elif not chunk:
+                return
+
+
+def parse_dump(path: str, model_cls: type, workers: int = None,
+               chunk_size: int = 1000, columns: List[str] = None) -> Iterator[Any]:
+    """Parses file with newline-delimited raw VK objects (see `parse_lines`)"""
+    with open(path, encoding='utf-8') as dump:
+        yield from parse_lines(dump, model_cls, workers=workers,
+                               chunk_size=chunk_size, columns=columns)
+
+
+def merge_columns(chunks: Iterable[Dict[str, list]]) -> Dict[str, list]:
+    columns = dict()
+    for chunk in chunks:
+        for column, values in chunk.items():
+            columns.setdefault(column, []).extend(values)
+    return columns
@@ -0,0 +1,314 @@
+import logging
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+__all__ = ['Pipeline', 'Stage', 'StageMetrics', 'get_items', 'DEFAULT_QUEUE_SIZE']
+
+# number of items waiting between neighbouring stages,
+# along with stages' workers' count it bounds number of items in memory
+DEFAULT_QUEUE_SIZE = 100
+
+# interval of checking whether pipeline is stopped while waiting for full or empty queue
+POLL_INTERVAL_IN_SEC = 0.1
+
+# marks the end of items
+END = object()
+
+
+def get_items(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns raw VK objects of batch yielded by `App.iterate_batches`, used by expanding stages"""
+    return batch['items']
+
+
+class StageMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy_time = 0.
+        self.start_time = None
+        self.elapsed_time = 0.
+
+    def __repr__(self):
+        return 'StageMetrics(received={self.received}, ' \
+               'emitted={self.emitted}, ' \
+               'failed={self.failed}, ' \
+               'throughput={self.throughput:.2f})'.format(self=self)
+
+    @property
+    def throughput(self) -> float:
+        """Returns number of processed items per second"""
+        elapsed_time = self.elapsed_time
+        if self.start_time is not None:
+            elapsed_time = time.monotonic() - self.start_time
+        return self.received / elapsed_time if elapsed_time else 0.
+
+    def update(self, emitted: int, busy_time: float):
+        with self.lock:
+            self.received += 1
+            self.emitted += emitted
+            self.busy_time += busy_time
+
+
+class Stage:
+    """Step of pipeline applying function to every item"""
+
+    def __init__(self, function: Callable[[Any], Any], name: str = None, workers: int = 1,
+                 expand: bool = False, skip_errors: bool = False):
+        """
+        :param function: function (or coroutine function for asynchronous pipeline)
+        which receives item and returns processed one or `None` to drop it
+        :param name: name of stage in metrics, function's name by default
+        :param workers: number of items processed simultaneously
+        :param expand: if set `function` returns iterable of items instead of single one,
+        ex.: `get_items` to turn batches into raw VK objects
+        :param skip_errors: if set items failed to be processed are logged and dropped,
+        otherwise the first error stops pipeline and is raised by it
+        """
+        self.function = function
+        self.name = name or getattr(function, '__name__', repr(function))
+        self.workers = workers
+        self.expand = expand
+        self.skip_errors = skip_errors
+        self.metrics = StageMetrics()
+
+    def __repr__(self):
+        return 'Stage(name={self.name!r}, ' \
+               'workers={self.workers}, ' \
+               'metrics={self.metrics})'.format(self=self)
+
+    def get_results(self, result: Any) -> List[Any]:
+        if self.expand:
+            return [item for item in result if item is not None]
+        if result is None:
+            return []
+        return [result]
+
+
+class Pipeline:
+    """
+    Passes items from source through stages connected by bounded queues,
+    so slow stage blocks the previous ones (backpressure) and memory usage
+    doesn't depend on collection's size:
+    >>> pipeline = Pipeline(app.iterate_batches('wall.get', owner_id=1),
+    ...                     [Stage(get_items, expand=True),
+    ...                      Stage(VKPost.from_raw, workers=2),
+    ...                      Stage(lambda post: post if post.text else None, name='filter_empty')])
+    >>> for post in pipeline: ...
+
+    stages are run by threads with `run`/iteration or by asyncio tasks with `run_async`
+    """
+
+    def __init__(self, source: Iterable[Any], stages: List[Stage], queue_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        :param source: iterable of initial items, ex.: `App.iterate_batches` result
+        :param stages: stages in order of items processing
+        :param queue_size: maximum number of items waiting before every stage and pipeline's output
+        """
+        if not stages:
+            raise ValueError('No stages to process items with.')
+
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def __repr__(self):
+        return 'Pipeline(stages={self.stages}, ' \
+               'queue_size={self.queue_size})'.format(self=self)
+
+    def __iter__(self) -> Iterator[Any]:
+        """Runs stages in threads and yields items processed by all of them"""
+        queues = [Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self.feed, args=(queues[0],), daemon=True)]
+        for stage, inbound, outbound in zip(self.stages, queues, queues[1:]):
+            # the last finished worker of stage passes end of items further
+            remaining_workers = [stage.workers]
+            stage.metrics.start_time = time.monotonic()
+            threads.extend(threading.Thread(target=self.work, args=(stage, inbound, outbound, remaining_workers),
+                                            daemon=True)
+                           for _ in range(stage.workers))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self.get(queues[-1])
+                if item is END:
+                    break
+                yield item
+        finally:
+            # consumer may stop iteration early, so workers should not wait for it
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self) -> int:
+        """Runs stages in threads and returns number of items passed through all of them"""
+        return sum(1 for _ in self)
+
+    def get_metrics(self) -> Dict[str, StageMetrics]:
+        return dict((stage.name, stage.metrics) for stage in self.stages)
+
+    def stop(self, error: Exception = None):
+        if error is not None and self.error is None:
+            self.error = error
+        self.stop_event.set()
+
+    def put(self, queue: Queue, item: Any) -> bool:
+        """Waits for free place in queue while pipeline is running, returns whether item was put"""
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL_IN_SEC)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue: Queue) -> Any:
+        """Waits for item in queue while pipeline is running, returns end of items after stop"""
+        while not self.stop_event.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL_IN_SEC)
+            except Empty:
+                continue
+        return END
+
+    def feed(self, outbound: Queue):
+        try:
+            for item in self.source:
+                if not self.put(outbound, item):
+                    return
+        except Exception as error:
+            logging.exception('Reading of pipeline source failed.')
+            self.stop(error)
+            return
+        self.put(outbound, END)
+
+    def work(self, stage: Stage, inbound: Queue, outbound: Queue, remaining_workers: List[int]):
+        while True:
+            item = self.get(inbound)
+            if item is END:
+                break
+            start = time.monotonic()
+            try:
+                results = stage.get_results(stage.function(item))
+            except Exception as error:
+                with stage.metrics.lock:
+                    stage.metrics.failed += 1
+                if not stage.skip_errors:
+                    logging.exception('Stage {} failed.'.format(stage.name))
+                    self.stop(error)
+                    return
+                logging.exception('Stage {} failed to process item, skipping it.'.format(stage.name))
+                continue
+            stage.metrics.update(len(results), time.monotonic() - start)
+            for result in results:
+                if not self.put(outbound, result):
+                    return
+        if self.stop_event.is_set():
+            return
+
+        with stage.metrics.lock:
+            remaining_workers[0] -= 1
+            last_worker = not remaining_workers[0]
+        if last_worker:
+            stage.metrics.elapsed_time = time.monotonic() - stage.metrics.start_time
+            stage.metrics.start_time = None
+            # other workers are waiting for end of items too
+            inbound.put(END)
+            self.put(outbound, END)
+        else:
+            inbound.put(END)
+
+    async def run_async(self, sink: Callable[[Any], Any] = None, loop=None) -> int:
+        """
+        Runs stages as asyncio tasks and returns number of items passed through all of them,
+        source is iterated in default executor, so it can be blocking (like `App.iterate_batches`)
+
+        :param sink: function or coroutine function which receives items processed by all stages
+        :param loop: event loop to run tasks in, current one by default
+        """
+        import asyncio
+
+        loop = loop or asyncio.get_event_loop()
+        queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        tasks = [asyncio.ensure_future(self.feed_async(queues[0], loop))]
+        for stage, inbound, outbound in zip(self.stages, queues, queues[1:]):
+            remaining_workers = [stage.workers]
+            stage.metrics.start_time = time.monotonic()
+            tasks.extend(asyncio.ensure_future(self.work_async(stage, inbound, outbound, remaining_workers))
+                         for _ in range(stage.workers))
+
+        count = 0
+        try:
+            while True:
+                item = await queues[-1].get()
+                if item is END:
+                    break
+                if sink is not None:
+                    result = sink(item)
+                    if asyncio.iscoroutine(result):
+                        await result
+                count += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self.error is not None:
+            raise self.error
+        return count
+
+    async def feed_async(self, outbound, loop):
+        iterator = iter(self.source)
+        try:
+            while True:
+                item = await loop.run_in_executor(None, next, iterator, END)
+                await outbound.put(item)
+                if item is END:
+                    return
+        except Exception as error:
+            logging.exception('Reading of pipeline source failed.')
+            self.stop(error)
+            await outbound.put(END)
+
+    async def work_async(self, stage: Stage, inbound, outbound, remaining_workers: List[int]):
+        import asyncio
+
+        while True:
+            item = await inbound.get()
+            if item is END:
+                break
+            start = time.monotonic()
+            try:
+                result = stage.function(item)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                results = stage.get_results(result)
+            except Exception as error:
+                stage.metrics.failed += 1
+                if not stage.skip_errors:
+                    logging.exception('Stage {} failed.'.format(stage.name))
+                    self.stop(error)
+                    # single event loop runs all tasks, so downstream stages can be finished right away
+                    await outbound.put(END)
+                    return
+                logging.exception('Stage {} failed to process item, skipping it.'.format(stage.name))
+                continue
+            stage.metrics.update(len(results), time.monotonic() - start)
+            for result in results:
+                await outbound.put(result)
+
+        remaining_workers[0] -= 1
+        # other workers are waiting for end of items too
+        await inbound.put(END)
+        if not remaining_workers[0]:
+            stage.metrics.elapsed_time = time.monotonic() - stage.metrics.start_time
+            stage.metrics.start_time = None
+            await outbound.put(END)
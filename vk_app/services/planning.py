@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+from functools import partial
+from typing import Iterable, List
+
+from vk_app.models.objects import VKFileAttachable, load_link
+from vk_app.services.loading import VerifiedDownloader
+from vk_app.utils import DirectoriesCache, DIRECTORIES_CACHE
+
+__all__ = ['PathPlanner']
+
+
+class PathPlanner:
+    """
+    Plans files paths of attachables stored under single directory:
+    path of every attachable is computed once
+    and directories are created once (see `DirectoriesCache`),
+    so downloading of existing file costs single `stat` call
+
+    memoized paths go stale if attachables' `SHARDING` or file names' fields change,
+    so new planner should be created after that;
+    directories removed by others are created again on writing
+    """
+
+    def __init__(self, path: str, directories_cache: DirectoriesCache = DIRECTORIES_CACHE,
+                 downloader: VerifiedDownloader = None):
+        """
+        :param path: directory for files to be stored at
+        :param directories_cache: directories known to exist, shared between planners by default
+        :param downloader: downloader verifying existing files, otherwise existing files are trusted
+        """
+        self.path = path
+        self.directories_cache = directories_cache
+        self.downloader = downloader
+        self.files_paths = dict()
+
+    def __repr__(self):
+        return 'PathPlanner(path={self.path!r}, ' \
+               'planned_files_count={planned_files_count})'.format(self=self,
+                                                                  planned_files_count=len(self.files_paths))
+
+    def get_file_path(self, attachable: VKFileAttachable, **kwargs) -> str:
+        key = (type(attachable), attachable.vk_id, tuple(sorted(kwargs.items())))
+        file_path = self.files_paths.get(key)
+        if file_path is None:
+            file_path = self.files_paths[key] = attachable.get_file_path(self.path, **kwargs)
+        return file_path
+
+    def plan(self, attachables: Iterable[VKFileAttachable], **kwargs) -> List[str]:
+        """Returns files paths of attachables creating all their directories beforehand"""
+        files_paths = [self.get_file_path(attachable, **kwargs) for attachable in attachables]
+        for file_dir in OrderedDict.fromkeys(map(os.path.dirname, files_paths)):
+            self.directories_cache.ensure(file_dir)
+        return files_paths
+
+    def download(self, attachable: VKFileAttachable) -> str:
+        """Same as `VKFileAttachable.download`, but with planned file path"""
+        file_path = self.get_file_path(attachable)
+        if attachable.link:
+            self.directories_cache.write(file_path, partial(load_link, attachable.link, downloader=self.downloader))
+        else:
+            self.directories_cache.ensure(os.path.dirname(file_path))
+        return file_path
+
+    def download_all(self, attachables: Iterable[VKFileAttachable]) -> List[str]:
+        attachables = list(attachables)
+        self.plan(attachables)
+        return [self.download(attachable) for attachable in attachables]
@@ -0,0 +1,274 @@
+import atexit
+import sys
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, List, Tuple
+
+__all__ = ['Profiler', 'Timer', 'PROFILER', 'PROFILE_ENV_VAR', 'start_profiling',
+           'TIMERS', 'CPROFILE', 'TRACEMALLOC']
+
+# environment variable enabling profiling of `App` instances,
+# holds comma-separated profiling modes. Ex.: 'timers,tracemalloc'
+PROFILE_ENV_VAR = 'VK_APP_PROFILE'
+
+# profiling modes:
+# hot paths are wrapped with timers, any other non-empty value means the same
+TIMERS = 'timers'
+# timers with deterministic profiling of the thread which started profiling
+CPROFILE = 'cprofile'
+# timers with snapshot of memory allocations
+TRACEMALLOC = 'tracemalloc'
+
+REPORT_LIMIT = 20
+
+
+class Timer:
+    """Accumulated duration of calls of single hot path"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.
+        self.max_time = 0.
+
+    def __repr__(self):
+        return 'Timer(name={self.name!r}, ' \
+               'calls={self.calls}, ' \
+               'total_time={self.total_time:.6f}, ' \
+               'max_time={self.max_time:.6f})'.format(self=self)
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.
+
+
+def get_from_raw_name(owner) -> Callable[..., str]:
+    name = '{}.from_raw'.format(owner.__name__)
+    return lambda *args, **kwargs: name
+
+
+def get_model_hot_paths(model_cls: type) -> List[Tuple[Any, str, Callable[[Any], Callable[..., str]]]]:
+    """Returns hot paths of model class, only its own `from_raw` is instrumented"""
+    if 'from_raw' not in model_cls.__dict__:
+        return []
+    return [(model_cls, 'from_raw', get_from_raw_name)]
+
+
+def get_hot_paths() -> List[Tuple[Any, str, Callable[[Any], Callable[..., str]]]]:
+    """
+    Returns owners (classes) and names of instrumented attributes
+    with functions making timers' names getters from owners
+    """
+    from vk_app.app import App
+    from vk_app.models.objects import (ATTACHABLES_CLASSES, CONTAINERS_CLASSES,
+                                       VKObject, VKFileAttachable, VKRawAttachable)
+    from vk_app.services.dispatching import RequestDispatcher
+    from vk_app.utils import RateLimiter
+
+    def get_constant_name(name: str) -> Callable[[Any], Callable[..., str]]:
+        return lambda owner: lambda *args, **kwargs: name
+
+    def get_method_name(owner) -> Callable[..., str]:
+        # network waits are split by API methods. Ex.: 'App.call_api[execute]'
+        return lambda self, method, **params: 'App.call_api[{}]'.format(method)
+
+    hot_paths = [(App, 'call_api', get_method_name),
+                 # covers `make_delayed` decorator and `App` rate limiting
+                 (RateLimiter, 'acquire', get_constant_name('RateLimiter.acquire')),
+                 (RequestDispatcher, 'acquire', get_constant_name('RequestDispatcher.acquire')),
+                 # `VKObject` methods are the only callers of these reflection utilities
+                 (VKObject, '__repr__', get_constant_name('get_repr')),
+                 (VKObject, 'to_dict', get_constant_name('obj_to_dict')),
+                 (VKFileAttachable, 'synchronize', get_constant_name('VKFileAttachable.synchronize')),
+                 (VKFileAttachable, 'download', get_constant_name('VKFileAttachable.download'))]
+    # classes registered later are instrumented on registration
+    models_classes = set(CONTAINERS_CLASSES + ATTACHABLES_CLASSES + [VKRawAttachable])
+    for model_cls in sorted(models_classes, key=lambda cls: cls.__name__):
+        hot_paths.extend(get_model_hot_paths(model_cls))
+    return hot_paths
+
+
+class Profiler:
+    """
+    Measures time spent in hot paths of crawling:
+    network waits of API calls, rate limiting sleeps, parsing with `from_raw`,
+    reflection in `get_repr`/`obj_to_dict` and file system work of attachables
+
+    hot paths are wrapped only while profiler is enabled, so there is no overhead otherwise,
+    timers are inclusive: time of nested hot paths (ex. `from_raw` of attachments) is counted by outer ones too
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = dict()
+        self.originals = list()
+        self.cpu_profile = None
+        self.tracemalloc_snapshot = None
+        self.tracing_memory = False
+        self.start_time = None
+        self.elapsed_time = 0.
+
+    def __repr__(self):
+        return 'Profiler(enabled={self.enabled}, ' \
+               'timers_count={timers_count})'.format(self=self, timers_count=len(self.timers))
+
+    def __enter__(self) -> 'Profiler':
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disable()
+
+    @property
+    def enabled(self) -> bool:
+        return self.start_time is not None
+
+    def enable(self, cpu: bool = False, memory: bool = False):
+        """
+        Wraps hot paths with timers
+
+        :param cpu: if set the calling thread is also profiled with `cProfile`
+        :param memory: if set memory allocations are traced with `tracemalloc`
+        """
+        if self.enabled:
+            return
+        self.add_hot_paths(get_hot_paths())
+        if cpu:
+            import cProfile
+
+            self.cpu_profile = cProfile.Profile()
+            self.cpu_profile.enable()
+        if memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing_memory = True
+        self.start_time = time.monotonic()
+
+    def disable(self):
+        """Restores hot paths keeping collected measurements for report"""
+        if not self.enabled:
+            return
+        self.elapsed_time += time.monotonic() - self.start_time
+        self.start_time = None
+        while self.originals:
+            owner, attribute, original = self.originals.pop()
+            setattr(owner, attribute, original)
+        if self.cpu_profile is not None:
+            self.cpu_profile.disable()
+        if self.tracing_memory:
+            import tracemalloc
+
+            self.tracemalloc_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.tracing_memory = False
+
+    def add_hot_paths(self, hot_paths: List[Tuple[Any, str, Callable[[Any], Callable[..., str]]]]):
+        for owner, attribute, get_name_getter in hot_paths:
+            original = owner.__dict__[attribute]
+            self.originals.append((owner, attribute, original))
+            setattr(owner, attribute, self.instrument(original, get_name_getter(owner)))
+
+    def add_model(self, model_cls: type):
+        """Instruments model class registered while profiler is enabled"""
+        if not self.enabled:
+            return
+        instrumented = set((owner, attribute) for owner, attribute, _ in self.originals)
+        self.add_hot_paths([hot_path
+                            for hot_path in get_model_hot_paths(model_cls)
+                            if hot_path[:2] not in instrumented])
+
+    def instrument(self, original: Any, get_name: Callable[..., str]) -> Any:
+        if isinstance(original, classmethod):
+            return classmethod(self.time(original.__func__, get_name))
+        return self.time(original, get_name)
+
+    def time(self, function: Callable[..., Any], get_name: Callable[..., str]) -> Callable[..., Any]:
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(get_name(*args, **kwargs), time.perf_counter() - start)
+
+        return timed
+
+    def add(self, name: str, duration: float):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer(name)
+            timer.calls += 1
+            timer.total_time += duration
+            timer.max_time = max(timer.max_time, duration)
+
+    def get_timers(self) -> List[Timer]:
+        """Returns timers from the most time consuming"""
+        with self.lock:
+            return sorted(self.timers.values(), key=lambda timer: timer.total_time, reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+        self.elapsed_time = 0.
+        if self.enabled:
+            self.start_time = time.monotonic()
+
+    def get_report(self, limit: int = REPORT_LIMIT) -> str:
+        """Returns breakdown of time spent in hot paths with `cProfile` and `tracemalloc` statistics if any"""
+        elapsed_time = self.elapsed_time
+        if self.enabled:
+            elapsed_time += time.monotonic() - self.start_time
+        lines = ['Profile of {:.3f} seconds (timers are inclusive):'.format(elapsed_time),
+                 '{:<40} {:>10} {:>12} {:>12} {:>12} {:>7}'.format('hot path', 'calls', 'total, s',
+                                                                   'mean, ms', 'max, ms', 'share')]
+        for timer in self.get_timers()[:limit]:
+            share = timer.total_time / elapsed_time if elapsed_time else 0.
+            lines.append('{:<40} {:>10} {:>12.3f} {:>12.3f} {:>12.3f} {:>7.1%}'
+                         .format(timer.name, timer.calls, timer.total_time,
+                                 timer.mean_time * 1000., timer.max_time * 1000., share))
+
+        if self.cpu_profile is not None:
+            import io
+            import pstats
+
+            stream = io.StringIO()
+            pstats.Stats(self.cpu_profile, stream=stream).sort_stats('cumulative').print_stats(limit)
+            lines.extend(['', 'cProfile statistics:', stream.getvalue().strip()])
+
+        if self.tracemalloc_snapshot is not None:
+            lines.extend(['', 'Top memory allocations:'])
+            lines.extend(map(str, self.tracemalloc_snapshot.statistics('lineno')[:limit]))
+        return '\n'.join(lines)
+
+    def report(self, stream=None):
+        """Writes report to given stream, standard error by default"""
+        stream = stream or sys.stderr
+        stream.write(self.get_report() + '\n')
+
+
+PROFILER = Profiler()
+
+
+def write_report():
+    PROFILER.disable()
+    PROFILER.report()
+
+
+def start_profiling(modes: str):
+    """
+    Enables shared profiler and registers its report to be written
+    to standard error at interpreter exit
+
+    :param modes: comma-separated profiling modes. Ex.: 'timers,cprofile'
+    """
+    if PROFILER.enabled:
+        return
+    modes = set(mode.strip().lower() for mode in modes.split(','))
+    PROFILER.enable(cpu=CPROFILE in modes, memory=TRACEMALLOC in modes)
+    # registering the same function again doesn't duplicate report
+    atexit.unregister(write_report)
+    atexit.register(write_report)
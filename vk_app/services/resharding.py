@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+
+from vk_app.models.objects import VKFileAttachable
+from vk_app.utils import DirectoriesCache, DIRECTORIES_CACHE
+
+__all__ = ['Resharder']
+
+
+class Resharder:
+    """
+    Moves files of existing archive to locations given by current `SHARDING` schemes of attachables:
+    archive is listed once, then files are moved in parallel
+    and directories left empty are removed
+    >>> VKPhoto.SHARDING = HashPrefixSharding()
+    >>> Resharder('photos').run(photos)
+    """
+
+    def __init__(self, path: str, workers: int = 4, directories_cache: DirectoriesCache = DIRECTORIES_CACHE):
+        """
+        :param path: directory of archive
+        :param workers: number of files moved simultaneously
+        :param directories_cache: directories known to exist, shared by default
+        """
+        self.path = path
+        self.workers = workers
+        self.directories_cache = directories_cache
+        self.lock = threading.Lock()
+
+        # metrics
+        self.moved = 0
+        self.unchanged = 0
+        self.missing = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return 'Resharder(path={self.path!r}, ' \
+               'moved={self.moved}, ' \
+               'unchanged={self.unchanged}, ' \
+               'missing={self.missing}, ' \
+               'failed={self.failed})'.format(self=self)
+
+    def index_files(self) -> Dict[str, List[str]]:
+        """Returns paths of archive's files by their names"""
+        files_paths = dict()
+        for root, dirs, files in os.walk(self.path):
+            for file_name in files:
+                files_paths.setdefault(file_name, []).append(os.path.join(root, file_name))
+        return files_paths
+
+    def run(self, attachables: Iterable[VKFileAttachable]) -> int:
+        """
+        Moves files of given attachables and returns number of moved ones,
+        files of unknown attachables are left in place
+        """
+        moved = self.moved
+        files_paths = self.index_files()
+        old_dirs = set()
+        with ThreadPoolExecutor(self.workers) as executor:
+            for old_file_path in executor.map(lambda attachable: self.move(attachable, files_paths),
+                                              attachables):
+                if old_file_path is not None:
+                    old_dirs.add(os.path.dirname(old_file_path))
+        self.remove_empty_dirs(old_dirs)
+        logging.info('Resharded {} files of {} in total: {} unchanged, {} missing, {} failed.'
+                     .format(self.moved, self.path, self.unchanged, self.missing, self.failed))
+        return self.moved - moved
+
+    def move(self, attachable: VKFileAttachable, files_paths: Dict[str, List[str]]) -> str:
+        """Moves file of attachable to its new location and returns the old one if file was moved"""
+        file_path = attachable.get_file_path(self.path)
+        candidates = files_paths.get(os.path.basename(file_path), [])
+        if file_path in candidates:
+            with self.lock:
+                self.unchanged += 1
+            return None
+        if not candidates:
+            with self.lock:
+                self.missing += 1
+            return None
+
+        # the same name may occur in different directories, only the first file is moved
+        old_file_path = candidates[0]
+        try:
+            self.directories_cache.ensure(os.path.dirname(file_path))
+            # archive is located on single file system, so renaming is atomic
+            os.replace(old_file_path, file_path)
+        except OSError:
+            logging.exception('Moving of {} to {} failed.'.format(old_file_path, file_path))
+            with self.lock:
+                self.failed += 1
+            return None
+        with self.lock:
+            self.moved += 1
+        return old_file_path
+
+    def remove_empty_dirs(self, dirs: Iterable[str]):
+        """Removes empty directories with their empty parents inside of archive"""
+        root = os.path.normpath(self.path)
+        # the deepest directories go first
+        for directory in sorted(map(os.path.normpath, dirs), key=len, reverse=True):
+            while directory != root and directory.startswith(root + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # directory isn't empty or is already removed
+                    break
+                self.directories_cache.forget(directory)
+                directory = os.path.dirname(directory)
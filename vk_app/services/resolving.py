@@ -0,0 +1,127 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from vk_app.services.executing import MAX_EXECUTE_CALLS_COUNT, execute_calls, get_call_code, is_failed_call
+
+__all__ = ['BulkResolver', 'IdsMethod', 'ResolvingError', 'IDS_METHODS']
+
+
+class ResolvingError(Exception):
+    """Describes why single identifier was not resolved"""
+
+
+def get_raw_vk_id(raw_vk_object: Dict[str, Any]) -> str:
+    return '{owner_id}_{id}'.format(**raw_vk_object)
+
+
+def get_raw_id(raw_vk_object: Dict[str, Any]) -> str:
+    return str(raw_vk_object['id'])
+
+
+class IdsMethod:
+    """API method receiving list of identifiers"""
+
+    def __init__(self, method: str, ids_param: str, max_ids_count: int,
+                 id_getter: Callable[[Dict[str, Any]], str] = get_raw_vk_id):
+        """
+        :param method: name of API method. Ex.: 'photos.getById'
+        :param ids_param: name of parameter with comma-separated identifiers. Ex.: 'photos'
+        :param max_ids_count: maximum number of identifiers for single call
+        :param id_getter: function which returns identifier of raw VK object
+        in requested format (VK ID by default)
+        """
+        self.method = method
+        self.ids_param = ids_param
+        self.max_ids_count = max_ids_count
+        self.id_getter = id_getter
+
+    def __repr__(self):
+        return 'IdsMethod(method={self.method!r}, ' \
+               'ids_param={self.ids_param!r}, ' \
+               'max_ids_count={self.max_ids_count})'.format(self=self)
+
+
+# more info about limits at https://vk.com/dev/`method_name`
+IDS_METHODS = dict((ids_method.method, ids_method) for ids_method in [
+    IdsMethod('photos.getById', 'photos', 100),
+    IdsMethod('wall.getById', 'posts', 100),
+    IdsMethod('video.get', 'videos', 200),
+    IdsMethod('docs.getById', 'docs', 100),
+    IdsMethod('users.get', 'user_ids', 1000, get_raw_id),
+    IdsMethod('groups.getById', 'group_ids', 500, get_raw_id),
+])
+
+
+class BulkResolver:
+    """
+    Resolves many identifiers into raw VK objects with few requests:
+    identifiers are split into chunks of method's limit
+    and up to 25 chunks are requested by single `execute` call
+    """
+
+    def __init__(self, app, method: str, **params):
+        """
+        :param app: `App` instance to send requests with
+        :param method: name of API method from `IDS_METHODS`. Ex.: 'users.get'
+        :param params: other method's parameters. Ex.: {'fields': 'photo_100'}
+        """
+        try:
+            self.ids_method = IDS_METHODS[method]
+        except KeyError:
+            raise ValueError('Unsupported method: {}'.format(method))
+        self.app = app
+        self.params = params
+        self.requests_count = 0
+
+    def __repr__(self):
+        return 'BulkResolver(ids_method={self.ids_method!r}, ' \
+               'requests_count={self.requests_count})'.format(self=self)
+
+    def resolve(self, ids: Iterable[Any]) -> Tuple[Dict[str, Any], Dict[str, ResolvingError]]:
+        """
+        Returns raw VK objects and errors by requested identifiers,
+        every identifier gets into one of them
+
+        :param ids: identifiers in method's format. Ex.: VK IDs like '1_456239017' for 'photos.getById'
+        (so `vk_id` of parsed attachables can be used)
+        """
+        ids = list(OrderedDict.fromkeys(map(str, ids)))
+        chunks = [ids[start:start + self.ids_method.max_ids_count]
+                  for start in range(0, len(ids), self.ids_method.max_ids_count)]
+        raw_objects = dict()
+        errors = dict()
+        for start in range(0, len(chunks), MAX_EXECUTE_CALLS_COUNT):
+            self.resolve_chunks(chunks[start:start + MAX_EXECUTE_CALLS_COUNT], raw_objects, errors)
+        return raw_objects, errors
+
+    def get_call_code(self, chunk: List[str]) -> str:
+        params = dict(self.params)
+        params[self.ids_method.ids_param] = ','.join(chunk)
+        return get_call_code(self.ids_method.method, params)
+
+    def resolve_chunks(self, chunks: List[List[str]],
+                       raw_objects: Dict[str, Any], errors: Dict[str, ResolvingError]):
+        self.requests_count += 1
+        try:
+            responses = execute_calls(self.app, list(map(self.get_call_code, chunks)))
+        except Exception as error:
+            logging.exception('Resolving of {} chunks failed.'.format(len(chunks)))
+            for chunk in chunks:
+                errors.update((chunk_id, ResolvingError(str(error))) for chunk_id in chunk)
+            return
+
+        for chunk, response in zip(chunks, responses):
+            if is_failed_call(response):
+                errors.update((chunk_id, ResolvingError('Call of {} failed.'.format(self.ids_method.method)))
+                              for chunk_id in chunk)
+                continue
+            # some methods (like `video.get`) return countable objects
+            if isinstance(response, dict):
+                response = response['items']
+            for raw_object in response:
+                raw_objects[self.ids_method.id_getter(raw_object)] = raw_object
+            # deleted and inaccessible objects are silently skipped by API
+            errors.update((chunk_id, ResolvingError('Object not found.'))
+                          for chunk_id in chunk
+                          if chunk_id not in raw_objects)
@@ -0,0 +1,114 @@
+import logging
+import random
+import socket
+import time
+from functools import wraps
+from typing import Any, Callable, Iterable, Tuple, Type
+from urllib.error import HTTPError, URLError
+
+__all__ = ['RetryPolicy', 'TRANSIENT_VK_ERRORS_CODES', 'DEFAULT_RETRY_POLICY']
+
+# more info about VK API errors at https://vk.com/dev/errors
+UNKNOWN_ERROR = 1
+TOO_MANY_REQUESTS_PER_SECOND = 6
+FLOOD_CONTROL = 9
+INTERNAL_SERVER_ERROR = 10
+
+TRANSIENT_VK_ERRORS_CODES = frozenset([UNKNOWN_ERROR,
+                                       TOO_MANY_REQUESTS_PER_SECOND,
+                                       FLOOD_CONTROL,
+                                       INTERNAL_SERVER_ERROR])
+
+# network failures of `urllib` and sockets,
+# other `OSError` subclasses (like missing files) won't disappear on retry,
+# `requests` connection failures and timeouts are retried as well
+TRANSIENT_EXCEPTIONS = (ConnectionError, TimeoutError, socket.timeout, URLError)
+
+# client errors except "Too Many Requests" won't disappear on retry
+TOO_MANY_REQUESTS_STATUS = 429
+
+
+def is_transient_status(status_code: int) -> bool:
+    return status_code >= 500 or status_code == TOO_MANY_REQUESTS_STATUS
+
+
+class RetryPolicy:
+    """
+    Retries calls failed with transient VK API errors or network failures
+    with exponential backoff and jitter
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.,
+                 jitter: float = 0.5,
+                 vk_errors_codes: Iterable[int] = TRANSIENT_VK_ERRORS_CODES,
+                 exceptions: Tuple[Type[Exception], ...] = TRANSIENT_EXCEPTIONS):
+        """
+        :param max_attempts: maximum number of attempts per single call
+        :param base_delay: seconds to wait before the second attempt,
+        doubles for every next one
+        :param max_delay: upper bound of seconds to wait between attempts
+        :param jitter: fraction of delay being randomized,
+        prevents simultaneously failed callers from retrying at the same time
+        :param vk_errors_codes: codes of VK API errors to retry on
+        :param exceptions: types of exceptions to retry on
+        """
+        if max_attempts < 1:
+            raise ValueError('Non-positive attempts number: {}'.format(max_attempts))
+        if not 0. <= jitter <= 1.:
+            raise ValueError('Jitter should be in [0, 1] range, but found: {}'.format(jitter))
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.vk_errors_codes = frozenset(vk_errors_codes)
+        self.exceptions = exceptions
+
+    def __repr__(self):
+        return 'RetryPolicy(max_attempts={self.max_attempts}, ' \
+               'base_delay={self.base_delay}, ' \
+               'max_delay={self.max_delay}, ' \
+               'jitter={self.jitter})'.format(self=self)
+
+    def __call__(self, function: Callable[..., Any]) -> Callable[..., Any]:
+        """Decorator for making functions retried according to policy"""
+
+        @wraps(function)
+        def retried(*args, **kwargs):
+            return self.call(function, *args, **kwargs)
+
+        return retried
+
+    def is_retryable(self, error: Exception) -> bool:
+        from vk.exceptions import VkAPIError
+
+        if isinstance(error, VkAPIError):
+            return error.code in self.vk_errors_codes
+        if isinstance(error, HTTPError):
+            return is_transient_status(error.code)
+        import requests
+
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and is_transient_status(error.response.status_code)
+        return isinstance(error, self.exceptions + (requests.ConnectionError, requests.Timeout))
+
+    def get_delay(self, attempt: int) -> float:
+        """Returns seconds to wait after given failed attempt (starting from zero)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * (1. - self.jitter * random.random())
+
+    def call(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        for attempt in range(self.max_attempts):
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if not self.is_retryable(error) or attempt == self.max_attempts - 1:
+                    raise
+                delay = self.get_delay(attempt)
+                logging.warning('Attempt {} of `{}` failed with "{}", retrying in {:.2f} seconds.'
+                                .format(attempt + 1, getattr(function, '__name__', function),
+                                        error, delay))
+                time.sleep(delay)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+__all__ = ['Scheduler', 'ScheduledJob', 'SKIP', 'COALESCE', 'CATCH_UP']
+
+# policies of handling runs missed because of scheduler's or job's delay:
+# missed runs are dropped, late run is launched only if it's late for less than a period
+SKIP = 'skip'
+# missed runs are collapsed into a single run
+COALESCE = 'coalesce'
+# every missed run is launched one after another until schedule is caught up
+CATCH_UP = 'catch_up'
+
+MISSED_RUNS_POLICIES = (SKIP, COALESCE, CATCH_UP)
+
+
+class ScheduledJob:
+    """Periodically launched function with its lateness metrics"""
+
+    def __init__(self, function: Callable[..., Any], period_in_sec: float,
+                 args: tuple, kwargs: dict, missed_runs_policy: str,
+                 jitter_in_sec: float, next_run_time: float):
+        self.function = function
+        self.period_in_sec = period_in_sec
+        self.args = args
+        self.kwargs = kwargs
+        self.missed_runs_policy = missed_runs_policy
+        self.jitter_in_sec = jitter_in_sec
+        self.next_run_time = next_run_time
+        # random delay of the next run, it is not counted as lateness
+        self.jitter = 0.
+        self.cancelled = False
+
+        # metrics
+        self.runs = 0
+        self.missed_runs = 0
+        self.failures = 0
+        self.total_lateness = 0.
+        self.max_lateness = 0.
+
+    def __repr__(self):
+        return 'ScheduledJob(function={name}, ' \
+               'period_in_sec={self.period_in_sec}, ' \
+               'missed_runs_policy={self.missed_runs_policy!r}, ' \
+               'runs={self.runs}, ' \
+               'missed_runs={self.missed_runs}, ' \
+               'mean_lateness={self.mean_lateness:.6f}, ' \
+               'max_lateness={self.max_lateness:.6f})'.format(name=self.function.__name__, self=self)
+
+    @property
+    def mean_lateness(self) -> float:
+        return self.total_lateness / self.runs if self.runs else 0.
+
+    def cancel(self):
+        """Prevents job from further launching, current run is not interrupted"""
+        self.cancelled = True
+
+    @property
+    def dispatch_time(self) -> float:
+        return self.next_run_time + self.jitter
+
+    def run(self):
+        lateness = time.monotonic() - self.dispatch_time
+        self.runs += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        try:
+            self.function(*self.args, **self.kwargs)
+        except Exception:
+            self.failures += 1
+            logging.exception('Scheduled call of `{}` failed.'.format(self.function.__name__))
+
+    def reschedule(self):
+        """Moves `next_run_time` according to missed runs policy"""
+        now = time.monotonic()
+        # number of runs which should have been launched by now
+        missed_runs = int((now - self.next_run_time) // self.period_in_sec)
+        if self.missed_runs_policy == CATCH_UP or missed_runs <= 0:
+            self.next_run_time += self.period_in_sec
+        elif self.missed_runs_policy == COALESCE:
+            # the latest missed run is launched right away and the schedule stays aligned
+            self.missed_runs += missed_runs - 1
+            self.next_run_time += self.period_in_sec * missed_runs
+        else:
+            self.missed_runs += missed_runs
+            self.next_run_time += self.period_in_sec * (missed_runs + 1)
+
+    def is_expired(self) -> bool:
+        """Checks if run became pointless because of lateness"""
+        if self.missed_runs_policy != SKIP:
+            return False
+        return time.monotonic() - self.dispatch_time >= self.period_in_sec
+
+
+class Scheduler:
+    """
+    Launches many periodic jobs with single dispatching thread
+    and pool of worker threads
+
+    jobs are kept in heap ordered by time of next run,
+    each job is never launched concurrently with itself
+    """
+
+    def __init__(self, workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.condition = threading.Condition()
+        self.heap = list()
+        self.counter = itertools.count()
+        self.jobs = list()
+        self.stopped = False
+        self.dispatcher = threading.Thread(target=self.dispatch, name='SchedulerDispatcher', daemon=True)
+
+    def __enter__(self) -> 'Scheduler':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def schedule(self, function: Callable[..., Any], period_in_sec: float, *args,
+                 missed_runs_policy: str = SKIP, jitter_in_sec: float = 0., delay_in_sec: float = 0.,
+                 **kwargs) -> ScheduledJob:
+        """
+        Schedules periodical launching of function
+
+        :param function: function to be launched
+        :param period_in_sec: seconds between consequent runs
+        :param args: positional function arguments
+        :param missed_runs_policy: one of `SKIP`, `COALESCE`, `CATCH_UP`
+        :param jitter_in_sec: upper bound of random delay added to every run,
+        prevents simultaneous runs of jobs with equal periods
+        :param delay_in_sec: seconds before the first run
+        :param kwargs: keyword function arguments
+        :return: job which can be cancelled and inspected for metrics
+        """
+        if period_in_sec <= 0.:
+            raise ValueError('Non-positive period: {}'.format(period_in_sec))
+        if missed_runs_policy not in MISSED_RUNS_POLICIES:
+            raise ValueError('Unknown missed runs policy: {}'.format(missed_runs_policy))
+
+        job = ScheduledJob(function, period_in_sec, args, kwargs,
+                           missed_runs_policy=missed_runs_policy,
+                           jitter_in_sec=jitter_in_sec,
+                           next_run_time=time.monotonic() + delay_in_sec)
+        with self.condition:
+            self.jobs.append(job)
+            self.push(job)
+        return job
+
+    def push(self, job: ScheduledJob):
+        job.jitter = random.uniform(0., job.jitter_in_sec)
+        heapq.heappush(self.heap, (job.dispatch_time, next(self.counter), job))
+        self.condition.notify()
+
+    def start(self):
+        self.dispatcher.start()
+
+    def stop(self, wait: bool = True):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=wait)
+
+    def dispatch(self):
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                dispatch_time, _, job = self.heap[0]
+                wait_sec = dispatch_time - time.monotonic()
+                if wait_sec > 0.:
+                    self.condition.wait(wait_sec)
+                    continue
+                heapq.heappop(self.heap)
+                if job.cancelled:
+                    self.jobs.remove(job)
+                    continue
+                if job.is_expired():
+                    job.reschedule()
+                    self.push(job)
+                    continue
+                self.executor.submit(self.launch, job)
+
+    def launch(self, job: ScheduledJob):
+        job.run()
+        with self.condition:
+            if job.cancelled:
+                self.jobs.remove(job)
+            else:
+                job.reschedule()
+                self.push(job)
+
+    def get_jobs(self) -> List[ScheduledJob]:
+        with self.condition:
+            return [job for job in self.jobs if not job.cancelled]
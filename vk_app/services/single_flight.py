@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+__all__ = ['SingleFlight', 'make_call_key']
+
+
+def normalize_param(value: Any) -> str:
+    # VK API receives lists as comma-separated strings and numbers as strings
+    if isinstance(value, (list, tuple)):
+        return ','.join(map(str, value))
+    return str(value)
+
+
+def make_call_key(method: str, params: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """Returns key of API call which is equal for calls with the same method and parameters"""
+    return method, tuple(sorted((name, normalize_param(value))
+                                for name, value in params.items()))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls:
+    while call with some key is in flight, other callers with the same key
+    wait for it and receive its result (or exception) instead of repeating it
+
+    results are shared, so they should not be mutated by callers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+        self.async_calls = dict()
+        self.executed = 0
+        self.collapsed = 0
+
+    def __repr__(self):
+        return 'SingleFlight(executed={self.executed}, ' \
+               'collapsed={self.collapsed})'.format(self=self)
+
+    def call(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        with self.lock:
+            future = self.calls.get(key)
+            leading = future is None
+            if leading:
+                future = self.calls[key] = Future()
+                self.executed += 1
+            else:
+                self.collapsed += 1
+        if not leading:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    async def call_async(self, key: Hashable, coroutine_function: Callable[..., Awaitable[Any]],
+                         *args, **kwargs) -> Any:
+        """Same as `call` for coroutines, should be used within single event loop"""
+        import asyncio
+
+        with self.lock:
+            task = self.async_calls.get(key)
+            if task is None:
+                task = self.async_calls[key] = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+                task.add_done_callback(lambda _: self.forget_async_call(key))
+                self.executed += 1
+            else:
+                self.collapsed += 1
+        # cancellation of one caller should not cancel the others
+        return await asyncio.shield(task)
+
+    def forget_async_call(self, key: Hashable):
+        with self.lock:
+            self.async_calls.pop(key, None)
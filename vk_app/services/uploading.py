@@ -0,0 +1,321 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from io import BytesIO
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from vk_app.services.retrying import RetryPolicy, DEFAULT_RETRY_POLICY
+from vk_app.utils import load_json
+
+__all__ = ['MultipartBody', 'ChunkedUpload', 'UploadIntegrityError', 'UploadStalled',
+           'DEFAULT_CHUNK_SIZE', 'DEFAULT_UPLOAD_CHUNK_SIZE']
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# upload server answers with this status and ranges of received bytes
+# (like "0-1023/4096") until the last chunk is received
+PARTIAL_UPLOAD_STATUS = 201
+
+# number of consecutive chunks received by upload server
+# without increasing number of received bytes after which upload is considered stalled
+MAX_STALLED_CHUNKS_COUNT = 5
+
+PART_HEADER_FORMAT = '--{boundary}\r\n' \
+                     'Content-Disposition: form-data; name="{field}"; filename="{file_name}"\r\n' \
+                     'Content-Type: {content_type}\r\n\r\n'
+CLOSING_BOUNDARY_FORMAT = '--{boundary}--\r\n'
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+
+class BytesPart:
+    """Part of body held in memory"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def __len__(self):
+        return len(self.content)
+
+    def open(self) -> BinaryIO:
+        return BytesIO(self.content)
+
+    def release(self, file: BinaryIO):
+        file.close()
+
+
+class PathPart:
+    """Part of body read from file located at given path"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self):
+        return self.size
+
+    def open(self) -> BinaryIO:
+        return open(self.path, 'rb', buffering=0)
+
+    def release(self, file: BinaryIO):
+        file.close()
+
+
+class FileObjectPart:
+    """Part of body read from given seekable binary file object starting from its current position"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.start = file.tell()
+        self.size = file.seek(0, os.SEEK_END) - self.start
+        file.seek(self.start)
+
+    def __len__(self):
+        return self.size
+
+    def open(self) -> BinaryIO:
+        self.file.seek(self.start)
+        return self.file
+
+    def release(self, file: BinaryIO):
+        # file object is owned by caller, so it is only rewound
+        file.seek(self.start)
+
+
+def to_part(file: Any) -> Tuple[str, Any]:
+    """
+    Returns file name and body part of file given as
+    path, binary file object or tuple of file name with its content or file object
+    """
+    if isinstance(file, str):
+        return os.path.basename(file), PathPart(file)
+    if isinstance(file, tuple):
+        file_name, content = file
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return file_name, BytesPart(bytes(content))
+        return file_name, FileObjectPart(content)
+    return os.path.basename(getattr(file, 'name', 'file')), FileObjectPart(file)
+
+
+class MultipartBody:
+    """
+    Lazily read `multipart/form-data` body of files upload with known length,
+    files are read from disk chunk by chunk while body is being sent,
+    so memory usage doesn't depend on files' sizes
+
+    can be passed as `data` to `requests` along with `headers` property value
+    """
+
+    def __init__(self, files: List[Tuple[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param files: tuples of form fields names and files given as
+        paths, binary file objects or tuples of files names with their content or file objects
+        :param chunk_size: number of bytes yielded at once by iterating over body
+        """
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts = list()
+        for field, file in files:
+            file_name, part = to_part(file)
+            content_type = mimetypes.guess_type(file_name)[0] or DEFAULT_CONTENT_TYPE
+            header = PART_HEADER_FORMAT.format(boundary=self.boundary, field=field,
+                                               file_name=file_name.replace('"', '%22'),
+                                               content_type=content_type)
+            self.parts.append(BytesPart(header.encode('utf-8')))
+            self.parts.append(part)
+            self.parts.append(BytesPart(b'\r\n'))
+        self.parts.append(BytesPart(CLOSING_BOUNDARY_FORMAT.format(boundary=self.boundary).encode('utf-8')))
+        self.length = sum(map(len, self.parts))
+        self.parts_iterator = None
+        self.current_part = None
+        self.current_file = None
+        self.reset()
+
+    def __repr__(self):
+        return 'MultipartBody(boundary={self.boundary!r}, ' \
+               'length={self.length})'.format(self=self)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self) -> 'MultipartBody':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def headers(self) -> dict:
+        return {'Content-Type': 'multipart/form-data; boundary={}'.format(self.boundary),
+                'Content-Length': str(self.length)}
+
+    def reset(self):
+        """Rewinds body to the beginning, used before sending it again"""
+        self.close()
+        self.parts_iterator = iter(self.parts)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.length
+        chunks = list()
+        while size > 0:
+            file = self.get_current_file()
+            if file is None:
+                break
+            chunk = file.read(size)
+            if not chunk:
+                self.release_current_file()
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def get_current_file(self) -> Optional[BinaryIO]:
+        if self.current_file is None:
+            self.current_part = next(self.parts_iterator, None)
+            if self.current_part is None:
+                return None
+            self.current_file = self.current_part.open()
+        return self.current_file
+
+    def release_current_file(self):
+        self.current_part.release(self.current_file)
+        self.current_part = None
+        self.current_file = None
+
+    def close(self):
+        """Closes file opened for reading, body can be read again after `reset`"""
+        if self.current_file is not None:
+            self.release_current_file()
+
+
+class UploadIntegrityError(Exception):
+    """Raised when uploaded file differs from the one received by upload server"""
+
+
+class UploadStalled(Exception):
+    """Raised when upload server keeps receiving chunks without receiving more bytes"""
+
+
+def get_file_md5(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_received_size(ranges: str) -> int:
+    """Returns number of leading bytes received by upload server according to its answer. Ex.: '0-1023/4096'"""
+    received_size = 0
+    for byte_range in ranges.strip().split('/')[0].split(','):
+        start, end = map(int, byte_range.split('-'))
+        if start > received_size:
+            break
+        received_size = max(received_size, end + 1)
+    return received_size
+
+
+class ChunkedUpload:
+    """
+    Uploads large file (like video for `video.save` upload URL) by chunks
+    with `Content-Range` and `Session-ID` headers, so only failed chunk is retried
+    and interrupted upload can be continued from the last received chunk
+    by creating upload with the same `session_id` and `offset`
+
+    only single chunk is kept in memory
+    """
+
+    def __init__(self, upload_url: str, file_path: str, chunk_size: int = DEFAULT_UPLOAD_CHUNK_SIZE,
+                 session_id: str = None, offset: int = 0):
+        """
+        :param upload_url: upload server URL. Ex.: `upload_url` field of `video.save` response
+        :param file_path: path of file to upload
+        :param chunk_size: number of bytes sent by single request
+        :param session_id: identifier of interrupted upload to continue, new one is generated by default
+        :param offset: number of bytes already received by upload server
+        """
+        self.upload_url = upload_url
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.session_id = session_id or uuid.uuid4().hex
+        self.offset = offset
+        self.size = os.path.getsize(file_path)
+        if not self.size:
+            # there is no valid `Content-Range` for empty chunk
+            raise ValueError('Empty file can\'t be uploaded: {}'.format(file_path))
+
+    def __repr__(self):
+        return 'ChunkedUpload(file_path={self.file_path!r}, ' \
+               'session_id={self.session_id!r}, ' \
+               'offset={self.offset}, ' \
+               'size={self.size})'.format(self=self)
+
+    def run(self, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+            progress: Callable[[int, int], Any] = None) -> Dict[str, Any]:
+        """
+        Sends remaining chunks, verifies upload and returns upload server response
+
+        :param retry_policy: policy of retrying chunks failed with transient errors
+        :param progress: function which receives numbers of uploaded and total bytes after every chunk
+        """
+        import requests
+
+        response = None
+        stalled_chunks_count = 0
+        with requests.Session() as session, open(self.file_path, 'rb') as file:
+            while response is None:
+                offset = self.offset
+                file.seek(offset)
+                chunk = file.read(self.chunk_size)
+                response = retry_policy.call(self.send_chunk, session, chunk)
+                if progress is not None:
+                    progress(self.offset, self.size)
+                if response is None and self.offset <= offset:
+                    stalled_chunks_count += 1
+                    if stalled_chunks_count >= MAX_STALLED_CHUNKS_COUNT:
+                        raise UploadStalled('Upload server received {} bytes of {} and stopped receiving more '
+                                            'after {} chunks.'.format(self.offset, self.file_path,
+                                                                      stalled_chunks_count))
+                else:
+                    stalled_chunks_count = 0
+        self.verify(response)
+        return response
+
+    def send_chunk(self, session, chunk: bytes) -> Optional[Dict[str, Any]]:
+        """Sends chunk starting from current offset and returns upload server response after the last one"""
+        end = self.offset + len(chunk) - 1
+        headers = {'Content-Type': 'application/x-binary',
+                   'Content-Disposition': 'attachment; filename="{}"'.format(
+                       os.path.basename(self.file_path).replace('"', '%22')),
+                   'Content-Range': 'bytes {}-{}/{}'.format(self.offset, end, self.size),
+                   'Session-ID': self.session_id}
+        response = session.post(self.upload_url, data=chunk, headers=headers)
+        response.raise_for_status()
+        if response.status_code == PARTIAL_UPLOAD_STATUS:
+            # server may have received more (resumed upload) or less (lost chunk) than was sent
+            self.offset = get_received_size(response.content.decode('ascii'))
+            logging.debug('Uploaded {} of {} bytes of {}.'.format(self.offset, self.size, self.file_path))
+            return None
+        self.offset = self.size
+        return load_json(response.content)
+
+    def verify(self, response: Dict[str, Any]):
+        """Compares file with size and MD5 checksum reported by upload server if any"""
+        size = response.get('size')
+        if size is not None and int(size) != self.size:
+            raise UploadIntegrityError('Upload server received {} bytes of {}, but file has {}.'
+                                       .format(size, self.file_path, self.size))
+        md5 = response.get('md5')
+        if md5 is not None and md5.lower() != get_file_md5(self.file_path):
+            raise UploadIntegrityError('Checksum of {} received by upload server differs.'
+                                       .format(self.file_path))
@@ -1,47 +1,113 @@
 import datetime
 import inspect
+import json
 import logging
-import logging.config
 import os
 import re
 import threading
 import time
 from collections import OrderedDict
-from functools import wraps
-from typing import Callable, List, Any
+from collections.abc import Mapping
+from functools import lru_cache, wraps
+from typing import Any, Callable, Dict, List, Union
 
-from PIL import Image
-from sqlalchemy import (Boolean, Column, DateTime, Integer,
-                        LargeBinary, String, Interval, Time)
 
-__all__ = ['make_periodic', 'make_delayed', 'get_year_month_date',
+__all__ = ['make_periodic', 'make_delayed', 'RateLimiter', 'get_year_month_date',
            'get_normalized_file_name', 'find_file',
            'set_logging_config', 'solve_captcha', 'check_dir',
+           'DirectoriesCache', 'DIRECTORIES_CACHE',
            'get_valid_dirs', 'map_non_primary_columns_by_ancestor',
-           'get_all_subclasses', 'get_repr', 'obj_to_dict']
+           'get_all_subclasses', 'get_repr', 'obj_to_dict',
+           'dump_json', 'load_json', 'JSON_BACKEND']
 
-PYTHON_SQLALCHEMY_TYPES = {
-    bool: Boolean,
-    bytes: LargeBinary,
-    datetime.datetime: DateTime,
-    datetime.timedelta: Interval,
-    datetime.time: Time,
-    int: Integer,
-    str: String(255),
-}
+# fast JSON libraries are used if installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+
+    def dump_json(obj: Any) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+
+    def load_json(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+elif ujson is not None:
+    JSON_BACKEND = 'ujson'
+
+    def dump_json(obj: Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=False)
+
+    def load_json(data: Union[bytes, str]) -> Any:
+        return ujson.loads(data)
+else:
+    JSON_BACKEND = 'json'
+
+    def dump_json(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    def load_json(data: Union[bytes, str]) -> Any:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+@lru_cache(maxsize=None)
+def get_python_sqlalchemy_types() -> Dict[type, Any]:
+    from sqlalchemy import (Boolean, DateTime, Integer,
+                            LargeBinary, String, Interval, Time)
+
+    return {
+        bool: Boolean,
+        bytes: LargeBinary,
+        datetime.datetime: DateTime,
+        datetime.timedelta: Interval,
+        datetime.time: Time,
+        int: Integer,
+        str: String(255),
+    }
+
+
+class LazyMapping(Mapping):
+    """Read-only mapping built by given function on first access"""
+
+    def __init__(self, get_mapping: Callable[[], Dict[Any, Any]]):
+        self.get_mapping = get_mapping
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get_mapping()[key]
+
+    def __iter__(self):
+        return iter(self.get_mapping())
+
+    def __len__(self) -> int:
+        return len(self.get_mapping())
+
+
+# kept for backward compatibility, SQLAlchemy is imported on first access
+PYTHON_SQLALCHEMY_TYPES = LazyMapping(get_python_sqlalchemy_types)
 
 
 def map_non_primary_columns_by_ancestor(inheritor: type, ancestor: type):
     if issubclass(inheritor, ancestor):
+        from sqlalchemy import Column
+
+        python_sqlalchemy_types = get_python_sqlalchemy_types()
         ancestor_initializer_signature = inspect.signature(ancestor.__init__)
         names_parameters = ancestor_initializer_signature.parameters
         non_self_parameters = list(names_parameters.values())[1:]
         for parameter in non_self_parameters:
-            if parameter.annotation in PYTHON_SQLALCHEMY_TYPES:
+            if parameter.annotation in python_sqlalchemy_types:
                 setattr(
                     inheritor, parameter.name,
                     Column(
-                        PYTHON_SQLALCHEMY_TYPES[parameter.annotation],
+                        python_sqlalchemy_types[parameter.annotation],
                         nullable=parameter.default is None
                     )
                 )
@@ -61,35 +127,36 @@ VoidFunction = Callable[..., None]
 
 
 def make_periodic(period_in_sec: float) -> Callable[[VoidFunction], VoidFunction]:
-    """Decorator with parameter for making functions periodically launched"""
+    """
+    Decorator with parameter for making functions periodically launched
+    in the calling thread, for launching many functions see `vk_app.services.Scheduler`
+    """
 
     if period_in_sec <= 0.:
         raise ValueError('Non-positive period: {}'.format(period_in_sec))
 
-    class CallRepeater:
-        def __init__(self):
-            self.call_event = threading.Event()
-            self.last_call_time = time.time()
-
-        def launch_periodically(self, function: VoidFunction) -> VoidFunction:
-            @wraps(function)
-            def launched_periodically(*args, **kwargs):
-                while not self.call_event.wait(self.last_call_time - time.time()):
-                    function(*args, **kwargs)
-                    self.last_call_time += period_in_sec
-                    logging.debug(
-                        'Next call of `{}` will be at {}'.format(
-                            function.__name__,
-                            datetime.datetime.fromtimestamp(self.last_call_time)
-                            .isoformat(' ')
-                        )
+    def launch_periodically(function: VoidFunction) -> VoidFunction:
+        @wraps(function)
+        def launched_periodically(*args, **kwargs):
+            # every launch has its own schedule
+            call_event = threading.Event()
+            next_call_time = time.time()
+            while not call_event.wait(next_call_time - time.time()):
+                function(*args, **kwargs)
+                # skipping calls missed because of long-running function instead of drifting
+                missed_calls = max(int((time.time() - next_call_time) // period_in_sec), 0)
+                next_call_time += period_in_sec * (missed_calls + 1)
+                logging.debug(
+                    'Next call of `{}` will be at {}'.format(
+                        function.__name__,
+                        datetime.datetime.fromtimestamp(next_call_time)
+                        .isoformat(' ')
                     )
+                )
 
-            return launched_periodically
-
-    call_repeater = CallRepeater()
+        return launched_periodically
 
-    return call_repeater.launch_periodically
+    return launch_periodically
 
 
 def make_delayed(delay_in_seconds: float) -> Callable[[AnyFunction], AnyFunction]:
@@ -98,30 +165,41 @@ def make_delayed(delay_in_seconds: float) -> Callable[[AnyFunction], AnyFunction
     if delay_in_seconds <= 0.:
         raise ValueError('Non-positive delay: {}'.format(delay_in_seconds))
 
-    class CallDelayer:
-        def __init__(self):
-            self.call_event = threading.Event()
-            self.last_call_time = time.time()
-
-        def launch_with_delay(self, function: AnyFunction) -> AnyFunction:
-            @wraps(function)
-            def launched_with_delay(*args, **kwargs):
-                self.last_call_time += delay_in_seconds
-                res = function(*args, **kwargs)
-                wait_sec = self.last_call_time - time.time()
-                logging.debug(
-                    'Next call of `{}` will be available at {}'.format(
-                        function.__name__,
-                        datetime.datetime.fromtimestamp(self.last_call_time).isoformat(' ')
-                    )
-                )
-                self.call_event.wait(wait_sec)
-                return res
+    # limiter is shared by all functions decorated with the same decorator
+    # and is safe to use from multiple threads
+    rate_limiter = RateLimiter(1. / delay_in_seconds)
+
+    def launch_with_delay(function: AnyFunction) -> AnyFunction:
+        @wraps(function)
+        def launched_with_delay(*args, **kwargs):
+            rate_limiter.acquire()
+            return function(*args, **kwargs)
+
+        return launched_with_delay
+
+    return launch_with_delay
+
 
-            return launched_with_delay
+class RateLimiter:
+    """Thread-safe limiter of calls rate which can be shared between consumers"""
 
-    call_delayer = CallDelayer()
-    return call_delayer.launch_with_delay
+    def __init__(self, calls_per_second: float):
+        if calls_per_second <= 0.:
+            raise ValueError('Non-positive calls rate: {}'.format(calls_per_second))
+
+        self.delay_in_seconds = 1. / calls_per_second
+        self.lock = threading.Lock()
+        self.next_call_time = time.monotonic()
+
+    def acquire(self):
+        """Blocks until next call is available"""
+        with self.lock:
+            now = time.monotonic()
+            call_time = max(self.next_call_time, now)
+            self.next_call_time = call_time + self.delay_in_seconds
+        wait_sec = call_time - now
+        if wait_sec > 0.:
+            time.sleep(wait_sec)
 
 
 def get_year_month_date(date_time: datetime.datetime, sep='.') -> str:
@@ -142,6 +220,8 @@ MAX_FILE_NAME_LEN = os.pathconf(os.getcwd(), 'PC_NAME_MAX')
 
 def set_logging_config(base_dir: str, logging_config_path: str, logs_path: str,
                        disable_existing_loggers=True):
+    import logging.config
+
     logs_dir = os.path.dirname(logs_path)
     check_dir(base_dir, logs_dir, create=True)
     abs_log_config_path = os.path.join(base_dir, logging_config_path)
@@ -174,6 +254,83 @@ def check_dir(root: str, *subs, create=False):
                 raise ValueError(err_message)
 
 
+class DirectoriesCache:
+    """
+    Thread-safe set of directories known to exist:
+    missing directory is created with single `os.makedirs` call
+    and is not checked anymore after that
+
+    directories removed by others should be forgotten explicitly,
+    writing with `write` recovers from such removal by itself
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories = set()
+
+    def __contains__(self, path: str):
+        return os.path.normpath(path) in self.directories
+
+    def __len__(self):
+        return len(self.directories)
+
+    def ensure(self, path: str):
+        path = os.path.normpath(path)
+        if path in self.directories:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            # parents exist too
+            while path not in self.directories:
+                self.directories.add(path)
+                parent = os.path.dirname(path)
+                if not parent or parent == path:
+                    break
+                path = parent
+
+    def write(self, file_path: str, write: Callable[[str], Any]):
+        """
+        Ensures file's directory and writes file with given function,
+        if file is not written because directory was removed by others
+        directory is forgotten, created again and writing is repeated once
+
+        :param file_path: path of file to be written
+        :param write: function which receives file path and writes file at it,
+        it may raise `FileNotFoundError` or swallow errors leaving file missing,
+        returns truthy value if file is known to be in place, so it is not checked again
+        """
+        file_dir = os.path.dirname(file_path)
+        self.ensure(file_dir)
+        try:
+            if write(file_path):
+                return
+        except FileNotFoundError:
+            if os.path.isdir(file_dir):
+                raise
+        else:
+            if os.path.exists(file_path) or os.path.isdir(file_dir):
+                return
+        logging.warning('Directory {} was removed, creating it again.'.format(file_dir))
+        self.forget(file_dir)
+        self.ensure(file_dir)
+        write(file_path)
+
+    def forget(self, path: str = None):
+        """Forgets given directory with its subdirectories or all directories by default"""
+        with self.lock:
+            if path is None:
+                self.directories.clear()
+                return
+            path = os.path.normpath(path)
+            prefix = os.path.join(path, '')
+            self.directories = set(directory
+                                   for directory in self.directories
+                                   if directory != path and not directory.startswith(prefix))
+
+
+DIRECTORIES_CACHE = DirectoriesCache()
+
+
 def get_valid_dirs(*dirs) -> List[str]:
     valid_dirs = filter(None, dirs)
     valid_dirs = list(valid_dirs)
@@ -192,10 +349,12 @@ def solve_captcha(path: str):
         if not CAPTCHA_RE.match(captcha_key):
             logging.info('Incorrect captcha format, repeat input.')
         else:
-            break
+            return captcha_key
 
 
 def show_captcha(path: str):
+    from PIL import Image
+
     with Image.open(path) as img:
         size = tuple([4 * x for x in img.size])
         img = img.resize(size)